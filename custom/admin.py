@@ -1,11 +1,10 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.contenttypes.admin import GenericTabularInline, GenericStackedInline
 from django.contrib.admin.options import IS_POPUP_VAR
 from django.utils.translation import gettext, gettext_lazy as _
 
-from django.db.models import Q
 from datetime import date
 
 from jet.admin import CompactInline
@@ -13,6 +12,9 @@ from django_object_actions import DjangoObjectActions
 
 from main.models import *
 from main.forms import *
+from main.scheduling import PERSONS, RESOURCES, busy_slots
+from main.dispatch import auto_assign
+from main.roles import ADMIN, OPERATOR, SUPERUSER, get_roles
 from .base import BaseAdminSite
 from .model_admin import BaseModelAdmin
 
@@ -34,22 +36,19 @@ class BaseUserAdmin(UserAdmin):
 
     def get_readonly_fields(self, request, obj=None):
 
-        if obj is None or request.user.is_superuser:
+        roles = get_roles(request)
+        if obj is None or roles.is_superuser:
             return ()
-        elif request.user.staff.is_admin:
+        elif roles.is_admin:
             return ('username', 'is_superuser')
 
         return self.readonly_fields
 
     def has_add_permission(self, request):
-        if request.user.is_superuser or request.user.staff.is_admin:
-            return True
-        return False
+        return get_roles(request).is_staff_admin
 
     def has_delete_permission(self, request, obj=None):
-        if request.user.is_superuser or request.user.staff.is_admin:
-            return True
-        return False
+        return get_roles(request).is_staff_admin
 
 
 class PermissionAdmin(BaseModelAdmin):
@@ -58,19 +57,15 @@ class PermissionAdmin(BaseModelAdmin):
     def get_readonly_fields(self, request, obj=None):
         if obj is None:
             return ()
-        elif request.user.is_superuser or request.user.staff.is_admin:
+        elif get_roles(request).is_staff_admin:
             return ()
         return [f.name for f in self.model._meta.fields] + self.readonly_fields
 
     def has_add_permission(self, request):
-        if request.user.is_superuser or request.user.staff.is_admin:
-            return True
-        return False
+        return get_roles(request).is_staff_admin
 
     def has_delete_permission(self, request, obj=None):
-        if request.user.is_superuser or request.user.staff.is_admin:
-            return True
-        return False
+        return get_roles(request).is_staff_admin
 
 
 @admin.register(PPI, DLI, TLI, site=site)
@@ -105,6 +100,8 @@ class TaskInline(CompactInline):
 @admin.register(Staff, site=site)
 class StaffAdmin(BaseUserAdmin, PermissionAdmin):
 
+    high_volume = True
+
     add_form = StaffCreationForm
 
     inlines = [
@@ -248,18 +245,16 @@ class StaffAdmin(BaseUserAdmin, PermissionAdmin):
                     start_time, end_time = end_time, start_time
 
                 if request.GET.get('is_driver') or request.GET.get('is_tourguide'):
-                    qs = Staff.objects.exclude(
-                        Q(driver_task__start_time__range=(start_time, end_time))
-                        | Q(driver_task__end_time__range=(start_time, end_time))
-                        | Q(tourguide_task__start_time__range=(start_time, end_time))
-                        | Q(tourguide_task__end_time__range=(start_time, end_time)))
+                    qs = Staff.objects.exclude(pk__in=busy_slots(
+                        PERSONS, start_time, end_time).values('resource_id'))
 
                     return qs
 
-        if request.user.is_superuser or request.user.staff.is_admin:
+        roles = get_roles(request)
+        if roles.is_staff_admin:
             return qs
 
-        return qs.filter(id=request.user.staff.id)
+        return qs.filter(id=roles.staff_id)
 
     def get_formsets_with_inlines(self, request, obj=None):
         for inline in self.get_inline_instances(request, obj):
@@ -281,6 +276,8 @@ class StaffAdmin(BaseUserAdmin, PermissionAdmin):
 @admin.register(Vehicle, site=site)
 class VehicleAdmin(PermissionAdmin):
 
+    high_volume = True
+
     inlines = [
         ImageInline,
     ]
@@ -370,9 +367,8 @@ class VehicleAdmin(PermissionAdmin):
                 if start_time > end_time:
                     start_time, end_time = end_time, start_time
 
-                qs = Vehicle.objects.exclude(
-                    Q(vehicle_task__start_time__range=(start_time, end_time))
-                    | Q(vehicle_task__end_time__range=(start_time, end_time)))
+                qs = Vehicle.objects.exclude(pk__in=busy_slots(
+                    ['vehicle'], start_time, end_time).values('resource_id'))
                 return qs
         return qs
 
@@ -380,6 +376,8 @@ class VehicleAdmin(PermissionAdmin):
 @admin.register(Task, site=site)
 class TaskAdmin(PermissionAdmin):
 
+    high_volume = True
+
     form = TaskForm
 
     class Media:
@@ -462,26 +460,41 @@ class TaskAdmin(PermissionAdmin):
         'author__full_name'
     ]
 
+    actions = [
+        'auto_assign'
+    ]
+
     def has_add_permission(self, request):
-        if request.user.is_superuser or request.user.staff.is_admin or request.user.staff.is_operator:
-            return True
-        return False
+        return get_roles(request).has(SUPERUSER | ADMIN | OPERATOR)
+
+    def auto_assign(self, request, queryset):
+        result = auto_assign(queryset, resources=RESOURCES)
+
+        self.message_user(request, '%d vehicles, %d drivers and %d tour guides assigned to %d tasks in %.2fs' % (
+            result['assigned']['vehicle'], result['assigned']['driver'],
+            result['assigned']['tourguide'], result['tasks'], result['seconds']))
+        if result['unassigned']:
+            self.message_user(request, 'No free resources left for %d tasks' % len(
+                result['unassigned']), level=messages.WARNING)
+    auto_assign.short_description = 'Assign free vehicles, drivers and tour guides'
 
     def get_readonly_fields(self, request, obj=None):
-        if request.user.is_superuser:
+        roles = get_roles(request)
+        if roles.is_superuser:
             return ()
-        if request.user.staff.is_admin:
+        if roles.is_admin:
             return ('author')
-        if obj is None or obj.author == request.user.staff:
+        if obj is None or obj.author_id == roles.staff_id:
             return ('author')
-        if request.user.staff in obj.operator.all():
+        if roles.operates(obj):
             return ('author', 'operator')
 
         return [f.name for f in self.model._meta.fields] + ['operator']
 
     def save_model(self, request, obj, form, change):
-        if not obj.author and not request.user.is_superuser:
-            obj.author = request.user.staff
+        roles = get_roles(request)
+        if not obj.author_id and not roles.is_superuser:
+            obj.author_id = roles.staff_id
         super().save_model(request, obj, form, change)
 
 
@@ -514,7 +527,7 @@ class SettingAdmin(DjangoObjectActions, PermissionAdmin):
 
     def change_code(self, request, obj):
         from django.utils.crypto import get_random_string
-        if request.user.is_superuser or request.user.staff.is_admin:
+        if get_roles(request).is_staff_admin:
             obj.verifycode = get_random_string(length=4)
             obj.save()
 
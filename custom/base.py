@@ -8,16 +8,16 @@ from django.contrib.admin.sites import AdminSite
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
-from django.shortcuts import render, redirect, HttpResponse
+from django.shortcuts import render, redirect
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.cache import never_cache
 from django.utils.decorators import method_decorator
-from django.core import serializers
 
 import json
 
 from .forms import TaskForm
-from main.models import *
 from main.forms import StaffCreationForm
+from main.scheduling import availability
 
 
 class BaseAdminSite(AdminSite):
@@ -26,8 +26,7 @@ class BaseAdminSite(AdminSite):
         urlpatterns = [
             path('signup/', self.signup, name='signup'),
 
-            path('resource/', self.resource, name='resource'),
-            path('vehicle/', self.vehicle, name='vehicle'),
+            path('availability/', self.availability, name='availability'),
 
             url(r'^reset/$', auth_views.PasswordResetView.as_view(
                 template_name='admin/password_reset.html',
@@ -69,32 +68,25 @@ class BaseAdminSite(AdminSite):
         return render(request, 'admin/signup.html', {'form': form})
 
     @method_decorator(staff_member_required)
-    def resource(self, request):
-        task = TaskForm(request.POST)
-
-        if task.is_valid():
-            driver = Staff.objects.filter(
-                is_driver=True, is_active=True, status='Enabled')
-            tourguide = Staff.objects.filter(
-                is_tourguide=True, is_active=True, status='Enabled')
-            vehicle = Vehicle.objects.filter(status='Enabled')
-
-            context = {'driver': serializers.serialize('json', driver), 'tourguide': serializers.serialize(
-                'json', tourguide), 'vehicle': serializers.serialize('json', vehicle)}
-            return HttpResponse(json.dumps(context), content_type='application/json')
-            # return HttpResponse(serializers.serialize('json', driver), content_type='application/json')
-        else:
-            return HttpResponse(task.errors, content_type='application/json')
+    def availability(self, request):
+        form = TaskForm(request.GET)
 
-    @method_decorator(staff_member_required)
-    def vehicle(self, request):
-        start_time = request.GET.get('start_time')
-        end_time = request.GET.get('end_time')
+        if not form.is_valid():
+            return JsonResponse(form.errors, status=400)
+
+        resources = availability(
+            form.cleaned_data['start_time'],
+            form.cleaned_data['end_time'],
+            exclude=form.cleaned_data['task'])
 
-        vehicle = Vehicle.objects.filter(status='Enabled')
+        def stream():
+            # {"driver": [[pk, label], ...], "tourguide": [...], "vehicle": [...]}
+            yield '{'
+            for i, (name, rows) in enumerate(sorted(resources.items())):
+                yield '%s"%s":%s' % (',' if i else '', name, json.dumps(list(rows)))
+            yield '}'
 
-        data = serializers.serialize('json', vehicle)
-        return HttpResponse(data, content_type='application/json')
+        return StreamingHttpResponse(stream(), content_type='application/json')
 
 
 admin.site.unregister(User)
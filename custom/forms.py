@@ -6,4 +6,16 @@ from main.models import Staff,Task
 
 class TaskForm(forms.Form):
     start_time = forms.DateTimeField()
-    end_time = forms.DateTimeField()    
+    end_time = forms.DateTimeField()
+    # the task being changed, its own bookings are left out
+    task = forms.IntegerField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_time = cleaned_data.get('start_time')
+        end_time = cleaned_data.get('end_time')
+
+        if start_time and end_time and start_time > end_time:
+            raise forms.ValidationError('the end time must be after start time')
+
+        return cleaned_data
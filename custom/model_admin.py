@@ -1,5 +1,111 @@
+import hashlib
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
 from django.contrib.admin.views.main import ChangeList
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils import timezone
+
+
+def estimated_rows(model, using):
+    """
+    The row count of the table of ``model`` from the statistics of the
+    database, None where there are none or it is too small to bother.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [connection.ops.quote_name(table)])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+
+    if row is None or row[0] is None or row[0] < settings.ADMIN_HIGH_VOLUME['ESTIMATE_OVER']:
+        return None
+    return int(row[0])
+
+
+class ChangeListQuerySet(QuerySet):
+    """
+    What a high volume changelist shows: its count and the dates of its
+    ``date_hierarchy`` cached for ``ADMIN_HIGH_VOLUME['CACHE_TIMEOUT']``
+    seconds, and the count of a whole large table estimated. The count
+    is only displayed, pages are read without it.
+    """
+
+    def cache_key(self, *parts):
+        sql, params = self.query.get_compiler(using=self.db).as_sql()
+        digest = hashlib.md5(('%s|%s|%s' % (sql, params, parts)).encode('utf-8')).hexdigest()
+        return 'changelist:%s:%s' % (self.model._meta.label_lower, digest)
+
+    def cached(self, compute, *parts):
+        try:
+            key = self.cache_key(*parts)
+        except EmptyResultSet:
+            return compute()
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value, settings.ADMIN_HIGH_VOLUME['CACHE_TIMEOUT'])
+        return value
+
+    def count(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+
+        def count():
+            estimate = None if self.query.where else estimated_rows(self.model, self.db)
+            return super(ChangeListQuerySet, self).count() if estimate is None else estimate
+        return self.cached(count, 'count')
+
+    def aggregate(self, *args, **kwargs):
+        # the Min and Max that pick the first date_hierarchy level
+        return self.cached(lambda: super(ChangeListQuerySet, self).aggregate(*args, **kwargs),
+                           'aggregate', args, sorted(kwargs.items()))
+
+    def dates(self, field_name, kind, order='ASC'):
+        return self.cached(lambda: list(super(ChangeListQuerySet, self).dates(field_name, kind, order)),
+                           'dates', field_name, kind, order)
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        return self.cached(
+            lambda: list(super(ChangeListQuerySet, self).datetimes(field_name, kind, order, tzinfo)),
+            'datetimes', field_name, kind, order, tzinfo)
+
+
+class ChangeListPaginator(Paginator):
+    """
+    The page links of a high volume changelist, from a count that may be
+    stale or estimated but never below the rows ``least`` known to be
+    there.
+    """
+
+    def __init__(self, object_list, per_page, count, least):
+        super().__init__(object_list, per_page)
+        self.count = max(count, least)
+
+
+def related_in_list_display(model, list_display):
+    # the foreign keys among the columns, to join in one query
+    names = []
+    for name in list_display:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if field.many_to_one or field.one_to_one:
+            names.append(name)
+    return names
 
 
 class BaseChangeList(ChangeList):
@@ -25,11 +131,67 @@ class BaseChangeList(ChangeList):
 
         return filter_specs, has_filters, lookup_params, use_distinct
 
+    def get_results(self, request):
+        if not self.model_admin.high_volume:
+            return super().get_results(request)
+
+        # only the rows shown, admin actions still get plain querysets
+        queryset = ChangeListQuerySet(
+            model=self.model, query=self.queryset.query.chain(), using=self.queryset.db)
+        queryset._prefetch_related_lookups = self.queryset._prefetch_related_lookups
+        self.queryset = queryset
+
+        result_count = queryset.count()
+        self.can_show_all = result_count <= self.list_max_show_all
+        if self.show_all and self.can_show_all:
+            offset, limit = 0, self.list_max_show_all
+        else:
+            offset, limit = self.page_num * self.list_per_page, self.list_per_page
+
+        # one row more than shown tells whether another page follows,
+        # whatever the count says
+        rows = list(queryset[offset:offset + limit + 1])
+        if not rows and self.page_num:
+            raise IncorrectLookupParameters
+        more = len(rows) > limit
+        # a queryset still, for the list_editable formset
+        self.result_list = queryset[offset:offset + limit]
+        self.result_list._result_cache = rows[:limit]
+        self.result_list._prefetch_done = True
+
+        least = offset + len(rows)
+        self.result_count = max(result_count, least)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.multi_page = bool(offset) or more
+        self.paginator = ChangeListPaginator(queryset, self.list_per_page, result_count, least)
+
+        # one clock for every row, see Task.time_in
+        self.now = timezone.now()
+        for result in self.result_list:
+            result.changelist_now = self.now
+
 
 class BaseModelAdmin(admin.ModelAdmin):
 
     other_list_filter = []
 
+    # for changelists of many rows: the foreign keys of list_display
+    # joined, counts estimated and dates cached, see ChangeListQuerySet
+    high_volume = False
+
+    def __init__(self, model, admin_site):
+        super().__init__(model, admin_site)
+        if self.high_volume:
+            # a second count, of the whole table
+            self.show_full_result_count = False
+
+    def get_list_select_related(self, request):
+        if self.high_volume and self.list_select_related is False:
+            return related_in_list_display(self.model, self.get_list_display(request))
+        return super().get_list_select_related(request)
+
     def lookup_allowed(self, lookup, value):
         if lookup in self.other_list_filter:
             return True
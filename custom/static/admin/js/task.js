@@ -25,8 +25,8 @@
         }
 
         $.ajaxSetup({
-            url: "/admin/resource/",
-            type: 'POST', //GET
+            url: "/admin/availability/",
+            type: 'GET',
             async: false,
             // timeout:5000,
             dataType: 'json',
@@ -74,45 +74,47 @@
             return true;
         }
 
+        function getTask() {
+            // the task being changed, so its own bookings do not count; none when adding
+            var match = window.location.pathname.match(/\/(\d+)\/change\/$/);
+            return match ? match[1] : '';
+        }
+
         function reset(id) {
             $(id).html('---------')
             $(id).attr('title', '---------')
         }
 
+        function options(rows) {
+            // labels are user data, set as text and never parsed as HTML
+            var content = [$('<option value selected>').text('---------')];
+
+            $.each(rows, function(i, row) {
+                content.push($('<option>').val(row[0]).text(row[1]));
+            });
+            return content;
+        }
+
         function getData() {
             // getData.loading = layer.load()
             $.ajax({
                 data: {
                     'start_time': getStartTime(),
                     'end_time': getEndTime(),
+                    'task': getTask(),
                 },
                 success: function(data) {
-                    var driver = $.parseJSON(data.driver);
-                    var driver_content = '<option value selected>---------</option>';
-                    var tourguide = $.parseJSON(data.tourguide);
-                    var tourguide_content = '<option value selected>---------</option>';
-                    var vehicle = $.parseJSON(data.vehicle);
-                    var vehicle_content = '<option value selected>---------</option>';
-
-                    $.each(driver, function(i, item) {
-                        driver_content += '<option value=' + item.pk + '>' + item.fields.phone + '</option>'
-                    });
-
-                    $.each(tourguide, function(i, item) {
-                        tourguide_content += '<option value=' + item.pk + '>' + item.fields.phone + '</option>'
-                    });
-
-                    $.each(vehicle, function(i, item) {
-                        vehicle_content += '<option value=' + item.pk + '>' + item.fields.traffic_plate_no + '</option>'
-                    });
+                    var driver_content = options(data.driver);
+                    var tourguide_content = options(data.tourguide);
+                    var vehicle_content = options(data.vehicle);
 
                     reset('#select2-id_driver-container')
                     reset('#select2-id_tourguide-container')
                     reset('#select2-id_vehicle-container')
 
-                    $('#id_driver').html(driver_content);
-                    $('#id_tourguide').html(driver_content);
-                    $('#id_vehicle').html(vehicle_content);
+                    $('#id_driver').empty().append(driver_content);
+                    $('#id_tourguide').empty().append(tourguide_content);
+                    $('#id_vehicle').empty().append(vehicle_content);
 
                     // layer.close(getData.loading);
                 },
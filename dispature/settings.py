@@ -68,11 +68,29 @@ OAUTH2_PROVIDER = {
     'SCOPES': {'read': 'Read scope', 'write': 'Write scope', 'groups': 'Access to your groups'}
 }
 
+# validated access tokens kept by each worker (main.authentication); the
+# timeout bounds how long permission changes take to show
+OAUTH2_TOKEN_CACHE = {
+    'SIZE': config('OAUTH2_TOKEN_CACHE_SIZE', default=10000, cast=int),
+    'TIMEOUT': config('OAUTH2_TOKEN_CACHE_TIMEOUT', default=300, cast=int),
+}
+
+# Authorization: Signed <token> from /auth/token/ (main.authentication);
+# expired tokens can be refreshed for REFRESH_GRACE seconds; token versions
+# are cached for VERSION_TIMEOUT seconds
+SIGNED_TOKEN = {
+    'MAX_AGE': config('SIGNED_TOKEN_MAX_AGE', default=15 * 60, cast=int),
+    'REFRESH_GRACE': config('SIGNED_TOKEN_REFRESH_GRACE', default=7 * 24 * 60 * 60, cast=int),
+    'VERSION_TIMEOUT': config('SIGNED_TOKEN_VERSION_TIMEOUT', default=60, cast=int),
+}
+
 REST_FRAMEWORK = {
+    # cheapest first; Basic hashes the password on every request
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.BasicAuthentication',
+        'main.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
+        'main.authentication.CachedOAuth2Authentication',
+        'rest_framework.authentication.BasicAuthentication',
     ),
 
     'DEFAULT_PERMISSION_CLASSES': (
@@ -123,6 +141,41 @@ DATABASES = {
 }
 
 
+# Cache
+# Version counters must be shared by all workers, so use memcached or
+# redis in production, e.g. CACHE_BACKEND=django.core.cache.backends.memcached.MemcachedCache
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+# Task events pushed over /tasks/events/; main.events.SQLiteBackend shares
+# them between the workers of one host through the file at EVENTS_PATH,
+# LocalBackend only reaches the clients of the worker that published them
+# (a single process) and is used until a path is set
+EVENTS_PATH = config('EVENTS_PATH', default='')
+EVENTS = {
+    'BACKEND': config('EVENTS_BACKEND', default='main.events.SQLiteBackend' if EVENTS_PATH else 'main.events.LocalBackend'),
+    'OPTIONS': {'path': EVENTS_PATH} if EVENTS_PATH else {},
+}
+
+# keep the roles of session users (main.roles) in their session until a
+# user or staff changes
+ROLES_SESSION_CACHE = config('ROLES_SESSION_CACHE', default=False, cast=bool)
+
+# main.analytics: the hours a resource could work per day, and how long
+# the figures of past days stay cached (they are dropped on any change)
+ANALYTICS_HOURS_PER_DAY = config('ANALYTICS_HOURS_PER_DAY', default=24, cast=float)
+ANALYTICS_CACHE_TIMEOUT = config('ANALYTICS_CACHE_TIMEOUT', default=7 * 24 * 60 * 60, cast=int)
+
+REST_FRAMEWORK_EXTENSIONS = {
+    'DEFAULT_CACHE_RESPONSE_TIMEOUT': 60 * 60,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -177,6 +230,42 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static'), ]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# thumbnails and other variants of uploaded photos (main.images), made
+# by this many threads per worker after the upload is committed
+IMAGE_VARIANTS = {
+    'WORKERS': config('IMAGE_VARIANTS_WORKERS', default=2, cast=int),
+    'ASYNC': config('IMAGE_VARIANTS_ASYNC', default=True, cast=bool),
+}
+
+# MEDIA_URL is served by main.media: PRIVATE prefixes need a login,
+# OFFLOAD ('x-accel-redirect' for nginx, 'x-sendfile' for Apache) has the
+# front proxy send the bytes, nginx from an internal location at
+# ACCEL_PREFIX that aliases MEDIA_ROOT
+MEDIA_DELIVERY = {
+    'PRIVATE': ['images/', 'variants/images/'],
+    'OFFLOAD': config('MEDIA_OFFLOAD', default=''),
+    'ACCEL_PREFIX': config('MEDIA_ACCEL_PREFIX', default='/protected-media/'),
+    'MAX_AGE': 60 * 60,
+    'IMMUTABLE_MAX_AGE': 365 * 24 * 60 * 60,
+}
+
+# resumable uploads (main.uploads): the chunks go to DIR, outside of
+# MEDIA_ROOT but on the same disk so that finished files are moved, and
+# uploads not finished within EXPIRES seconds go with `manage.py clear_uploads`
+CHUNKED_UPLOADS = {
+    'DIR': config('CHUNKED_UPLOADS_DIR', default=os.path.join(BASE_DIR, 'uploads')),
+    'MAX_SIZE': config('CHUNKED_UPLOADS_MAX_SIZE', default=20 * 1024 * 1024, cast=int),
+    'EXPIRES': 24 * 60 * 60,
+}
+
+# changelists of admins with high_volume on (custom.model_admin): counts
+# and date_hierarchy dates are cached this many seconds, and the count of
+# a whole table over ESTIMATE_OVER rows taken from the database statistics
+ADMIN_HIGH_VOLUME = {
+    'CACHE_TIMEOUT': 5 * 60,
+    'ESTIMATE_OVER': 100000,
+}
+
 LOGOUT_REDIRECT_URL = None
 LOGIN_REDIRECT_URL = 'home'
 LOGIN_URL = '/accounts/login/'
@@ -1,8 +1,8 @@
 from django.contrib import admin
 from django.conf import settings
 from django.conf.urls import url, include
-from django.conf.urls.static import static
 from account import views as accounts_views
+from main.views import MediaView
 
 # home
 urlpatterns = [
@@ -42,6 +42,7 @@ if settings.DEBUG:
     ]
 
 
-# static files
-urlpatterns = urlpatterns + \
-    static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# media files, in production too
+urlpatterns = urlpatterns + [
+    url(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), MediaView.as_view()),
+]
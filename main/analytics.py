@@ -0,0 +1,172 @@
+import datetime
+
+import numpy
+from django.conf import settings
+from django.core.cache import cache
+
+from .board import board_rows
+from .caching import bump_version, get_versions, shared_versions, version_key
+from .scheduling import LABELS, busy_slots
+
+
+MINUTES_PER_DAY = 24 * 60
+
+GRANULARITY = ['day', 'week', 'month']
+
+
+def today():
+    return datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+
+
+def periods_changed(start_time):
+    """
+    Drop the cached days once slots starting at ``start_time`` were
+    written or removed, if that is before today.
+    """
+    from .models import ResourceBusySlot
+
+    if start_time is not None and start_time < today():
+        bump_version(ResourceBusySlot)
+
+
+def booked_minutes(resource_ids, starts, ends, origin, days):
+    """
+    Return the distinct ``resource_ids`` and a ``(resources, days)``
+    array of the minutes each was booked on every day from ``origin``.
+
+    Every resource gets its own stretch of one time line, so the minutes
+    booked before any day boundary come from two sorted searches:
+    ``sum(t - start) - sum(t - end)`` over the slots starting and ending
+    before ``t``.
+    """
+    ids, rows = numpy.unique(numpy.asarray(resource_ids, dtype=numpy.int64), return_inverse=True)
+    span = days * MINUTES_PER_DAY
+    stretch = span + 1
+    origin = numpy.datetime64(origin, 'm')
+
+    def minutes(values):
+        offsets = (numpy.asarray(values, dtype='datetime64[m]') - origin).astype(numpy.int64)
+        return numpy.sort(numpy.clip(offsets, 0, span) + rows * stretch)
+
+    bounds = (numpy.arange(len(ids))[:, None] * stretch +
+              numpy.arange(days + 1)[None, :] * MINUTES_PER_DAY)
+
+    def before(times):
+        count = numpy.searchsorted(times, bounds)
+        sums = numpy.concatenate(([0], numpy.cumsum(times)))
+        return bounds * count - sums[count]
+
+    covered = before(minutes(starts)) - before(minutes(ends))
+    return ids, numpy.diff(covered, axis=1)
+
+
+def day_key(resource, day, version):
+    return 'analytics:%s:%s:%s' % (resource, day.isoformat(), version)
+
+
+def daily_minutes(resource, days):
+    """
+    Return ``(ids, minutes)`` arrays per day of ``days``, the resources
+    booked that day and for how long.
+
+    Days before today are cached until a slot in the past changes, when
+    the versions are shared (``shared_versions``); the others are read
+    with one query over the slots.
+    """
+    from .models import ResourceBusySlot
+
+    version = get_versions([ResourceBusySlot])[version_key(ResourceBusySlot)]
+    closed = today().date()
+    # the version would only be dropped in this worker
+    keys = {day: day_key(resource, day, version) for day in days
+            if day < closed and shared_versions()}
+    cached = cache.get_many(list(keys.values()))
+
+    daily = [cached.get(keys.get(day)) for day in days]
+    missing = [i for i, value in enumerate(daily) if value is None]
+    if missing:
+        first, last = missing[0], missing[-1] + 1
+        origin = datetime.datetime.combine(days[first], datetime.time.min)
+        end = origin + datetime.timedelta(days=last - first)
+
+        slots = list(busy_slots([resource], origin, end).values_list(
+            'resource_id', 'start_time', 'end_time'))
+        resource_ids, starts, ends = zip(*slots) if slots else ((), (), ())
+        ids, minutes = booked_minutes(resource_ids, starts, ends, origin, last - first)
+
+        store = {}
+        for i in range(first, last):
+            if daily[i] is None:
+                column = minutes[:, i - first]
+                booked = column > 0
+                daily[i] = (ids[booked], column[booked])
+                if days[i] in keys:
+                    store[keys[days[i]]] = daily[i]
+        cache.set_many(store, settings.ANALYTICS_CACHE_TIMEOUT)
+
+    return daily
+
+
+def period_starts(days, granularity):
+    # indexes of the days that open a period; the first one always does
+    return [i for i, day in enumerate(days) if i == 0 or granularity == 'day' or
+            (granularity == 'week' and day.weekday() == 0) or
+            (granularity == 'month' and day.day == 1)]
+
+
+def ratio(booked, available):
+    return numpy.divide(booked, available, out=numpy.zeros_like(booked),
+                        where=available > 0)
+
+
+def utilization(resource, first_day, last_day, granularity='day', group=None):
+    """
+    Booked against available hours of every ``resource`` from
+    ``first_day`` to ``last_day`` included, per day, week or month, and
+    for vehicles the revenue their day rate brings in pro rata.
+
+    Rows and periods come back as lists of columns like the dispatch
+    board, plus the totals of each period.
+    """
+    days = [first_day + datetime.timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+
+    fields = ['pk', LABELS[resource]] + (['rate'] if resource == 'vehicle' else [])
+    rows = list(board_rows(resource, group).values_list(*fields))
+    row_ids = numpy.array([row[0] for row in rows], dtype=numpy.int64)
+
+    minutes = numpy.zeros((len(rows), len(days)))
+    for i, (ids, booked) in enumerate(daily_minutes(resource, days)):
+        # both sorted by id; resources off the board are skipped
+        positions = numpy.searchsorted(row_ids, ids)
+        found = positions < len(row_ids)
+        found[found] = row_ids[positions[found]] == ids[found]
+        minutes[positions[found], i] = booked[found]
+
+    starts = period_starts(days, granularity)
+    lengths = numpy.diff(starts + [len(days)])
+    booked = numpy.add.reduceat(minutes, starts, axis=1) / 60
+    available = lengths * float(settings.ANALYTICS_HOURS_PER_DAY)
+
+    result = {
+        'resource': resource,
+        'granularity': granularity,
+        'periods': [days[i].isoformat() for i in starts],
+        'available_hours': available.round(2).tolist(),
+        'id': [row[0] for row in rows],
+        'label': [row[1] for row in rows],
+        'booked_hours': booked.round(2).tolist(),
+        'utilization': ratio(booked, available).round(4).tolist(),
+        'total': {
+            'booked_hours': booked.sum(axis=0).round(2).tolist(),
+            'available_hours': (available * len(rows)).round(2).tolist(),
+            'utilization': ratio(booked.sum(axis=0), available * len(rows)).round(4).tolist(),
+        },
+    }
+
+    if resource == 'vehicle':
+        rates = numpy.array([row[2] or 0 for row in rows], dtype=float)
+        revenue = booked / 24 * rates[:, None]
+        result['revenue'] = revenue.round(2).tolist()
+        result['total']['revenue'] = revenue.sum(axis=0).round(2).tolist()
+
+    return result
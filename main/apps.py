@@ -6,4 +6,6 @@ class MainConfig(AppConfig):
 
     def ready(self):
         # signals are imported, so that they are defined and can be used
-        import main.handlers
\ No newline at end of file
+        import main.handlers
+        # system checks, see main.checks
+        import main.checks
@@ -0,0 +1,255 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+from oauth2_provider.models import get_access_token_model
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication
+
+from .caching import get_versions, shared_versions
+from .roles import SUPERUSER, Roles
+
+
+class TokenCache(object):
+    """
+    The access tokens this process validated, the ``size`` most recently
+    used kept for ``timeout`` seconds at most, under a hash of the token.
+    """
+
+    def __init__(self, size=10000, timeout=300):
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = self.revocations = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                user, token, expires, entry_version = entry
+                if entry_version == version and expires > time.time():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return user, token
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, version, user, token):
+        # never past the expiry of the token itself
+        left = (token.expires - timezone.now()).total_seconds()
+        expires = time.time() + min(self.timeout, left)
+        with self.lock:
+            self.entries[key] = (user, token, expires, version)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def revoke(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.revocations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = self.revocations = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'revocations': self.revocations,
+            }
+
+
+_config = getattr(settings, 'OAUTH2_TOKEN_CACHE', {})
+token_cache = TokenCache(_config.get('SIZE', 10000), _config.get('TIMEOUT', 300))
+
+
+def token_key(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def token_version():
+    """
+    The cache versions of the tokens and their users; bumping one, in
+    any worker, drops every entry of every worker.
+    """
+    from .models import Staff
+
+    versions = get_versions([get_access_token_model(), User, Staff])
+    return tuple(sorted(versions.items()))
+
+
+def bearer_token(request):
+    parts = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(parts) == 2 and parts[0].lower() == 'bearer':
+        return parts[1]
+    return None
+
+
+class CachedOAuth2Authentication(OAuth2Authentication):
+    """
+    ``OAuth2Authentication`` that skips the token and user queries for
+    bearer tokens seen recently, see ``TokenCache``.
+    """
+
+    def authenticate(self, request):
+        token = bearer_token(request)
+        if token is None or not shared_versions():
+            # other workers could not drop the entries of this one
+            return super().authenticate(request)
+
+        key = token_key(token)
+        # read before the lookup, so a revocation racing it wins
+        version = token_version()
+        cached = token_cache.get(key, version)
+        if cached is not None:
+            return cached
+
+        result = super().authenticate(request)
+        if result is not None:
+            token_cache.set(key, version, *result)
+        return result
+
+
+SIGNED_TOKEN_SALT = 'main.authentication.signed-token'
+
+
+def version_cache_key(staff_id):
+    return 'token_version:%s' % staff_id
+
+
+def token_version_of(staff_id):
+    """
+    The signed token version of ``staff_id``, from the cache for
+    ``SIGNED_TOKEN['VERSION_TIMEOUT']`` seconds at most.
+    """
+    from .models import Staff
+
+    key = version_cache_key(staff_id)
+    version = cache.get(key)
+    if version is None:
+        version = Staff.objects.filter(pk=staff_id).values_list('token_version', flat=True).first()
+        # a revocation committing after the read may be missed until then
+        cache.set(key, version, settings.SIGNED_TOKEN['VERSION_TIMEOUT'])
+    return version
+
+
+def revoke_signed_tokens(staff_id):
+    """
+    Invalidate the signed tokens of ``staff_id``; returns the new token
+    version.
+    """
+    from .models import Staff
+
+    Staff.objects.filter(pk=staff_id).update(token_version=F('token_version') + 1)
+    key = version_cache_key(staff_id)
+    # once now and once more after the commit, which drops the old
+    # version a concurrent request read and cached in between
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+    return Staff.objects.filter(pk=staff_id).values_list('token_version', flat=True).first()
+
+
+def issue_signed_token(staff):
+    """
+    Sign the id, roles and token version of ``staff`` with an expiry
+    ``SIGNED_TOKEN['MAX_AGE']`` seconds away.
+    """
+    from .roles import resolve
+
+    expires = int(time.time()) + settings.SIGNED_TOKEN['MAX_AGE']
+    payload = {'u': staff.pk, 'r': resolve(staff).mask, 'v': staff.token_version, 'e': expires}
+    return {'token': signing.dumps(payload, salt=SIGNED_TOKEN_SALT), 'expires': expires}
+
+
+def read_signed_token(token, grace=0):
+    """
+    The payload of ``token``, or None when it is forged, revoked or
+    expired for longer than ``grace`` seconds.
+    """
+    try:
+        payload = signing.loads(token, salt=SIGNED_TOKEN_SALT)
+    except signing.BadSignature:
+        return None
+    if payload['e'] + grace < time.time():
+        return None
+    if payload['v'] != token_version_of(payload['u']):
+        return None
+    return payload
+
+
+class TokenUser(object):
+    """
+    The user of a signed token. It only knows what the token carries;
+    anything else, ``is_active`` too, reads the user row on first access.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, pk, mask):
+        self.pk = self.id = pk
+        self.is_superuser = bool(mask & SUPERUSER)
+        self._user = None
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if self._user is None:
+            self._user = User.objects.get(pk=self.pk)
+        return getattr(self._user, name)
+
+    def __eq__(self, other):
+        return isinstance(other, (User, TokenUser)) and other.pk == self.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return str(self.pk)
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    ``Authorization: Signed <token>`` as issued by ``/auth/token/``.
+
+    The signature, expiry and roles are checked without the database,
+    the token version against the cache.
+    """
+    keyword = 'Signed'
+
+    def authenticate(self, request):
+        parts = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(parts) != 2 or parts[0] != self.keyword:
+            return None
+
+        payload = read_signed_token(parts[1])
+        if payload is None:
+            raise exceptions.AuthenticationFailed('Invalid or expired token.')
+
+        user = TokenUser(payload['u'], payload['r'])
+        # main.roles takes the roles from the token as well
+        request._request._roles = Roles(user, payload['r'], payload['u'])
+        return user, payload
+
+    def authenticate_header(self, request):
+        return self.keyword
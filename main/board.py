@@ -0,0 +1,75 @@
+from django.db.models import Q
+
+from .scheduling import LABELS, busy_slots
+
+
+def board_rows(resource, group=None):
+    """
+    The ``(pk, label)`` of every ``resource`` shown on the board, the
+    members of ``group`` when it holds this kind of resource.
+    """
+    from .models import Task
+
+    field = Task._meta.get_field(resource)
+    qs = field.related_model.objects.filter(**field.get_limit_choices_to())
+
+    kind = 'vehicle' if resource == 'vehicle' else 'staff'
+    if group is not None and group.type_name == kind:
+        qs = qs.filter(group=group)
+    return qs.order_by('pk')
+
+
+def occupancy(start_time, end_time, resources, group=None):
+    """
+    Return the bookings of ``resources`` between ``start_time`` and
+    ``end_time`` as columns, per resource:
+
+    ``id``, ``label``
+        one entry per row, ordered by id
+    ``offsets``
+        the bookings of row ``i`` are ``offsets[i]:offsets[i + 1]``
+    ``task``, ``start``, ``duration``
+        one entry per booking, start in minutes from ``start_time``
+        (negative when it began earlier) and duration in minutes
+
+    All bookings come from one query ordered like the rows, so they are
+    grouped in a single merge pass.
+    """
+    rows = {resource: board_rows(resource, group) for resource in resources}
+
+    condition = Q()
+    for resource, qs in rows.items():
+        condition |= Q(resource_type=resource, resource_id__in=qs.values('pk'))
+
+    slots = busy_slots(resources, start_time, end_time).filter(condition).order_by(
+        'resource_type', 'resource_id', 'start_time', 'task').values_list(
+        'resource_type', 'resource_id', 'task', 'start_time', 'end_time')
+
+    board = {}
+    for resource, qs in rows.items():
+        ids, labels = [], []
+        for pk, label in qs.values_list('pk', LABELS[resource]):
+            ids.append(pk)
+            labels.append(label)
+        board[resource] = {'id': ids, 'label': labels, 'offsets': [0],
+                           'task': [], 'start': [], 'duration': []}
+
+    # rows and slots share the id order, walk both at once
+    position = {resource: 0 for resource in resources}
+    for resource_type, resource_id, task_id, start, end in slots.iterator():
+        columns = board[resource_type]
+        i = position[resource_type]
+        while columns['id'][i] != resource_id:
+            columns['offsets'].append(len(columns['task']))
+            i += 1
+        position[resource_type] = i
+
+        columns['task'].append(task_id)
+        columns['start'].append(int((start - start_time).total_seconds() // 60))
+        columns['duration'].append(int((end - start).total_seconds() // 60))
+
+    for resource, columns in board.items():
+        while len(columns['offsets']) <= len(columns['id']):
+            columns['offsets'].append(len(columns['task']))
+
+    return board
@@ -0,0 +1,291 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework_extensions.cache.decorators import cache_response
+from rest_framework_extensions.etag.decorators import etag
+from rest_framework_extensions.key_constructor import bits
+from rest_framework_extensions.key_constructor.constructors import KeyConstructor
+
+from .roles import get_roles
+
+
+# caches every process has its own copy of: a version bumped there is only
+# seen by the worker that saw the write
+LOCAL_CACHES = [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]
+
+
+def shared_versions():
+    """
+    Whether every worker sees the same version counters. Only then are
+    responses, tokens and roles cached and ETags taken from the counters;
+    otherwise what the database holds is read every time.
+    """
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHES
+
+
+def related_updated_at(instance, names):
+    # the rows shown along with ``instance``, loaded with it
+    values = []
+    for name in names:
+        if instance._meta.get_field(name).many_to_many:
+            values.extend(related.updated_at for related in getattr(instance, name).all())
+        else:
+            related = getattr(instance, name)
+            if related is not None:
+                values.append(related.updated_at)
+    return values
+
+
+class ListUpdatedAtKeyBit(bits.KeyBitBase):
+    """
+    What the list shows. Models whose every change bumps a version in
+    ``etag_models`` need no query, when the versions are shared (see
+    ``shared_versions``). Otherwise the page about to be sent is
+    fetched here, and kept for the response, and the ``updated_at`` of its
+    rows and of their ``etag_related`` rows is used.
+    """
+
+    def get_data(self, params, view_instance, view_method, request, args, kwargs):
+        versions = get_versions(view_instance.etag_models) if view_instance.etag_models else {}
+        queryset = view_instance.filter_queryset(view_instance.get_queryset())
+        if queryset.model in view_instance.etag_models and shared_versions():
+            # no single row tells when the list last changed
+            view_instance.last_modified = None
+            return versions
+
+        page = view_instance.paginate_queryset(queryset)
+        view_instance.etag_page = page
+        stamps = []
+        for row in (queryset if page is None else page):
+            values = [row.updated_at] + related_updated_at(row, view_instance.etag_related)
+            view_instance.last_modified = max([view_instance.last_modified or values[0]] + values)
+            stamps.append((row.pk, values))
+        digest = hashlib.md5(repr(stamps).encode('utf-8')).hexdigest()
+        return '%s:%s' % (digest, sorted(versions.items()))
+
+
+class ObjectUpdatedAtKeyBit(bits.KeyBitBase):
+    """
+    The ``updated_at`` of the object and of its ``etag_related`` rows, in
+    one query, and the versions of ``etag_models``.
+    """
+
+    def get_data(self, params, view_instance, view_method, request, args, kwargs):
+        lookup_url_kwarg = view_instance.lookup_url_kwarg or view_instance.lookup_field
+        queryset = view_instance.filter_queryset(view_instance.get_queryset())
+        queryset = queryset.filter(**{view_instance.lookup_field: kwargs[lookup_url_kwarg]})
+
+        columns = ['updated_at']
+        for name in view_instance.etag_related:
+            if queryset.model._meta.get_field(name).many_to_many:
+                queryset = queryset.annotate(**{'%s_updated_at' % name: Max('%s__updated_at' % name)})
+                columns.append('%s_updated_at' % name)
+            else:
+                columns.append('%s__updated_at' % name)
+        row = queryset.values_list(*columns).first()
+
+        view_instance.last_modified = row and max(value for value in row if value is not None)
+        versions = get_versions(view_instance.etag_models) if view_instance.etag_models else {}
+        return '%s:%s' % (row, sorted(versions.items()))
+
+
+class ETagKeyConstructor(KeyConstructor):
+
+    def prepare_key(self, key_dict):
+        # Django 2.0 parses If-None-Match into quoted tags, which is what
+        # drf-extensions compares the key with
+        return quote_etag(super().prepare_key(key_dict))
+
+
+class ListETagKeyConstructor(ETagKeyConstructor):
+    unique_method_id = bits.UniqueMethodIdKeyBit()
+    format = bits.FormatKeyBit()
+    query_params = bits.QueryParamsKeyBit()
+    updated_at = ListUpdatedAtKeyBit()
+
+
+class ObjectETagKeyConstructor(ETagKeyConstructor):
+    unique_method_id = bits.UniqueMethodIdKeyBit()
+    format = bits.FormatKeyBit()
+    query_params = bits.QueryParamsKeyBit()
+    updated_at = ObjectUpdatedAtKeyBit()
+
+
+def timestamp(value):
+    # updated_at is naive local time, USE_TZ is off
+    return int(time.mktime(value.timetuple()))
+
+
+def conditional(etag_func):
+    """
+    ``etag`` from drf-extensions plus ``Last-Modified``.
+
+    The key constructor leaves ``updated_at`` on the view as
+    ``last_modified``; ``If-Modified-Since`` is only looked at when the
+    request has no ``If-None-Match``.
+    """
+    def decorator(func):
+
+        @wraps(func)
+        def modified_since(self, request, *args, **kwargs):
+            since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+            if (since is not None and self.last_modified is not None and
+                    'HTTP_IF_NONE_MATCH' not in request.META and
+                    timestamp(self.last_modified) <= since):
+                return Response(status=status.HTTP_304_NOT_MODIFIED)
+            return func(self, request, *args, **kwargs)
+
+        view = etag(etag_func=etag_func)(modified_since)
+
+        @wraps(func)
+        def inner(self, request, *args, **kwargs):
+            self.last_modified = None
+            response = view(self, request, *args, **kwargs)
+            if self.last_modified is not None and response.status_code in (200, 304):
+                response['Last-Modified'] = http_date(timestamp(self.last_modified))
+            return response
+        return inner
+
+    return decorator
+
+
+class ConditionalGetMixin(object):
+    """
+    ``ETag`` and ``Last-Modified`` on ``list`` and ``retrieve`` of models
+    with an ``updated_at`` column; unchanged resources get a ``304``
+    without being serialized.
+    """
+
+    list_etag_func = ListETagKeyConstructor()
+    object_etag_func = ObjectETagKeyConstructor()
+    # models whose version counters go into the ETags
+    etag_models = ()
+    # relations shown with each row, whose updated_at goes into the ETags
+    etag_related = ()
+
+    def paginate_queryset(self, queryset):
+        # the list ETag may have fetched the page already
+        page = getattr(self, 'etag_page', None)
+        if page is not None:
+            self.etag_page = None
+            return page
+        return super().paginate_queryset(queryset)
+
+    @conditional(etag_func='list_etag_func')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional(etag_func='object_etag_func')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+def version_key(model):
+    return 'version:%s' % model._meta.label_lower
+
+
+def get_versions(models):
+    """
+    Return ``{label: version}`` of ``models`` in one cache round trip.
+
+    A counter that is missing (never bumped, or evicted) starts from the
+    clock so it cannot fall back to a value older responses were cached
+    under.
+    """
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+    return versions
+
+
+def bump_version(model):
+    key = version_key(model)
+
+    def bump():
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), None)
+
+    # once now for this process and once more after the commit, which
+    # drops whatever a concurrent request cached in between
+    bump()
+    transaction.on_commit(bump)
+
+
+class VersionsKeyBit(bits.KeyBitBase):
+
+    def get_data(self, params, view_instance, view_method, request, args, kwargs):
+        return get_versions(view_instance.cache_models)
+
+
+class RoleKeyBit(bits.KeyBitBase):
+    """
+    Admins share their entries; everybody else gets their own, since
+    object permissions are only checked when the view runs.
+    """
+
+    def get_data(self, params, view_instance, view_method, request, args, kwargs):
+        roles = get_roles(request)
+        if roles.is_superuser:
+            return 'superuser'
+        if roles.is_admin:
+            return 'admin'
+        return 'user:%s' % request.user.pk
+
+
+class ListCacheKeyConstructor(KeyConstructor):
+    unique_method_id = bits.UniqueMethodIdKeyBit()
+    format = bits.FormatKeyBit()
+    query_params = bits.QueryParamsKeyBit()
+    role = RoleKeyBit()
+    versions = VersionsKeyBit()
+
+
+class ObjectCacheKeyConstructor(ListCacheKeyConstructor):
+    kwargs = bits.KwargsKeyBit()
+
+
+class VersionedCacheMixin(object):
+    """
+    Caches ``list`` and ``retrieve`` responses until one of
+    ``cache_models`` changes; ``main.handlers`` bumps their version on
+    every save, delete and many-to-many change. Nothing is cached unless
+    the versions are shared between workers.
+    """
+
+    cache_models = ()
+    list_cache_key_func = ListCacheKeyConstructor()
+    object_cache_key_func = ObjectCacheKeyConstructor()
+
+    def list(self, request, *args, **kwargs):
+        if not shared_versions():
+            return super().list(request, *args, **kwargs)
+        return self.cached_list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not shared_versions():
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached_retrieve(request, *args, **kwargs)
+
+    @cache_response(key_func='list_cache_key_func', cache_errors=False)
+    def cached_list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response(key_func='object_cache_key_func', cache_errors=False)
+    def cached_retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
@@ -0,0 +1,162 @@
+import datetime
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F, Max, Min
+
+from .events import publish_task_changes
+from .scheduling import BATCH_SIZE
+
+
+# the slots of a task that belong to a person
+STAFF_SLOTS = ['driver', 'tourguide', 'operator']
+
+def participants(task_ids):
+    """
+    Return ``{task_id: {staff_id}}`` of the drivers, tour guides,
+    operators and authors of ``task_ids``.
+    """
+    from .models import ResourceBusySlot, Task
+
+    task_ids = list(task_ids)
+    staff = defaultdict(set)
+    for i in range(0, len(task_ids), BATCH_SIZE):
+        batch = task_ids[i:i + BATCH_SIZE]
+        slots = ResourceBusySlot.objects.filter(
+            task__in=batch, resource_type__in=STAFF_SLOTS).values_list('task', 'resource_id')
+        authors = Task.objects.filter(
+            pk__in=batch, author__isnull=False).values_list('pk', 'author__pk')
+        for task_id, staff_id in list(slots) + list(authors):
+            staff[task_id].add(staff_id)
+    return staff
+
+
+def write_changes(action, task_ids, before, after):
+    """
+    Log ``action`` for every task, once for the whole feed and once per
+    participant; people who are no longer part of a task get a
+    ``removed`` entry instead.
+    """
+    from .models import TaskChange
+
+    changes = []
+    for task_id in task_ids:
+        changes.append(TaskChange(task_id=task_id, action=action))
+        for staff_id in sorted(after.get(task_id, ())):
+            changes.append(TaskChange(task_id=task_id, action=action, staff_id=staff_id))
+        for staff_id in sorted(before.get(task_id, set()) - after.get(task_id, set())):
+            changes.append(TaskChange(
+                task_id=task_id, action='deleted' if action == 'deleted' else 'removed',
+                staff_id=staff_id))
+    TaskChange.objects.bulk_create(changes, batch_size=BATCH_SIZE)
+    transaction.on_commit(sequence_changes)
+    publish_task_changes(action, task_ids, before, after)
+
+
+def sequence_changes():
+    """
+    Give the committed entries that have no ``seq`` yet the next ones.
+
+    Ids are taken at insert but rows show up at commit, so a long
+    transaction can commit ids below a token already handed out; seqs
+    are given after the commit, one numbering at a time, and tokens are
+    seqs. Runs after every commit that logs changes and before the log
+    is read, in case one did not.
+    """
+    from .models import TaskChange, TaskChangeSequence
+
+    pending = TaskChange.objects.filter(seq__isnull=True)
+    if not pending.exists():
+        return
+
+    with transaction.atomic():
+        sequence = TaskChangeSequence.objects.select_for_update().get_or_create(pk=1)[0]
+        span = pending.aggregate(first=Min('id'), last=Max('id'))
+        if span['first'] is None:
+            return
+        # seqs keep the order of the ids, gaps do not matter
+        offset = sequence.last + 1 - span['first']
+        pending.filter(id__gte=span['first'], id__lte=span['last']).update(seq=F('id') + offset)
+        sequence.last = span['last'] + offset
+        sequence.save()
+
+
+@contextmanager
+def recording(task_ids, action='updated', before=None):
+    """
+    Log ``action`` for ``task_ids`` around a block that rewrites their
+    busy slots, comparing the participants before and after it, or
+    ``before`` when they were taken earlier.
+    """
+    task_ids = list(task_ids)
+    if before is None:
+        before = participants(task_ids) if action != 'created' else {}
+    yield
+    write_changes(action, task_ids, before, participants(task_ids))
+
+
+class Gone(Exception):
+    pass
+
+
+def changes_since(since, staff=None, limit=500):
+    """
+    Collapse the log after token ``since`` into the latest action per
+    task, for the whole feed or for one ``staff`` id.
+
+    Returns ``(actions, token, more)`` where ``actions`` is an ordered
+    ``{task_id: action}``. Raises ``Gone`` when entries after ``since``
+    have been pruned.
+    """
+    from .models import TaskChange, TaskChangeSequence
+
+    sequence_changes()
+    pruned = TaskChangeSequence.objects.values_list('pruned', flat=True).first() or 0
+    if since < pruned:
+        raise Gone(since)
+
+    qs = TaskChange.objects.filter(seq__gt=since)
+    if staff is None:
+        qs = qs.filter(staff_id__isnull=True)
+    else:
+        qs = qs.filter(staff_id=staff)
+
+    rows = list(qs.order_by('seq').values_list('seq', 'task_id', 'action')[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    actions = OrderedDict()
+    for seq, task_id, action in rows:
+        actions.pop(task_id, None)
+        actions[task_id] = action
+
+    return actions, rows[-1][0] if rows else since, more
+
+
+def current_token():
+    from .models import TaskChangeSequence
+
+    sequence_changes()
+    return TaskChangeSequence.objects.values_list('last', flat=True).first() or 0
+
+
+def prune_changes(days):
+    """
+    Delete the entries older than ``days`` and remember the last seq
+    deleted, so older tokens get a 410 even once the log is empty.
+    """
+    from .models import TaskChange, TaskChangeSequence
+
+    sequence_changes()
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    with transaction.atomic():
+        old = TaskChange.objects.filter(created_at__lt=cutoff, seq__isnull=False)
+        last = old.aggregate(last=Max('seq'))['last']
+        if last is None:
+            return 0
+        sequence = TaskChangeSequence.objects.select_for_update().get_or_create(pk=1)[0]
+        if last > sequence.pruned:
+            sequence.pruned = last
+            sequence.save()
+        return old.filter(seq__lte=last).delete()[0]
@@ -0,0 +1,14 @@
+from django.core.checks import Tags, Warning, register
+
+from .caching import shared_versions
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if shared_versions():
+        return []
+    return [Warning(
+        'The default cache is local to each process, so responses, tokens and '
+        'roles are not cached and ETags are read from the database.',
+        hint='Set CACHE_BACKEND to a cache every worker shares, such as memcached.',
+        id='main.W001')]
@@ -3,6 +3,28 @@ GROUP = [
     ('staff', 'Staff'),
 ]
 
+RESOURCE_TYPE = [
+    ('vehicle', 'Vehicle'),
+    ('driver', 'Driver'),
+    ('tourguide', 'TourGuide'),
+    ('operator', 'Operator'),
+]
+
+TASK_CHANGE = [
+    ('created', 'Created'),
+    ('updated', 'Updated'),
+    ('deleted', 'Deleted'),
+    ('removed', 'Removed'),
+]
+
+UPLOAD_TARGET = [
+    ('staff.photo', 'Staff Photo'),
+    ('vehicle.photo', 'Vehicle Photo'),
+    ('staff.image', 'Staff Image'),
+    ('vehicle.image', 'Vehicle Image'),
+    ('task.image', 'Task Image'),
+]
+
 RENTAL_MODE = [
     (0, 'Rent_Per_Day'),
     (1, 'Rent_Per_Week'),
@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .scheduling import BATCH_SIZE, PERSONS, RESOURCES, Bookings, busy_slots, sync_busy_slots
+from .changes import recording
+
+
+class Pool(object):
+    """
+    Interval partitioning over the candidates of one resource.
+
+    Resources whose last assignment ended before the current task are
+    kept in ``idle``; the most recently released one is tried first so
+    the others stay free for longer tasks (best fit). ``busy`` holds the
+    ``Bookings`` of every resource, shared between pools so a person
+    driving a task cannot guide it.
+    """
+
+    def __init__(self, kind, candidates, busy):
+        self.kind = kind
+        self.busy = busy
+        # preferred candidates are popped first
+        self.idle = list(reversed(candidates))
+        self.running = []
+        self.counter = itertools.count()
+
+    def take(self, start_time, end_time):
+        while self.running and self.running[0][0] <= start_time:
+            self.idle.append(heapq.heappop(self.running)[2])
+
+        for i in range(len(self.idle) - 1, -1, -1):
+            pk = self.idle[i]
+            if not self.busy[(self.kind, pk)].collides(start_time, end_time):
+                del self.idle[i]
+                self.busy[(self.kind, pk)].add(start_time, end_time)
+                heapq.heappush(self.running, (end_time, next(self.counter), pk))
+                return pk
+
+        return None
+
+
+def candidates(resource, num_of_pass=None):
+    """
+    Return the pks of the resources ``Task.<resource>`` may point at,
+    smallest vehicles first.
+    """
+    from .models import Task
+
+    field = Task._meta.get_field(resource)
+    qs = field.related_model.objects.filter(**field.get_limit_choices_to())
+
+    if resource == 'vehicle':
+        if num_of_pass:
+            qs = qs.filter(num_of_pass__gte=num_of_pass)
+        qs = qs.order_by('num_of_pass', 'pk')
+    else:
+        qs = qs.order_by('pk')
+
+    return list(qs.values_list('pk', flat=True))
+
+
+def auto_assign(tasks, resources=('vehicle', 'driver'), num_of_pass=None):
+    """
+    Fill the empty ``resources`` of ``tasks`` in one pass.
+
+    Tasks are swept by start time and every missing resource is taken
+    from the free eligible candidates, respecting the bookings already
+    in ``ResourceBusySlot``. Tasks no candidate is left for keep their
+    empty fields. Returns a dict with the number of tasks seen, the
+    number of assignments per resource, the ids of the tasks that are
+    still missing something and the time spent.
+    """
+    from .models import Task
+
+    started = time.time()
+    resources = [resource for resource in RESOURCES if resource in resources]
+
+    missing = Q()
+    for resource in resources:
+        missing |= Q(**{'%s__isnull' % resource: True})
+
+    rows = list(tasks.filter(missing).order_by('start_time', 'pk').values_list(
+        'pk', 'start_time', 'end_time', *resources))
+
+    result = {
+        'tasks': len(rows),
+        'assigned': {resource: 0 for resource in resources},
+        'unassigned': [],
+        'seconds': 0.0,
+    }
+    if not rows:
+        return result
+
+    busy = defaultdict(Bookings)
+    window = (min(row[1] for row in rows), max(row[2] for row in rows))
+    slots = busy_slots(RESOURCES, *window).values_list(
+        'resource_type', 'resource_id', 'start_time', 'end_time')
+    for resource_type, resource_id, start_time, end_time in slots.iterator():
+        kind = 'staff' if resource_type in PERSONS else resource_type
+        busy[(kind, resource_id)].add(start_time, end_time)
+
+    pools = {}
+    for resource in resources:
+        kind = 'staff' if resource in PERSONS else resource
+        pools[resource] = Pool(kind, candidates(resource, num_of_pass), busy)
+
+    assignments = {resource: defaultdict(list) for resource in resources}
+    for row in rows:
+        pk, start_time, end_time = row[:3]
+        complete = True
+
+        for resource, current in zip(resources, row[3:]):
+            if current is not None:
+                continue
+
+            chosen = pools[resource].take(start_time, end_time)
+            if chosen is None:
+                complete = False
+                continue
+
+            assignments[resource][chosen].append(pk)
+            result['assigned'][resource] += 1
+
+        if not complete:
+            result['unassigned'].append(pk)
+
+    changed, now = set(), timezone.now()
+    with transaction.atomic():
+        # one UPDATE per chosen resource instead of one per task
+        for resource, groups in assignments.items():
+            for chosen, ids in groups.items():
+                for i in range(0, len(ids), BATCH_SIZE):
+                    Task.objects.filter(pk__in=ids[i:i + BATCH_SIZE]).update(
+                        **{'%s_id' % resource: chosen, 'updated_at': now})
+                changed.update(ids)
+
+        with recording(changed):
+            sync_busy_slots(changed)
+
+    result['seconds'] = time.time() - started
+    return result
@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('django')
+
+
+class LocalBackend(object):
+    """
+    Events of this process only, the last ``size`` kept for clients
+    reconnecting with ``Last-Event-ID``. The clients of other workers
+    never see them, so only for single process setups.
+    """
+
+    def __init__(self, size=1000):
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=size)
+        self.last = 0
+
+    def publish(self, payload):
+        self.publish_many([payload])
+
+    def publish_many(self, payloads):
+        with self.condition:
+            for payload in payloads:
+                self.last += 1
+                self.events.append((self.last, payload))
+            self.condition.notify_all()
+
+    def last_id(self):
+        return self.last
+
+    def read(self, after, timeout):
+        with self.condition:
+            if self.last <= after:
+                self.condition.wait(timeout)
+            return [(id, payload) for id, payload in self.events if id > after]
+
+
+class SQLiteBackend(object):
+    """
+    Events in a SQLite file shared by every worker of one host, polled
+    every ``interval`` seconds. Stands in for a broker in multi-worker
+    setups and tests.
+    """
+
+    def __init__(self, path=None, size=10000, interval=0.5):
+        self.path = path or os.path.join(settings.BASE_DIR, 'events.sqlite3')
+        self.size = size
+        self.interval = interval
+        with self.connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS events '
+                       '(id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)')
+
+    def connect(self):
+        # one connection per call, sqlite3 connections are bound to a thread
+        return sqlite3.connect(self.path, timeout=5)
+
+    def publish(self, payload):
+        self.publish_many([payload])
+
+    def publish_many(self, payloads):
+        # one connection and one transaction however many there are
+        with self.connect() as db:
+            db.executemany('INSERT INTO events (payload) VALUES (?)',
+                           [[json.dumps(payload)] for payload in payloads])
+            db.execute('DELETE FROM events WHERE id <= (SELECT MAX(id) FROM events) - ?', [self.size])
+
+    def last_id(self):
+        with self.connect() as db:
+            return db.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+    def read(self, after, timeout):
+        deadline = time.time() + timeout
+        while True:
+            with self.connect() as db:
+                rows = db.execute('SELECT id, payload FROM events WHERE id > ? ORDER BY id',
+                                  [after]).fetchall()
+            if rows or time.time() >= deadline:
+                return [(id, json.loads(payload)) for id, payload in rows]
+            time.sleep(min(self.interval, max(deadline - time.time(), 0)))
+
+
+class Hub(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def publish(self, payload):
+        self.backend.publish(payload)
+
+    def publish_many(self, payloads):
+        self.backend.publish_many(payloads)
+
+    def listen(self, accept, last_id=None, seconds=300, heartbeat=15):
+        """
+        Yield ``(id, data)`` for the events ``accept`` turns into data,
+        and ``None`` every ``heartbeat`` seconds without any, for
+        ``seconds`` in total.
+        """
+        last = self.backend.last_id()
+        # ids from before a restart of the local backend start over
+        after = last if last_id is None or last_id > last else last_id
+        deadline = time.time() + seconds
+
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+
+            events = self.backend.read(after, min(heartbeat, remaining))
+            sent = False
+            for id, payload in events:
+                after = id
+                data = accept(payload)
+                if data is not None:
+                    sent = True
+                    yield id, data
+            if not sent:
+                yield None
+
+
+_hub = None
+_lock = threading.Lock()
+
+
+def get_hub():
+    global _hub
+    with _lock:
+        if _hub is None:
+            config = getattr(settings, 'EVENTS', {})
+            backend = import_string(config.get('BACKEND', 'main.events.LocalBackend'))
+            _hub = Hub(backend(**config.get('OPTIONS', {})))
+    return _hub
+
+
+def publish_task_changes(action, task_ids, before, after):
+    """
+    Publish one event per task once the transaction commits, listing
+    what it means to each participant: ``removed`` for those who are no
+    longer part of it. The write is done by then, so a backend failing
+    is logged and not raised.
+    """
+    payloads = []
+    for task_id in task_ids:
+        staff = {str(pk): action for pk in after.get(task_id, ())}
+        for pk in before.get(task_id, set()) - after.get(task_id, set()):
+            staff[str(pk)] = 'deleted' if action == 'deleted' else 'removed'
+        payloads.append({'task': task_id, 'action': action, 'staff': staff})
+
+    def publish():
+        try:
+            get_hub().publish_many(payloads)
+        except Exception:
+            logger.exception('Could not publish the events of tasks %s', list(task_ids))
+
+    transaction.on_commit(publish)
+
+
+def task_filter(staff_id=None):
+    """
+    Turn an event into what one subscriber sees: everything for admins
+    (``staff_id`` None), else only the tasks ``staff_id`` is part of.
+    """
+    def accept(payload):
+        if staff_id is None:
+            action = payload['action']
+        else:
+            action = payload['staff'].get(str(staff_id))
+        if action is None:
+            return None
+        return {'task': payload['task'], 'action': action}
+    return accept
+
+
+def event_stream(events, retry=3000):
+    yield 'retry: %d\n\n' % retry
+    for event in events:
+        if event is None:
+            yield ': keepalive\n\n'
+        else:
+            id, data = event
+            yield 'id: %d\nevent: task\ndata: %s\n\n' % (id, json.dumps(data))
@@ -0,0 +1,14 @@
+import django_filters
+
+from .models import Task
+
+
+class TaskFilter(django_filters.FilterSet):
+    # resources are filtered by plate and name, as when they were the keys
+    vehicle = django_filters.CharFilter(name='vehicle__traffic_plate_no')
+    driver = django_filters.CharFilter(name='driver__full_name')
+    tourguide = django_filters.CharFilter(name='tourguide__full_name')
+
+    class Meta:
+        model = Task
+        fields = ['id', 'create_time', 'vehicle', 'driver', 'tourguide', 'start_addr', 'end_addr']
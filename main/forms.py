@@ -1,10 +1,10 @@
 from django import forms
 from django.forms.models import ModelForm
 from django.contrib.auth.forms import UserCreationForm
-from django.contrib.contenttypes.models import ContentType
 
 from .models import *
 from .validators import verifycode_validate
+from .provisioning import assign_role
 
 
 class StaffCreationForm(UserCreationForm):
@@ -25,13 +25,7 @@ class StaffCreationForm(UserCreationForm):
         user = super().save(commit=False)
         user.is_staff = True
         user.save()
-
-        content_query = ContentType.objects.filter(app_label='main')
-        for content in content_query:
-            permission_query = Permission.objects.filter(
-                content_type_id=content.id)
-            for permission in permission_query:
-                user.user_permissions.add(permission.id)
+        assign_role([user.pk], 'staff')
 
         return user
 
@@ -45,3 +39,29 @@ class TaskForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(TaskForm, self).__init__(*args, **kwargs)
+
+
+class TaskImportForm(forms.Form):
+    # one row of a task import, resources are given by their label
+    start_time = forms.DateTimeField()
+    end_time = forms.DateTimeField()
+    start_addr = forms.CharField(max_length=256)
+    end_addr = forms.CharField(max_length=256)
+    remake = forms.CharField(max_length=256, required=False)
+    vehicle = forms.CharField(max_length=16, required=False)
+    driver = forms.CharField(max_length=64, required=False)
+    tourguide = forms.CharField(max_length=64, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_time = cleaned_data.get('start_time')
+        end_time = cleaned_data.get('end_time')
+
+        if start_time and end_time and start_time > end_time:
+            raise forms.ValidationError('the end time must be after start time')
+
+        driver = cleaned_data.get('driver')
+        if driver and driver == cleaned_data.get('tourguide'):
+            raise forms.ValidationError('%s cannot be driver and tourguide' % driver)
+
+        return cleaned_data
@@ -1,6 +1,17 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_migrate
-from .models import Setting
+from django.db.models.signals import post_migrate, pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.contrib.auth.models import User
+from django.utils import timezone
+from oauth2_provider.models import get_access_token_model
+from .models import Setting, Task, Staff, Vehicle, BaseGroup, DLI, TLI, PPI, Image
+from .scheduling import sync_busy_slots
+from .changes import participants, recording, write_changes
+from .caching import bump_version
+from .analytics import periods_changed
+from .provisioning import clear_permission_ids
+from .authentication import revoke_signed_tokens, token_cache, token_key
+from .roles import FLAGS
+from .images import schedule_variants
 
 
 def init_db(sender, **kwargs):
@@ -10,3 +21,179 @@ def init_db(sender, **kwargs):
 
 
 post_migrate.connect(init_db)
+# new content types or permissions change the role templates
+post_migrate.connect(clear_permission_ids)
+
+
+@receiver(pre_save, sender=Task)
+def task_saving(sender, instance, raw=False, **kwargs):
+    # the author is written by the save itself, read the old one first
+    instance._participants = None
+    if not raw and instance.pk is not None:
+        instance._participants = participants([instance.pk])
+
+
+@receiver(post_save, sender=Task)
+def task_saved(sender, instance, created=False, raw=False, **kwargs):
+    # slots of deleted tasks go away with the ON DELETE CASCADE
+    if not raw:
+        before = getattr(instance, '_participants', None)
+        with recording([instance.pk], 'created' if created else 'updated', before):
+            sync_busy_slots([instance.pk])
+
+
+@receiver(pre_delete, sender=Task)
+def task_deleting(sender, instance, **kwargs):
+    # the slots are gone by post_delete
+    instance._participants = participants([instance.pk])
+
+
+@receiver(post_delete, sender=Task)
+def task_deleted(sender, instance, **kwargs):
+    write_changes('deleted', [instance.pk], getattr(instance, '_participants', {}), {})
+    periods_changed(instance.start_time)
+
+
+@receiver(m2m_changed, sender=Task.operator.through)
+def task_operator_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            with recording([instance.pk]):
+                sync_busy_slots([instance.pk])
+    elif action == 'pre_clear':
+        # post_clear does not report which tasks lost the operator
+        instance._cleared_tasks = list(
+            instance.operator_task.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        tasks = getattr(instance, '_cleared_tasks', [])
+        with recording(tasks):
+            sync_busy_slots(tasks)
+    elif action in ('post_add', 'post_remove'):
+        with recording(pk_set):
+            sync_busy_slots(pk_set)
+
+
+def touch(model, pks):
+    # update() skips auto_now, and m2m or license changes are not saves
+    model.objects.filter(pk__in=list(pks)).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Task.operator.through)
+@receiver(m2m_changed, sender=Staff.group.through)
+@receiver(m2m_changed, sender=Vehicle.group.through)
+def touch_m2m(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            touch(type(instance), [instance.pk])
+    elif action == 'pre_clear':
+        columns = {field.related_model: field.name
+                   for field in sender._meta.get_fields() if field.many_to_one}
+        instance._cleared_pks = list(sender.objects.filter(
+            **{columns[type(instance)]: instance.pk}).values_list(columns[model], flat=True))
+    elif action == 'post_clear':
+        touch(model, getattr(instance, '_cleared_pks', []))
+    elif action in ('post_add', 'post_remove'):
+        touch(model, pk_set)
+
+
+@receiver(post_save, sender=BaseGroup)
+def touch_members(sender, instance, created=False, raw=False, **kwargs):
+    # the group is part of the staff and vehicle detail
+    if not created and not raw:
+        touch(Staff, instance.staff.values_list('pk', flat=True))
+        touch(Vehicle, instance.vehicle.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=DLI)
+@receiver(post_save, sender=TLI)
+@receiver(post_save, sender=PPI)
+@receiver(post_delete, sender=DLI)
+@receiver(post_delete, sender=TLI)
+@receiver(post_delete, sender=PPI)
+def touch_staff(sender, instance, raw=False, **kwargs):
+    # the licenses are part of the staff detail
+    if not raw:
+        touch(Staff, [instance.staff_id])
+
+
+# what the cached responses of main.views are built from
+CACHED_MODELS = [Staff, Vehicle, BaseGroup, DLI, TLI, PPI]
+
+
+# User fields saved on their own (update_last_login) that neither the
+# cached responses nor authentication depend on; staff responses may
+# show an older last_login until something else changes
+UNVERSIONED_USER_FIELDS = {'last_login'}
+
+
+def model_changed(sender, update_fields=None, **kwargs):
+    if sender is User and update_fields and set(update_fields) <= UNVERSIONED_USER_FIELDS:
+        return
+    bump_version(sender)
+    if sender is User:
+        # the staff fields inherited from User are saved on the parent row
+        bump_version(Staff)
+
+
+for model in CACHED_MODELS + [User]:
+    post_save.connect(model_changed, sender=model, dispatch_uid='version_%s' % model.__name__)
+    post_delete.connect(model_changed, sender=model, dispatch_uid='version_delete_%s' % model.__name__)
+
+
+@receiver(m2m_changed, sender=Staff.group.through)
+@receiver(m2m_changed, sender=Vehicle.group.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def relation_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_version(Vehicle if sender is Vehicle.group.through else Staff)
+
+
+@receiver(post_save, sender=get_access_token_model())
+@receiver(post_delete, sender=get_access_token_model())
+def token_changed(sender, instance, created=False, **kwargs):
+    # new tokens cannot be cached yet; others may have been revoked
+    if not created:
+        token_cache.revoke(token_key(instance.token))
+        bump_version(sender)
+
+
+# what the roles in a signed token are read from, see main.roles.resolve
+ROLE_FIELDS = {
+    User: ['is_active', 'is_superuser'],
+    Staff: ['is_active', 'is_superuser'] + [flag for role, flag in FLAGS],
+}
+
+
+def role_fields(sender, update_fields):
+    if update_fields is None:
+        return ROLE_FIELDS[sender]
+    return [name for name in ROLE_FIELDS[sender] if name in update_fields]
+
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=Staff)
+def roles_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    fields = role_fields(sender, update_fields)
+    instance._old_roles = None
+    if not raw and instance.pk is not None and fields:
+        instance._old_roles = sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Staff)
+def roles_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    # deactivated or with other roles: the signed tokens out there are wrong
+    old = getattr(instance, '_old_roles', None)
+    if old is not None and old != tuple(getattr(instance, name) for name in role_fields(sender, update_fields)):
+        version = revoke_signed_tokens(instance.pk)
+        if sender is Staff:
+            # a later save of this instance must not write the old one back
+            instance.token_version = version
+
+
+@receiver(post_save, sender=Staff)
+@receiver(post_save, sender=Vehicle)
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_variants(instance)
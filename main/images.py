@@ -0,0 +1,145 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from .caching import bump_version
+
+logger = logging.getLogger('django')
+
+
+# name: (longest side in pixels, Pillow format, file extension)
+VARIANTS = OrderedDict([
+    ('thumbnail', (160, 'JPEG', 'jpg')),
+    ('medium', (800, 'JPEG', 'jpg')),
+    ('webp', (1600, 'WEBP', 'webp')),
+])
+
+# model: (image field, field the variants are recorded in)
+FIELDS = {
+    'main.staff': ('photo', 'photo_variants'),
+    'main.vehicle': ('photo', 'photo_variants'),
+    'main.image': ('image', 'variants'),
+}
+
+
+def read_variants(value):
+    # {'source': name of the original, <variant>: name of the file}
+    return json.loads(value) if value else {}
+
+
+def render(source):
+    """
+    Yield ``(name, extension, content)`` of every variant of the image
+    file ``source``, never larger than the original.
+    """
+    with PILImage.open(source) as original:
+        image = original.convert('RGB')
+
+    for name, (size, format, extension) in VARIANTS.items():
+        variant = image.copy()
+        variant.thumbnail((size, size), PILImage.LANCZOS)
+        buffer = io.BytesIO()
+        variant.save(buffer, format, quality=85)
+        yield name, extension, buffer.getvalue()
+
+
+def generate_variants(label, pk):
+    """
+    Write the variants of the image of ``label`` ``pk`` next to it and
+    record them, unless the image was replaced in the meantime.
+    """
+    model = apps.get_model(label)
+    image_field, variants_field = FIELDS[label]
+
+    instance = model.objects.filter(pk=pk).first()
+    image = instance and getattr(instance, image_field)
+    if not image:
+        return None
+
+    old = read_variants(getattr(instance, variants_field))
+    variants = {'source': image.name}
+    stem = os.path.splitext(image.name)[0]
+
+    storage = image.storage
+    image.open('rb')
+    try:
+        for name, extension, content in render(image):
+            # named after the original and the content, so a name never
+            # changes meaning and main.media lets clients keep it for good
+            digest = hashlib.md5(content).hexdigest()[:8]
+            path = 'variants/%s_%s_%s.%s' % (stem, name, digest, extension)
+            if not storage.exists(path):
+                path = storage.save(path, ContentFile(content))
+            variants[name] = path
+    finally:
+        image.close()
+
+    for name, path in old.items():
+        if name != 'source' and path not in variants.values():
+            storage.delete(path)
+
+    values = {variants_field: json.dumps(variants)}
+    if any(field.name == 'updated_at' for field in model._meta.fields):
+        values['updated_at'] = timezone.now()
+    # update() does not come back here through post_save
+    if model.objects.filter(pk=pk, **{image_field: image.name}).update(**values):
+        bump_version(model)
+    return variants
+
+
+def run(label, pk, thread=True):
+    # threads of a pool open their own connection, closed when done
+    try:
+        generate_variants(label, pk)
+    except Exception:
+        logger.exception('Could not generate the image variants of %s %s', label, pk)
+    finally:
+        if thread:
+            connection.close()
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.IMAGE_VARIANTS['WORKERS'])
+    return _executor
+
+
+def schedule_variants(instance):
+    """
+    Generate the variants of ``instance`` once it is committed, in the
+    pool of ``IMAGE_VARIANTS['WORKERS']`` threads, if its image changed.
+    """
+    label = instance._meta.label_lower
+    image_field, variants_field = FIELDS[label]
+    image = getattr(instance, image_field)
+    recorded = read_variants(getattr(instance, variants_field))
+
+    if not image:
+        if recorded:
+            type(instance).objects.filter(pk=instance.pk).update(**{variants_field: ''})
+        return
+    if recorded.get('source') == image.name:
+        return
+
+    if settings.IMAGE_VARIANTS['ASYNC']:
+        transaction.on_commit(lambda: get_executor().submit(run, label, instance.pk))
+    else:
+        generate_variants(label, instance.pk)
@@ -0,0 +1,163 @@
+import csv
+import json
+import uuid
+from collections import defaultdict
+
+from django.db import transaction
+
+from .forms import TaskImportForm
+from .scheduling import BATCH_SIZE, LABELS, PERSONS, RESOURCES, Bookings, busy_slots, sync_busy_slots
+from .changes import recording
+
+
+def read_rows(stream, file_format):
+    """
+    Yield one dict per task from a binary CSV (with a header line) or
+    newline-delimited JSON ``stream``.
+    """
+    # readline() is all an upload or a request body reliably offers
+    text = (line.decode('utf-8-sig') for line in iter(stream.readline, b''))
+
+    if file_format == 'csv':
+        for row in csv.DictReader(text):
+            yield row
+    elif file_format == 'ndjson':
+        for line in text:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError('unknown format %s' % file_format)
+
+
+def guess_format(name='', content_type=''):
+    if name.endswith(('.ndjson', '.jsonl', '.json')) or 'json' in content_type:
+        return 'ndjson'
+    return 'csv'
+
+
+def resolve(resource, labels):
+    """
+    Map the labels of ``resource`` to their pk. Ineligible resources are
+    left out.
+    """
+    from .models import Task
+
+    field = Task._meta.get_field(resource)
+    qs = field.related_model.objects.filter(**field.get_limit_choices_to())
+
+    labels = list(labels)
+    resolved = {}
+    for i in range(0, len(labels), BATCH_SIZE):
+        resolved.update(qs.filter(**{'%s__in' % LABELS[resource]: labels[i:i + BATCH_SIZE]}).values_list(
+            LABELS[resource], 'pk'))
+    return resolved
+
+
+def import_tasks(rows, author=None, dry_run=False):
+    """
+    Validate and create tasks from ``rows`` (dicts of TaskImportForm data).
+
+    Existing bookings of the window are read once; every row is then
+    checked against them and against the rows before it with a sweep in
+    start-time order, so the whole import costs a handful of queries
+    whatever its size. Valid rows are written with ``bulk_create`` unless
+    ``dry_run``. Returns the number of ``created`` and ``valid`` rows and
+    the ``errors`` as ``[{'row': i, 'errors': [...]}]``, rows numbered
+    from 1.
+    """
+    from .models import Task
+
+    errors = []
+    valid = []
+    labels = defaultdict(set)
+
+    # a new form per row would deep-copy its fields every time
+    form = TaskImportForm({})
+    for number, row in enumerate(rows, 1):
+        form.data, form._errors = row, None
+        if not form.is_valid():
+            errors.append({'row': number, 'errors': [
+                '%s: %s' % (field, message) if field != '__all__' else message
+                for field, messages in form.errors.items() for message in messages]})
+            continue
+
+        valid.append((number, form.cleaned_data))
+        for resource in RESOURCES:
+            if form.cleaned_data[resource]:
+                labels[resource].add(form.cleaned_data[resource])
+
+    resolved = {resource: resolve(resource, labels[resource]) for resource in RESOURCES}
+
+    bookings = defaultdict(list)
+    if valid:
+        window = (min(data['start_time'] for number, data in valid),
+                  max(data['end_time'] for number, data in valid))
+        slots = busy_slots(RESOURCES, *window).values_list(
+            'resource_type', 'resource_id', 'start_time', 'end_time', 'task')
+        for resource_type, resource_id, start_time, end_time, task_id in slots.iterator():
+            kind = 'staff' if resource_type in PERSONS else resource_type
+            bookings[(kind, resource_id)].append((start_time, end_time, task_id))
+    bookings = {key: Bookings(slots) for key, slots in bookings.items()}
+
+    # (end time, row) of the latest accepted row per resource
+    accepted = {}
+    tasks = []
+    valid.sort(key=lambda item: (item[1]['start_time'], item[0]))
+
+    for number, data in valid:
+        start_time, end_time = data['start_time'], data['end_time']
+        messages, keys, pks = [], [], {}
+
+        for resource in RESOURCES:
+            label = data[resource]
+            if not label:
+                continue
+            if label not in resolved[resource]:
+                messages.append('%s: %s is not available' % (resource, label))
+                continue
+
+            pks[resource] = resolved[resource][label]
+            key = ('staff' if resource in PERSONS else resource, pks[resource])
+
+            booking = key in bookings and bookings[key].collides(start_time, end_time)
+            if booking:
+                messages.append('%s is busy until %s (task %s)' % (
+                    label, booking[0].strftime('%Y-%m-%d %H:%M'), booking[1]))
+            elif key in accepted and accepted[key][0] > start_time:
+                messages.append('%s is busy until %s (row %s)' % (
+                    label, accepted[key][0].strftime('%Y-%m-%d %H:%M'), accepted[key][1]))
+            keys.append(key)
+
+        if messages:
+            errors.append({'row': number, 'errors': messages})
+            continue
+
+        for key in keys:
+            if key not in accepted or accepted[key][0] < end_time:
+                accepted[key] = (end_time, number)
+
+        task = Task(uuid=uuid.uuid4(), author=author, start_time=start_time, end_time=end_time,
+                    start_addr=data['start_addr'], end_addr=data['end_addr'], remake=data['remake'])
+        for resource, pk in pks.items():
+            setattr(task, '%s_id' % resource, pk)
+        tasks.append(task)
+
+    errors.sort(key=lambda error: error['row'])
+
+    if not dry_run and tasks:
+        with transaction.atomic():
+            Task.objects.bulk_create(tasks, batch_size=BATCH_SIZE)
+
+            # bulk_create does not fire post_save; the ids are set where
+            # the backend returns them, else looked up by the indexed uuid
+            ids = [task.pk for task in tasks if task.pk is not None]
+            if len(ids) < len(tasks):
+                ids = []
+                for i in range(0, len(tasks), BATCH_SIZE):
+                    ids.extend(Task.objects.filter(
+                        uuid__in=[task.uuid for task in tasks[i:i + BATCH_SIZE]]).values_list('pk', flat=True))
+            # one change log write and one event publish for the whole import
+            with recording(ids, 'created'):
+                sync_busy_slots(ids)
+
+    return {'created': 0 if dry_run else len(tasks), 'valid': len(tasks), 'errors': errors}
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.models import Staff
+from main.provisioning import TEMPLATES, assign_role
+
+
+class Command(BaseCommand):
+    help = 'Give staff the permissions of a role template in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('template', choices=sorted(TEMPLATES))
+        parser.add_argument('usernames', nargs='*')
+        parser.add_argument(
+            '--group', help='Everybody in this staff group.')
+        parser.add_argument(
+            '--all', action='store_true', dest='all', help='Every staff member.')
+        parser.add_argument(
+            '--replace', action='store_true', dest='replace',
+            help='Take away the permissions the template does not grant.')
+
+    def handle(self, *args, **options):
+        staff = Staff.objects.all()
+        if options['group']:
+            staff = staff.filter(group__name=options['group'], group__type_name='staff')
+        elif options['usernames']:
+            staff = staff.filter(username__in=options['usernames'])
+        elif not options['all']:
+            raise CommandError('Give usernames, --group or --all')
+
+        user_ids = list(staff.values_list('pk', flat=True))
+        added = assign_role(user_ids, options['template'], replace=options['replace'])
+        self.stdout.write(self.style.SUCCESS(
+            'Added %d permissions to %d staff' % (added, len(user_ids))))
@@ -0,0 +1,58 @@
+import datetime
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.dispatch import auto_assign
+from main.models import Staff, Vehicle, Task
+
+
+class Command(BaseCommand):
+    help = 'Measure auto-assign throughput on a synthetic day of tasks (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=2000)
+        parser.add_argument('--vehicles', type=int, default=500)
+        parser.add_argument('--staff', type=int, default=600)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def populate(self, options):
+        random.seed(options['seed'])
+        day = datetime.datetime(2000, 1, 1)
+
+        Vehicle.objects.bulk_create([
+            Vehicle(model_name='bench', num_of_pass=random.choice([4, 7, 14, 30]),
+                    eng_no='bench-%d' % i, chassis_no='bench-%d' % i,
+                    traffic_plate_no='bench-%d' % i, policy_no='bench-%d' % i,
+                    exp_date=day, reg_date=day, ins_exp=day)
+            for i in range(options['vehicles'])], batch_size=500)
+
+        # multi-table inheritance rules out bulk_create
+        for i in range(options['staff']):
+            staff = Staff(username='bench-%d' % i, full_name='bench-%d' % i,
+                          phone='bench-%d' % i, is_driver=True, is_tourguide=i % 3 == 0)
+            staff.save()
+
+        tasks = []
+        for i in range(options['tasks']):
+            start_time = day + datetime.timedelta(minutes=random.randrange(0, 20 * 60, 5))
+            end_time = start_time + datetime.timedelta(minutes=random.randrange(30, 4 * 60, 5))
+            tasks.append(Task(start_time=start_time, end_time=end_time,
+                              start_addr='bench', end_addr='bench'))
+        Task.objects.bulk_create(tasks, batch_size=500)
+
+        return Task.objects.filter(start_addr='bench')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            tasks = self.populate(options)
+            result = auto_assign(tasks, resources=['vehicle', 'driver', 'tourguide'])
+            transaction.set_rollback(True)
+
+        self.stdout.write('tasks:      %d' % result['tasks'])
+        for resource, count in sorted(result['assigned'].items()):
+            self.stdout.write('%-11s %d' % (resource + ':', count))
+        self.stdout.write('incomplete: %d' % len(result['unassigned']))
+        self.stdout.write('seconds:    %.3f' % result['seconds'])
+        self.stdout.write('tasks/s:    %.0f' % (result['tasks'] / max(result['seconds'], 1e-9)))
@@ -0,0 +1,152 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from main.models import Staff, Vehicle, Task
+
+
+# the indexes of main/migrations/0006_scheduling_indexes.py
+INDEXES = [
+    'main_staff_driver_idx',
+    'main_staff_guide_idx',
+    'main_staff_operator_idx',
+    'main_task_vehicle_time_idx',
+    'main_task_driver_time_idx',
+    'main_task_guide_time_idx',
+    'main_task_start_idx',
+    'main_vehicle_status_idx',
+]
+
+EXPLAIN = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+}
+
+
+class Command(BaseCommand):
+    help = ('Show the plans and timings of the scheduling queries with and without '
+            'their indexes on a synthetic task table (rolled back afterwards)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=1000000)
+        parser.add_argument('--vehicles', type=int, default=1000)
+        parser.add_argument('--staff', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per query, the best one is reported.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def populate(self, options):
+        random.seed(options['seed'])
+        day = datetime.datetime(2000, 1, 1)
+
+        plates = ['bench-%d' % i for i in range(options['vehicles'])]
+        Vehicle.objects.bulk_create([
+            Vehicle(model_name='bench', eng_no=plate, chassis_no=plate, traffic_plate_no=plate,
+                    policy_no=plate, exp_date=day, reg_date=day, ins_exp=day,
+                    status=random.choice(['enabled', 'enabled', 'disabled']))
+            for plate in plates], batch_size=500)
+
+        # multi-table inheritance rules out bulk_create
+        names = ['bench-%d' % i for i in range(options['staff'])]
+        for i, name in enumerate(names):
+            Staff(username=name, full_name=name, phone=name, is_driver=i % 2 == 0,
+                  is_tourguide=i % 2 == 1, is_operator=i % 10 == 0).save()
+
+        bench = Staff.objects.filter(username__startswith='bench-')
+        vehicles = list(Vehicle.objects.filter(model_name='bench').values_list('pk', flat=True))
+        drivers = list(bench.filter(is_driver=True).values_list('pk', flat=True))
+        guides = list(bench.filter(is_tourguide=True).values_list('pk', flat=True))
+
+        # a few years of history, written in batches to keep memory flat
+        minutes = 5 * 365 * 24 * 60
+        for offset in range(0, options['tasks'], 10000):
+            tasks = []
+            for i in range(offset, min(offset + 10000, options['tasks'])):
+                start_time = day + datetime.timedelta(minutes=random.randrange(0, minutes, 5))
+                tasks.append(Task(
+                    start_time=start_time,
+                    end_time=start_time + datetime.timedelta(minutes=random.randrange(30, 8 * 60, 5)),
+                    start_addr='bench', end_addr='bench',
+                    vehicle_id=random.choice(vehicles),
+                    driver_id=random.choice(drivers),
+                    tourguide_id=random.choice(guides)))
+            Task.objects.bulk_create(tasks, batch_size=500)
+            self.stdout.write('\r%d tasks' % min(offset + 10000, options['tasks']), ending='')
+        self.stdout.write('')
+
+        return vehicles, drivers, guides
+
+    def queries(self, vehicles, drivers, guides):
+        start_time = datetime.datetime(2002, 6, 1, 8)
+        end_time = start_time + datetime.timedelta(hours=4)
+        window = dict(start_time__lt=end_time, end_time__gt=start_time)
+        driver = Task._meta.get_field('driver')
+
+        return [
+            ('vehicle overlap', Task.objects.filter(vehicle=vehicles[0], **window)),
+            ('driver overlap', Task.objects.filter(driver=drivers[0], **window)),
+            ('tourguide overlap', Task.objects.filter(tourguide=guides[0], **window)),
+            ('tasks of a day', Task.objects.filter(
+                start_time__gte=start_time, start_time__lt=start_time + datetime.timedelta(days=1))),
+            ('keyset page', Task.objects.filter(start_time__lt=start_time).order_by(
+                '-start_time', '-id')[:20]),
+            ('driver choices', Staff.objects.filter(**driver.get_limit_choices_to())),
+            ('vehicle choices', Vehicle.objects.filter(status='enabled')),
+        ]
+
+    def explain(self, queryset):
+        prefix = EXPLAIN.get(connection.vendor)
+        if prefix is None:
+            return []
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+    def measure(self, queries, repeat):
+        results = {}
+        for name, queryset in queries:
+            best = None
+            for i in range(repeat):
+                started = time.time()
+                list(queryset.all())
+                elapsed = time.time() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = (best, self.explain(queryset))
+        return results
+
+    def set_indexes(self, add):
+        # SQL only: the SQLite schema editor refuses to run in a transaction
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for model in (Staff, Vehicle, Task):
+                for index in model._meta.indexes:
+                    if index.name in INDEXES:
+                        sql = index.create_sql(model, editor) if add else index.remove_sql(model, editor)
+                        cursor.execute(str(sql))
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'mysql':
+            self.stderr.write('MySQL commits DDL, run this on a scratch database only.')
+
+        with transaction.atomic():
+            queries = self.queries(*self.populate(options))
+
+            self.set_indexes(add=False)
+            before = self.measure(queries, options['repeat'])
+            self.set_indexes(add=True)
+            after = self.measure(queries, options['repeat'])
+
+            transaction.set_rollback(True)
+
+        for name, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, (elapsed, plan) in (('before', before[name]), ('after', after[name])):
+                self.stdout.write('  %-6s %9.2f ms' % (label, elapsed * 1000))
+                for line in plan:
+                    self.stdout.write('         %s' % line)
+            self.stdout.write('  speedup %.1fx' % (before[name][0] / max(after[name][0], 1e-9)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.uploads import clear_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete the chunked uploads that were never finished, and their chunks'
+
+    def handle(self, *args, **options):
+        cleared = clear_expired()
+        self.stdout.write(self.style.SUCCESS('Cleared %d uploads' % cleared))
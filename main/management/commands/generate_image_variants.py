@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from main.images import FIELDS, read_variants, run
+
+
+class Command(BaseCommand):
+    help = 'Generate the missing or outdated variants of the uploaded photos in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Threads to use, 1 runs in the command itself. Default 4.')
+        parser.add_argument(
+            '--force', action='store_true', dest='force',
+            help='Also regenerate the variants that are up to date.')
+
+    def pending(self, force):
+        for label, (image_field, variants_field) in sorted(FIELDS.items()):
+            rows = apps.get_model(label).objects.exclude(**{image_field: ''}).exclude(
+                **{'%s__isnull' % image_field: True}).values_list('pk', image_field, variants_field)
+            for pk, image, variants in rows.iterator():
+                if force or read_variants(variants).get('source') != image:
+                    yield label, pk
+
+    def handle(self, *args, **options):
+        pending = list(self.pending(options['force']))
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(options['workers']) as executor:
+                for label, pk in pending:
+                    executor.submit(run, label, pk)
+        else:
+            for label, pk in pending:
+                run(label, pk, thread=False)
+
+        self.stdout.write(self.style.SUCCESS('Processed %d images' % len(pending)))
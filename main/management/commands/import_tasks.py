@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.imports import guess_format, import_tasks, read_rows
+from main.models import Staff
+
+
+class Command(BaseCommand):
+    help = 'Import tasks from a CSV or NDJSON manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], dest='file_format',
+                            help='Defaults to the file extension.')
+        parser.add_argument('--author', help='Full name of the operator the tasks are created for.')
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                            help='Only report the errors, create nothing.')
+
+    def handle(self, *args, **options):
+        author = None
+        if options['author']:
+            try:
+                author = Staff.objects.get(full_name=options['author'])
+            except Staff.DoesNotExist:
+                raise CommandError('%s does not exist' % options['author'])
+
+        file_format = options['file_format'] or guess_format(options['path'])
+        with open(options['path'], 'rb') as stream:
+            result = import_tasks(read_rows(stream, file_format),
+                                  author=author, dry_run=options['dry_run'])
+
+        for error in result['errors']:
+            self.stderr.write('row %d: %s' % (error['row'], '; '.join(error['errors'])))
+
+        self.stdout.write('%d valid rows, %d created, %d rejected' % (
+            result['valid'], result['created'], len(result['errors'])))
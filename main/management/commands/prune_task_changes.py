@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from main.changes import prune_changes
+
+
+class Command(BaseCommand):
+    help = 'Delete task change log entries older than the given number of days'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=30,
+            help='Keep this many days of changes; older tokens get a 410. Default 30.')
+
+    def handle(self, *args, **options):
+        deleted = prune_changes(options['days'])
+        self.stdout.write(self.style.SUCCESS('Deleted %d task changes' % deleted))
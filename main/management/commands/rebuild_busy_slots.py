@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.models import Task, ResourceBusySlot
+from main.scheduling import BATCH_SIZE, expected_slots, sync_busy_slots
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the resource busy slots from the tasks and verify that they match'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true', dest='check',
+            help='Only verify the slots, do not rebuild them.')
+
+    def task_batches(self):
+        batch = []
+        for pk in Task.objects.order_by('pk').values_list('pk', flat=True).iterator():
+            batch.append(pk)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def rebuild(self):
+        with transaction.atomic():
+            ResourceBusySlot.objects.all().delete()
+            for batch in self.task_batches():
+                sync_busy_slots(batch)
+
+    def verify(self):
+        missing = extra = 0
+        for batch in self.task_batches():
+            expected = set(expected_slots(batch))
+            actual = list(ResourceBusySlot.objects.filter(task__in=batch).values_list(
+                'resource_type', 'resource_id', 'start_time', 'end_time', 'task'))
+
+            missing += len(expected - set(actual))
+            # duplicated rows count as extra as well
+            extra += len(actual) - len(set(actual) & expected)
+
+        return missing, extra
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            self.rebuild()
+            self.stdout.write('Rebuilt %d slots' % ResourceBusySlot.objects.count())
+
+        missing, extra = self.verify()
+        if missing or extra:
+            raise CommandError(
+                'Busy slots do not match the tasks: %d missing, %d extra' % (missing, extra))
+
+        self.stdout.write(self.style.SUCCESS('Busy slots match the tasks'))
@@ -0,0 +1,175 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
+
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def is_private(path):
+    return any(path.startswith(prefix) for prefix in settings.MEDIA_DELIVERY['PRIVATE'])
+
+
+def is_immutable(path):
+    # variant names carry a digest of their content, see main.images
+    return path.startswith('variants/')
+
+
+def media_path(path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    return full_path
+
+
+def make_etag(stat):
+    return quote_etag('%x-%x' % (int(stat.st_mtime), stat.st_size))
+
+
+def not_modified(request, etag, mtime):
+    """
+    Whether the client has the file; ``If-Modified-Since`` is only looked
+    at when the request has no ``If-None-Match``.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and int(mtime) <= since
+
+
+def parse_range(request, etag, size):
+    """
+    The ``(first, last)`` byte of a single ``Range``, None for the whole
+    file and False when it lies past the end. Several ranges, and ranges
+    on a changed file (``If-Range``), get the whole file.
+    """
+    match = RANGE.match(request.META.get('HTTP_RANGE', '').strip())
+    if not match or not any(match.groups()):
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # the final ``last`` bytes
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        return False
+    return first, last
+
+
+class RangeFile(object):
+    """
+    ``length`` bytes of ``file`` from its current position. The file
+    number is kept, so servers whose ``wsgi.file_wrapper`` uses
+    ``sendfile`` from the current offset for ``Content-Length`` bytes
+    still can; the others read through ``read``.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.left = length
+
+    def read(self, size=-1):
+        size = self.left if size < 0 else min(size, self.left)
+        data = self.file.read(size) if size else b''
+        self.left -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def offload(path, full_path):
+    """
+    An empty response that has the front proxy send ``path`` itself, per
+    ``MEDIA_DELIVERY['OFFLOAD']``; None when Django sends it.
+    """
+    mode = settings.MEDIA_DELIVERY['OFFLOAD']
+    if mode == 'x-accel-redirect':
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_DELIVERY['ACCEL_PREFIX'] + path)
+    elif mode == 'x-sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = full_path
+    else:
+        return None
+    # the proxy sets its own from the file
+    del response['Content-Type']
+    return response
+
+
+def serve(request, path):
+    """
+    Send the media file ``path`` with validators and caching headers,
+    only the bytes of a ``Range``, or nothing when the client has it.
+    """
+    full_path = media_path(path)
+    stat = os.stat(full_path)
+    etag = make_etag(stat)
+
+    # shared caches must never keep private files, immutable or not
+    scope = 'private' if is_private(path) else 'public'
+    if is_immutable(path):
+        cache_control = '%s, max-age=%d, immutable' % (scope, settings.MEDIA_DELIVERY['IMMUTABLE_MAX_AGE'])
+    else:
+        cache_control = '%s, max-age=%d, must-revalidate' % (scope, settings.MEDIA_DELIVERY['MAX_AGE'])
+
+    if not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        response = offload(path, full_path) or send(request, full_path, etag, stat.st_size)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def send(request, full_path, etag, size):
+    content_type, encoding = mimetypes.guess_type(full_path)
+    byte_range = parse_range(request, etag, size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type or 'application/octet-stream')
+        response['Content-Length'] = size
+    else:
+        first, last = byte_range
+        file.seek(first)
+        response = FileResponse(
+            RangeFile(file, last - first + 1), status=206,
+            content_type=content_type or 'application/octet-stream')
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Accept-Ranges'] = 'bytes'
+    return response
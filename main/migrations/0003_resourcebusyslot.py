@@ -0,0 +1,70 @@
+# Generated by Django 2.0.13 on 2026-10-18 16:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_slots(apps, schema_editor):
+    Task = apps.get_model('main', 'Task')
+    ResourceBusySlot = apps.get_model('main', 'ResourceBusySlot')
+
+    slots = []
+
+    def flush(force=False):
+        if slots and (force or len(slots) >= 5000):
+            ResourceBusySlot.objects.bulk_create(slots, batch_size=500)
+            del slots[:]
+
+    tasks = Task.objects.values_list(
+        'id', 'start_time', 'end_time', 'vehicle__pk', 'driver__pk', 'tourguide__pk')
+    for id, start_time, end_time, vehicle, driver, tourguide in tasks.iterator():
+        for resource_type, resource_id in zip(('vehicle', 'driver', 'tourguide'), (vehicle, driver, tourguide)):
+            if resource_id is not None:
+                slots.append(ResourceBusySlot(
+                    resource_type=resource_type, resource_id=resource_id,
+                    start_time=start_time, end_time=end_time, task_id=id))
+        flush()
+
+    operators = Task.operator.through.objects.values_list(
+        'task', 'staff', 'task__start_time', 'task__end_time')
+    for task_id, staff_id, start_time, end_time in operators.iterator():
+        slots.append(ResourceBusySlot(
+            resource_type='operator', resource_id=staff_id,
+            start_time=start_time, end_time=end_time, task_id=task_id))
+        flush()
+
+    flush(force=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_auto_20180305_1627'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceBusySlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(choices=[('vehicle', 'Vehicle'), ('driver', 'Driver'), ('tourguide', 'TourGuide'), ('operator', 'Operator')], max_length=16)),
+                ('resource_id', models.PositiveIntegerField()),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='busy_slots', to='main.Task')),
+            ],
+            options={
+                'verbose_name': 'Resource Busy Slot',
+                'verbose_name_plural': 'Resource Busy Slot',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='resourcebusyslot',
+            index=models.Index(fields=['resource_type', 'resource_id', 'start_time', 'end_time'], name='main_slot_resource_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resourcebusyslot',
+            index=models.Index(fields=['start_time', 'end_time'], name='main_slot_time_idx'),
+        ),
+        migrations.RunPython(build_slots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.0.13 on 2026-10-18 16:50
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def copy_create_time(apps, schema_editor):
+    # rows that were never touched again were last modified when created
+    for name in ('Staff', 'Vehicle', 'Task'):
+        apps.get_model('main', name).objects.update(updated_at=F('create_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_resourcebusyslot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='staff',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_create_time, migrations.RunPython.noop),
+    ]
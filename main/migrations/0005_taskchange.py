@@ -0,0 +1,31 @@
+# Generated by Django 2.0.13 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.PositiveIntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted'), ('removed', 'Removed')], max_length=16)),
+                ('staff_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Task Change',
+                'verbose_name_plural': 'Task Change',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='taskchange',
+            index=models.Index(fields=['staff_id', 'id'], name='main_change_staff_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.0.13 on 2026-10-18 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_taskchange'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='staff',
+            index=models.Index(fields=['is_driver', 'status'], name='main_staff_driver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='staff',
+            index=models.Index(fields=['is_tourguide', 'status'], name='main_staff_guide_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='staff',
+            index=models.Index(fields=['is_operator', 'status'], name='main_staff_operator_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['vehicle', 'start_time', 'end_time'], name='main_task_vehicle_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['driver', 'start_time', 'end_time'], name='main_task_driver_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['tourguide', 'start_time', 'end_time'], name='main_task_guide_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['start_time', 'id'], name='main_task_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['status'], name='main_vehicle_status_idx'),
+        ),
+    ]
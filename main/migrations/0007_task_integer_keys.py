@@ -0,0 +1,46 @@
+# Generated by Django 2.0.13 on 2026-10-18 16:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# The switch to integer keys runs in three migrations, each in its own
+# transaction: PostgreSQL cannot alter a table with the deferred foreign
+# key checks of the copy still pending. This one adds the new columns,
+# 0007_task_integer_keys_copy fills them and 0007_task_integer_keys_swap
+# puts them in place of the old ones.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_scheduling_indexes'),
+    ]
+
+    operations = [
+        # the composite indexes cover the columns being replaced
+        migrations.RemoveIndex(model_name='task', name='main_task_vehicle_time_idx'),
+        migrations.RemoveIndex(model_name='task', name='main_task_driver_time_idx'),
+        migrations.RemoveIndex(model_name='task', name='main_task_guide_time_idx'),
+
+        migrations.AddField(
+            model_name='task',
+            name='vehicle_pk',
+            field=models.ForeignKey(null=True, blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.Vehicle'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='driver_pk',
+            field=models.ForeignKey(null=True, blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.Staff'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='tourguide_pk',
+            field=models.ForeignKey(null=True, blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.Staff'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='author_pk',
+            field=models.ForeignKey(null=True, blank=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.Staff'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.0.13 on 2026-10-18 16:50
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+# Task field, related model, the column it used to point at
+KEYS = [
+    ('vehicle', 'Vehicle', 'traffic_plate_no'),
+    ('driver', 'Staff', 'full_name'),
+    ('tourguide', 'Staff', 'full_name'),
+    ('author', 'Staff', 'full_name'),
+]
+
+
+def copy_keys(apps, schema_editor):
+    # one UPDATE with correlated subqueries instead of a loop over tasks
+    Task = apps.get_model('main', 'Task')
+    Task.objects.update(**{
+        '%s_pk' % name: Subquery(apps.get_model('main', model).objects.filter(
+            **{column: OuterRef('%s_id' % name)}).values('pk')[:1])
+        for name, model, column in KEYS
+    })
+
+
+def copy_values(apps, schema_editor):
+    Task = apps.get_model('main', 'Task')
+    Task.objects.update(**{
+        name: Subquery(apps.get_model('main', model).objects.filter(
+            pk=OuterRef('%s_pk' % name)).values(column)[:1])
+        for name, model, column in KEYS
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_task_integer_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_keys, copy_values),
+    ]
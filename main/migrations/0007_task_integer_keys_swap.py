@@ -0,0 +1,51 @@
+# Generated by Django 2.0.13 on 2026-10-18 16:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index(field, name):
+    return models.Index(fields=[field, 'start_time', 'end_time'], name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_task_integer_keys_copy'),
+    ]
+
+    operations = [
+        migrations.RemoveField(model_name='task', name='vehicle'),
+        migrations.RemoveField(model_name='task', name='driver'),
+        migrations.RemoveField(model_name='task', name='tourguide'),
+        migrations.RemoveField(model_name='task', name='author'),
+        migrations.RenameField(model_name='task', old_name='vehicle_pk', new_name='vehicle'),
+        migrations.RenameField(model_name='task', old_name='driver_pk', new_name='driver'),
+        migrations.RenameField(model_name='task', old_name='tourguide_pk', new_name='tourguide'),
+        migrations.RenameField(model_name='task', old_name='author_pk', new_name='author'),
+
+        migrations.AlterField(
+            model_name='task',
+            name='vehicle',
+            field=models.ForeignKey(blank=True, limit_choices_to={'status': 'enabled'}, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='vehicle_task', to='main.Vehicle'),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='driver',
+            field=models.ForeignKey(blank=True, limit_choices_to={'is_active': True, 'is_driver': True, 'status': 'enabled'}, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='driver_task', to='main.Staff'),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='tourguide',
+            field=models.ForeignKey(blank=True, limit_choices_to={'is_active': True, 'is_tourguide': True, 'status': 'enabled'}, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tourguide_task', to='main.Staff'),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='author',
+            field=models.ForeignKey(blank=True, limit_choices_to={'is_active': True, 'is_operator': True, 'status': 'enabled'}, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='author_task', to='main.Staff'),
+        ),
+
+        migrations.AddIndex(model_name='task', index=index('vehicle', 'main_task_vehicle_time_idx')),
+        migrations.AddIndex(model_name='task', index=index('driver', 'main_task_driver_time_idx')),
+        migrations.AddIndex(model_name='task', index=index('tourguide', 'main_task_guide_time_idx')),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_task_integer_keys_swap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='staff',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
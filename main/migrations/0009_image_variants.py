@@ -0,0 +1,28 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_staff_token_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='variants',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='staff',
+            name='photo_variants',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='photo_variants',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('target', models.CharField(choices=[('staff.photo', 'Staff Photo'), ('vehicle.photo', 'Vehicle Photo'), ('staff.image', 'Staff Image'), ('vehicle.image', 'Vehicle Image'), ('task.image', 'Task Image')], max_length=16)),
+                ('object_id', models.PositiveIntegerField()),
+                ('filename', models.CharField(max_length=100)),
+                ('size', models.PositiveIntegerField()),
+                ('checksum', models.CharField(max_length=64)),
+                ('offset', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='main.Staff')),
+            ],
+            options={
+                'verbose_name': 'Upload',
+                'verbose_name_plural': 'Upload',
+            },
+        ),
+    ]
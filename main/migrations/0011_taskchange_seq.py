@@ -0,0 +1,45 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:23
+
+from django.db import migrations, models
+from django.db.models import F, Max, Min
+
+
+def number_changes(apps, schema_editor):
+    # tokens handed out so far were ids, they stay valid as seqs
+    TaskChange = apps.get_model('main', 'TaskChange')
+    TaskChange.objects.update(seq=F('id'))
+    span = TaskChange.objects.aggregate(first=Min('id'), last=Max('id'))
+    apps.get_model('main', 'TaskChangeSequence').objects.create(
+        pk=1, last=span['last'] or 0, pruned=span['first'] - 1 if span['first'] else 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskChangeSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last', models.PositiveIntegerField(default=0)),
+                ('pruned', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='taskchange',
+            name='main_change_staff_idx',
+        ),
+        migrations.AddField(
+            model_name='taskchange',
+            name='seq',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='taskchange',
+            index=models.Index(fields=['staff_id', 'seq'], name='main_change_staff_seq_idx'),
+        ),
+        migrations.RunPython(number_changes, migrations.RunPython.noop),
+    ]
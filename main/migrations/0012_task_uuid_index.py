@@ -0,0 +1,19 @@
+# Generated by Django 2.0.13 on 2026-10-18 17:43
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_taskchange_seq'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='task',
+            name='uuid',
+            field=models.UUIDField(auto_created=True, db_index=True, default=uuid.uuid4, editable=False),
+        ),
+    ]
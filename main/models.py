@@ -1,5 +1,4 @@
 from django.db import models
-from django.db.models import Q
 from django.contrib.auth.models import User, Permission, UserManager
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
@@ -16,11 +15,14 @@ import datetime
 
 from custom.utils import Tools
 from .validators import verifycode_validate
-from .constants import GROUP, STATUS, GENDER, LANGUAGE
+from .constants import GROUP, STATUS, GENDER, LANGUAGE, RESOURCE_TYPE, TASK_CHANGE, UPLOAD_TARGET
+from .scheduling import find_conflicts
 
 
 class Image(models.Model):
     image = models.ImageField(upload_to="images")
+    # written by main.images once the variants exist
+    variants = models.TextField(blank=True, default='', editable=False)
     content_type = models.ForeignKey(
         ContentType, on_delete=models.CASCADE, related_name='images')
     object_id = models.PositiveIntegerField()
@@ -114,6 +116,7 @@ class Staff(User):
     wechart_account = models.CharField(max_length=64, null=True, blank=True)
     whatsup_account = models.CharField(max_length=64, null=True, blank=True)
     photo = models.ImageField(upload_to='photos', null=True, blank=True)
+    photo_variants = models.TextField(blank=True, default='', editable=False)
     status = models.CharField(max_length=16, default='enabled',
                               blank=True, null=True, choices=STATUS)
     is_driver = models.BooleanField(default=False, verbose_name='Driver ?')
@@ -124,12 +127,22 @@ class Staff(User):
         default=False, verbose_name='Admin', help_text='This user has permission to add or delete')
     group = models.ManyToManyField(
         'BaseGroup', blank=True, related_name='staff', limit_choices_to={'type_name': 'staff'})
+    # bumped to revoke every signed token of this staff
+    token_version = models.PositiveIntegerField(default=0, editable=False)
 
     create_time = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = 'Staff'
         verbose_name_plural = 'Staff'
+        # the limit_choices_to of Task.driver, tourguide and operator;
+        # is_active lives on auth_user and cannot be part of them
+        indexes = [
+            models.Index(fields=['is_driver', 'status'], name='main_staff_driver_idx'),
+            models.Index(fields=['is_tourguide', 'status'], name='main_staff_guide_idx'),
+            models.Index(fields=['is_operator', 'status'], name='main_staff_operator_idx'),
+        ]
 
     def __str__(self):
         return self.full_name
@@ -161,10 +174,12 @@ class Vehicle(models.Model):
     status = models.CharField(
         max_length=16, default='enabled', blank=True, null=True, choices=STATUS)
     photo = models.ImageField(upload_to='photos', blank=True)
+    photo_variants = models.TextField(blank=True, default='', editable=False)
     group = models.ManyToManyField(
         'BaseGroup', blank=True, related_name='vehicle', limit_choices_to={'type_name': 'vehicle'})
 
     create_time = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.traffic_plate_no
@@ -172,11 +187,14 @@ class Vehicle(models.Model):
     class Meta:
         verbose_name = 'Vehicle'
         verbose_name_plural = 'Vehicle'
+        indexes = [
+            models.Index(fields=['status'], name='main_vehicle_status_idx'),
+        ]
 
 
 class Task(models.Model):
     uuid = models.UUIDField(
-        auto_created=True, default=uuid.uuid4, editable=False)
+        auto_created=True, default=uuid.uuid4, editable=False, db_index=True)
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
     start_addr = models.CharField(max_length=256)
@@ -184,110 +202,56 @@ class Task(models.Model):
     remake = models.TextField(blank=True, max_length=256)
 
     vehicle = models.ForeignKey(
-        Vehicle, null=True, blank=True, on_delete=models.CASCADE, related_name='vehicle_task', to_field='traffic_plate_no', limit_choices_to={'status': 'enabled'})
+        Vehicle, null=True, blank=True, on_delete=models.CASCADE, related_name='vehicle_task', limit_choices_to={'status': 'enabled'})
     driver = models.ForeignKey(
-        Staff, null=True, blank=True, on_delete=models.CASCADE, related_name='driver_task', to_field='full_name', limit_choices_to={'is_driver': True, 'is_active': True, 'status': 'enabled'})
+        Staff, null=True, blank=True, on_delete=models.CASCADE, related_name='driver_task', limit_choices_to={'is_driver': True, 'is_active': True, 'status': 'enabled'})
     tourguide = models.ForeignKey(
-        Staff, null=True, blank=True, on_delete=models.CASCADE, related_name='tourguide_task', to_field='full_name', limit_choices_to={'is_tourguide': True, 'is_active': True, 'status': 'enabled'})
+        Staff, null=True, blank=True, on_delete=models.CASCADE, related_name='tourguide_task', limit_choices_to={'is_tourguide': True, 'is_active': True, 'status': 'enabled'})
     operator = models.ManyToManyField(
         Staff, blank=True, related_name='operator_task', limit_choices_to={'is_operator': True, 'is_active': True, 'status': 'enabled'})
     author = models.ForeignKey(
-        Staff, null=True, blank=True, on_delete=models.CASCADE, related_name='author_task', to_field='full_name', limit_choices_to={'is_operator': True, 'is_active': True, 'status': 'enabled'})
+        Staff, null=True, blank=True, on_delete=models.CASCADE, related_name='author_task', limit_choices_to={'is_operator': True, 'is_active': True, 'status': 'enabled'})
 
     create_time = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
-    def start_time_in(self):
-        time = self.start_time.strftime('%Y-%m-%d %H:%M')
-        now = timezone.now().strftime('%Y-%m-%d %H:%M')
-
-        if time >= now:
-            color_code = 'green'
-        else:
-            color_code = 'red'
+    def time_in(self, value):
+        # green while to come; a high volume changelist hands every row
+        # the same clock as ``changelist_now``
+        now = getattr(self, 'changelist_now', None) or timezone.now()
+        color_code = 'green' if value >= now.replace(second=0, microsecond=0) else 'red'
 
         return format_html(
             '<span style="color: {};">{}</span>',
             color_code,
-            time,
+            value.strftime('%Y-%m-%d %H:%M'),
         )
+
+    def start_time_in(self):
+        return self.time_in(self.start_time)
     start_time_in.short_description = 'start time'
     start_time_in.admin_order_field = 'start_time'
 
     def end_time_in(self):
-        time = self.end_time.strftime('%Y-%m-%d %H:%M')
-        now = timezone.now().strftime('%Y-%m-%d %H:%M')
-
-        if time >= now:
-            color_code = 'green'
-        else:
-            color_code = 'red'
-
-        return format_html(
-            '<span style="color: {};">{}</span>',
-            color_code,
-            time,
-        )
+        return self.time_in(self.end_time)
     end_time_in.short_description = 'end time'
     end_time_in.admin_order_field = 'end_time'
 
     class Meta:
         verbose_name = 'Task'
         verbose_name_plural = 'Task'
+        indexes = [
+            models.Index(fields=['vehicle', 'start_time', 'end_time'], name='main_task_vehicle_time_idx'),
+            models.Index(fields=['driver', 'start_time', 'end_time'], name='main_task_driver_time_idx'),
+            models.Index(fields=['tourguide', 'start_time', 'end_time'], name='main_task_guide_time_idx'),
+            # date filters, and the keyset pagination of the task list
+            models.Index(fields=['start_time', 'id'], name='main_task_start_idx'),
+        ]
 
     def __str__(self):
         # str(self.uuid)[:8]
         return self.create_time.strftime('%Y-%m-%d-%H-%M-%S')
 
-    def clean_vehicle(self):
-        if self.vehicle:
-            qs = Task.objects.exclude(id=self.id).filter(vehicle=self.vehicle).filter(
-                Q(start_time__lte=self.start_time,
-                  end_time__gte=self.start_time)
-                | Q(start_time__lte=self.end_time, end_time__gte=self.end_time)
-                | Q(start_time__gte=self.start_time, end_time__lte=self.end_time))
-
-            if qs:
-                raise ValidationError(
-                    '%s is busy' % qs[0].vehicle.traffic_plate_no)
-
-    def clean_driver(self):
-        if self.driver:
-            qs = Task.objects.exclude(id=self.id).filter(driver=self.driver).filter(
-                Q(start_time__lte=self.start_time, end_time__gte=self.start_time)
-                | Q(start_time__lte=self.end_time, end_time__gte=self.end_time)
-                | Q(start_time__gte=self.start_time, end_time__lte=self.end_time))
-            if qs:
-                raise ValidationError(
-                    '%s is busy' % qs[0].driver.full_name)
-
-        if self.driver and self.driver.is_tourguide:
-            qs = Task.objects.exclude(id=self.id).filter(tourguide=self.driver).filter(
-                Q(start_time__lte=self.start_time, end_time__gte=self.start_time)
-                | Q(start_time__lte=self.end_time, end_time__gte=self.end_time)
-                | Q(start_time__gte=self.start_time, end_time__lte=self.end_time))
-            if qs:
-                raise ValidationError(
-                    '%s is busy' % qs[0].tourguide.full_name)
-
-    def clean_tourguide(self):
-        if self.driver:
-            qs = Task.objects.exclude(id=self.id).filter(tourguide=self.tourguide).filter(
-                Q(start_time__lte=self.start_time, end_time__gte=self.start_time)
-                | Q(start_time__lte=self.end_time, end_time__gte=self.end_time)
-                | Q(start_time__gte=self.start_time, end_time__lte=self.end_time))
-            if qs:
-                raise ValidationError(
-                    '%s is busy' % qs[0].tourguide.full_name)
-
-        if self.tourguide and self.tourguide.is_driver:
-            qs = Task.objects.exclude(id=self.id).filter(driver=self.tourguide).filter(
-                Q(start_time__lte=self.start_time, end_time__gte=self.start_time)
-                | Q(start_time__lte=self.end_time, end_time__gte=self.end_time)
-                | Q(start_time__gte=self.start_time, end_time__lte=self.end_time))
-            if qs:
-                raise ValidationError(
-                    '%s is busy' % qs[0].driver.full_name)
-
     def clean(self):
         super().clean()
 
@@ -295,9 +259,89 @@ class Task(models.Model):
             if self.start_time > self.end_time:
                 raise ValidationError('the end time must be after start time')
 
-            self.clean_vehicle()
-            self.clean_driver()
-            self.clean_tourguide()
+            conflicts = find_conflicts(self)
+            if conflicts:
+                raise ValidationError([str(conflict) for conflict in conflicts])
+
+
+class ResourceBusySlot(models.Model):
+    # derived from Task by main.handlers, one row per booked resource;
+    # rebuild with `manage.py rebuild_busy_slots`
+    resource_type = models.CharField(max_length=16, choices=RESOURCE_TYPE)
+    resource_id = models.PositiveIntegerField()
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+
+    task = models.ForeignKey(
+        Task, on_delete=models.CASCADE, related_name='busy_slots')
+
+    class Meta:
+        verbose_name = 'Resource Busy Slot'
+        verbose_name_plural = 'Resource Busy Slot'
+        indexes = [
+            models.Index(fields=['resource_type', 'resource_id', 'start_time', 'end_time'],
+                         name='main_slot_resource_idx'),
+            models.Index(fields=['start_time', 'end_time'],
+                         name='main_slot_time_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.resource_type, self.resource_id)
+
+
+class TaskChange(models.Model):
+    # written by main.handlers on every task change, the seq is the
+    # token of /tasks/changes/; prune with `manage.py prune_task_changes`
+    task_id = models.PositiveIntegerField()
+    action = models.CharField(max_length=16, choices=TASK_CHANGE)
+    # null for the admin-wide feed, else the participant the entry is for
+    staff_id = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # numbered in commit order once committed, see main.changes
+    seq = models.PositiveIntegerField(null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        verbose_name = 'Task Change'
+        verbose_name_plural = 'Task Change'
+        indexes = [
+            models.Index(fields=['staff_id', 'seq'], name='main_change_staff_seq_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.action, self.task_id)
+
+
+class TaskChangeSequence(models.Model):
+    # a single row: the last seq given to a TaskChange, and the last one
+    # pruned, below which tokens get a 410
+    last = models.PositiveIntegerField(default=0)
+    pruned = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '%d' % self.last
+
+
+class Upload(models.Model):
+    # a chunked upload in progress, see main.uploads; dropped when done,
+    # and with `manage.py clear_uploads` when never finished
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='uploads')
+    target = models.CharField(max_length=16, choices=UPLOAD_TARGET)
+    object_id = models.PositiveIntegerField()
+    filename = models.CharField(max_length=100)
+    size = models.PositiveIntegerField()
+    # hex SHA-256 of the whole file
+    checksum = models.CharField(max_length=64)
+    # bytes received so far
+    offset = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Upload'
+        verbose_name_plural = 'Upload'
+
+    def __str__(self):
+        return '%s %s' % (self.target, self.object_id)
 
 
 class Setting(models.Model):
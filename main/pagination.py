@@ -0,0 +1,192 @@
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+def flip(name):
+    return name[1:] if name.startswith('-') else '-' + name
+
+
+def cached_count(queryset, timeout=300):
+    """
+    ``COUNT(*)`` of ``queryset``, remembered for ``timeout`` seconds per
+    distinct query.
+    """
+    queryset = queryset.order_by()
+    sql, params = queryset.query.sql_with_params()
+    key = 'count:%s' % hashlib.md5(repr((sql, params)).encode('utf-8')).hexdigest()
+
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def estimated_count(queryset, timeout=300):
+    """
+    The planner's row estimate on PostgreSQL, a cached count elsewhere.
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+
+    if connection.vendor != 'postgresql':
+        return cached_count(queryset, timeout)
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ``ordering``, e.g. ``('-start_time', '-id')``.
+
+    Pages are fetched with ``WHERE (start_time, id) < (cursor)`` instead
+    of ``OFFSET`` so deep pages cost as much as the first one. Cursors
+    are opaque and stay valid while rows are added. No total is returned
+    unless asked for with ``?count=exact``, ``?count=cached`` or
+    ``?count=estimate``. ``?ordering=`` may only flip the direction of
+    the first field, any other ordering is ignored.
+    """
+
+    ordering = ('-id',)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering_query_param = 'ordering'
+    count_cache_timeout = 300
+
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, request):
+        if request.query_params.get(self.ordering_query_param) == flip(self.ordering[0]):
+            return tuple(flip(name) for name in self.ordering)
+        return tuple(self.ordering)
+
+    def encode_cursor(self, row, reverse):
+        position = [self.fields[name].value_to_string(row) for name in self.names]
+        data = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii'))
+            position = [self.fields[name].to_python(value)
+                        for name, value in zip(self.names, data['p'])]
+            if len(position) != len(self.names):
+                raise ValueError(cursor)
+            return position, bool(data['r'])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, position, reverse):
+        """
+        The rows that come after ``position`` in ``ordering``
+        (before it when ``reverse``).
+        """
+        condition = Q()
+        for i, name in enumerate(self.names):
+            descending = self.ordering[i].startswith('-') != reverse
+            lookup = '%s__%s' % (name, 'lt' if descending else 'gt')
+
+            step = Q(**{lookup: position[i]})
+            for previous in range(i):
+                step &= Q(**{self.names[previous]: position[previous]})
+            condition |= step
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request)
+        self.names = [name.lstrip('-') for name in self.ordering]
+        self.fields = {name: queryset.model._meta.get_field(name) for name in self.names}
+        self.page_size = self.get_page_size(request)
+        self.count = self.get_count(queryset, request.query_params.get(self.count_query_param))
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        position, reverse = self.decode_cursor(cursor) if cursor else (None, False)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [flip(name) for name in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(position, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = rows
+        return rows
+
+    def get_count(self, queryset, mode):
+        if mode == 'exact':
+            return queryset.order_by().count()
+        if mode == 'cached':
+            return cached_count(queryset, self.count_cache_timeout)
+        if mode == 'estimate':
+            return estimated_count(queryset, self.count_cache_timeout)
+        return None
+
+    def get_link(self, row, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(row, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.get_link(self.page[-1], False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.get_link(self.page[0], True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+        if self.count is not None:
+            response['count'] = self.count
+            response.move_to_end('count', last=False)
+        return Response(response)
+
+
+class TaskPagination(KeysetPagination):
+    ordering = ('-start_time', '-id')
@@ -1,7 +1,6 @@
 from rest_framework.permissions import BasePermission
-import logging
 
-logger = logging.getLogger('django')
+from .roles import get_roles
 
 
 class AllowAny(BasePermission):
@@ -35,20 +34,11 @@ class IsStaff(BasePermission):
 class IsStaffAdmin(BasePermission):
 
     def has_permission(self, request, view):
-        try:
-            return request.user and request.user.is_active and (request.user.is_superuser or request.user.staff.is_admin)
-        except Exception as e:
-            logger.info(e)
-
-        return False
+        return get_roles(request).is_staff_admin
 
 
 class IsStaffSelf(BasePermission):
 
     def has_object_permission(self, request, view, obj):
-        try:
-            return request.user and request.user.is_active and (request.user.id == obj.id or request.user.is_superuser or request.user.staff.is_admin)
-        except Exception as e:
-            logger.info(e)
-
-        return False
+        return request.user.is_active and (
+            request.user.id == obj.id or get_roles(request).is_staff_admin)
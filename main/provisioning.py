@@ -0,0 +1,69 @@
+from django.db import transaction
+
+from .scheduling import BATCH_SIZE
+
+
+# the permissions a role template grants, as app labels or
+# 'app_label.codename'; 'staff' is what a signup gets
+TEMPLATES = {
+    'staff': ['main'],
+}
+
+_permission_ids = {}
+
+
+def permission_ids(template):
+    """
+    The ids of the permissions ``template`` grants, read once per
+    process; ``clear_permission_ids`` drops them after a migration.
+    """
+    from django.contrib.auth.models import Permission
+    from django.db.models import Q
+
+    if template not in _permission_ids:
+        condition = Q(pk__in=[])
+        for name in TEMPLATES[template]:
+            if '.' in name:
+                app_label, codename = name.split('.', 1)
+                condition |= Q(content_type__app_label=app_label, codename=codename)
+            else:
+                condition |= Q(content_type__app_label=name)
+        _permission_ids[template] = frozenset(
+            Permission.objects.filter(condition).values_list('pk', flat=True))
+    return _permission_ids[template]
+
+
+def clear_permission_ids(**kwargs):
+    _permission_ids.clear()
+
+
+def assign_role(user_ids, template, replace=False):
+    """
+    Give ``user_ids`` the permissions of ``template`` with one bulk
+    insert into the user permission table, skipping those they have.
+    ``replace`` takes away every other permission first.
+
+    Returns the number of permissions added.
+    """
+    from django.contrib.auth.models import User
+
+    Through = User.user_permissions.through
+    user_ids = list(user_ids)
+    granted = permission_ids(template)
+
+    added = 0
+    with transaction.atomic():
+        for i in range(0, len(user_ids), BATCH_SIZE):
+            batch = user_ids[i:i + BATCH_SIZE]
+            current = Through.objects.filter(user__in=batch)
+            if replace:
+                current.exclude(permission__in=granted).delete()
+
+            existing = set(current.values_list('user', 'permission'))
+            rows = [Through(user_id=user_id, permission_id=permission_id)
+                    for user_id in batch for permission_id in granted
+                    if (user_id, permission_id) not in existing]
+            Through.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+            added += len(rows)
+
+    return added
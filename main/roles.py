@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+
+
+SUPERUSER = 1
+ADMIN = 2
+OPERATOR = 4
+DRIVER = 8
+TOURGUIDE = 16
+
+# the Staff flag behind each role
+FLAGS = [
+    (ADMIN, 'is_admin'),
+    (OPERATOR, 'is_operator'),
+    (DRIVER, 'is_driver'),
+    (TOURGUIDE, 'is_tourguide'),
+]
+
+SESSION_ROLES = '_roles'
+
+# the profile of a superuser is only read when asked for
+UNKNOWN = object()
+
+
+class Roles(object):
+    """
+    The roles of a user as a bitmask, with their ``Staff`` profile
+    loaded on first use. Inactive users have none, superusers need no
+    other.
+    """
+
+    def __init__(self, user, mask=0, staff_id=None, staff=None):
+        self.user = user
+        self.mask = mask
+        self._staff_id = staff_id
+        self._staff = staff
+        self._operated = {}
+
+    def has(self, roles):
+        return bool(self.mask & roles)
+
+    @property
+    def is_superuser(self):
+        return self.has(SUPERUSER)
+
+    @property
+    def is_admin(self):
+        return self.has(ADMIN)
+
+    @property
+    def is_operator(self):
+        return self.has(OPERATOR)
+
+    @property
+    def is_staff_admin(self):
+        return self.has(SUPERUSER | ADMIN)
+
+    @property
+    def staff_id(self):
+        if self._staff_id is UNKNOWN:
+            self._staff_id = self.staff and self._staff.pk
+        return self._staff_id
+
+    @property
+    def staff(self):
+        from .models import Staff
+
+        if self._staff is None and self._staff_id is not None:
+            query = {'pk': self.user.pk if self._staff_id is UNKNOWN else self._staff_id}
+            self._staff = Staff.objects.filter(**query).first()
+            self._staff_id = self._staff and self._staff.pk
+        return self._staff
+
+    def operates(self, task):
+        # asked several times per object by the admin change view
+        if task.pk not in self._operated:
+            from .models import Task
+
+            self._operated[task.pk] = self.staff_id is not None and \
+                Task.operator.through.objects.filter(task=task.pk, staff=self.staff_id).exists()
+        return self._operated[task.pk]
+
+
+def resolve(user):
+    """
+    Read the roles of ``user`` with at most one query for the profile,
+    none when ``user`` already is a ``Staff`` or a superuser.
+    """
+    from .models import Staff
+
+    if user is None or not user.is_authenticated:
+        return Roles(user)
+    if user.is_superuser and user.is_active and not isinstance(user, Staff):
+        return Roles(user, SUPERUSER, UNKNOWN)
+
+    staff = user if isinstance(user, Staff) else Staff.objects.filter(pk=user.pk).first()
+    mask = SUPERUSER if user.is_superuser else 0
+    if staff is not None:
+        for role, flag in FLAGS:
+            if getattr(staff, flag):
+                mask |= role
+
+    return Roles(user, mask if user.is_active else 0, staff and staff.pk, staff)
+
+
+def session_roles(request, user):
+    """
+    The roles kept in the session of ``user`` while no staff or user
+    changed since, when ``ROLES_SESSION_CACHE`` is on. Only sessions
+    logged in as ``user`` are used, token clients are left alone.
+    """
+    from .caching import get_versions, shared_versions, version_key
+    from .models import Staff
+
+    session = getattr(request, 'session', None)
+    if not settings.ROLES_SESSION_CACHE or not shared_versions() or session is None or \
+            not user.is_authenticated or session.get(SESSION_KEY) != str(user.pk):
+        return None
+
+    version = get_versions([Staff])[version_key(Staff)]
+    cached = session.get(SESSION_ROLES)
+    if cached is not None and cached[0] == version:
+        return Roles(user, cached[1], cached[2])
+
+    roles = resolve(user)
+    session[SESSION_ROLES] = [version, roles.mask, roles.staff_id]
+    return roles
+
+
+def get_roles(request):
+    """
+    Return the ``Roles`` of ``request.user``, resolved once per request.
+
+    Works with Django and REST framework requests alike; both keep the
+    result on the Django one.
+    """
+    http_request = getattr(request, '_request', request)
+    user = request.user
+
+    roles = getattr(http_request, '_roles', None)
+    if roles is None or roles.user is None or roles.user.pk != user.pk:
+        roles = session_roles(http_request, user) or resolve(user)
+        http_request._roles = roles
+    return roles
@@ -0,0 +1,216 @@
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Q, Exists, Min, OuterRef
+
+
+# the resources a task books, checked against every other task
+RESOURCES = ['vehicle', 'driver', 'tourguide']
+
+# a staff member is busy whether driving or guiding
+PERSONS = ['driver', 'tourguide']
+
+# slots are written in batches of this size
+BATCH_SIZE = 500
+
+
+class Conflict(namedtuple('Conflict', ['resource', 'label', 'task_id', 'start_time', 'end_time'])):
+
+    def __str__(self):
+        return '%s is busy from %s to %s (task %s)' % (
+            self.label,
+            self.start_time.strftime('%Y-%m-%d %H:%M'),
+            self.end_time.strftime('%Y-%m-%d %H:%M'),
+            self.task_id)
+
+
+class Bookings(object):
+    """
+    The bookings of one resource sorted by start time, with a running
+    maximum of the end times, so one bisect tells whether any of them
+    overlaps a window; a long booking hides no shorter one inside it.
+    """
+
+    def __init__(self, slots=()):
+        self.starts = []
+        # (end time, task id) of the booking ending last among those
+        # starting up to the same position
+        self.latest = []
+        for slot in sorted(slots):
+            self.add(*slot)
+
+    def add(self, start_time, end_time, task_id=None):
+        i = bisect_right(self.starts, start_time)
+        latest = (end_time, task_id)
+        if i and self.latest[i - 1][0] >= end_time:
+            latest = self.latest[i - 1]
+        self.starts.insert(i, start_time)
+        self.latest.insert(i, latest)
+        # the maxima after it are raised up to it
+        for j in range(i + 1, len(self.latest)):
+            if self.latest[j][0] >= latest[0]:
+                break
+            self.latest[j] = latest
+
+    def collides(self, start_time, end_time):
+        # (end time, task id) of the latest booking starting before end_time
+        i = bisect_left(self.starts, end_time)
+        if i and self.latest[i - 1][0] > start_time:
+            return self.latest[i - 1]
+        return None
+
+
+def overlapping(queryset, start_time, end_time):
+    # half-open intervals: a task ending at 10:00 does not collide
+    # with one starting at 10:00
+    return queryset.filter(start_time__lt=end_time, end_time__gt=start_time)
+
+
+def busy_slots(resource_types, start_time, end_time, exclude=None):
+    """
+    Return the ``ResourceBusySlot`` rows of ``resource_types`` that
+    overlap the window, leaving out the slots of task ``exclude``.
+    """
+    from .models import ResourceBusySlot
+
+    qs = overlapping(ResourceBusySlot.objects.filter(
+        resource_type__in=resource_types), start_time, end_time)
+    if exclude is not None:
+        qs = qs.exclude(task=exclude)
+    return qs
+
+
+def find_conflicts(task):
+    """
+    Return every booking that collides with the resources of ``task``.
+
+    All resources are checked in a single query on ``ResourceBusySlot``;
+    the result is a list of ``Conflict`` ordered by start time, empty
+    when the task is free.
+    """
+    if task.start_time is None or task.end_time is None:
+        return []
+
+    resources = {resource: getattr(task, '%s_id' % resource) for resource in RESOURCES}
+    vehicle = resources['vehicle']
+    persons = [resources[name] for name in PERSONS if resources[name] is not None]
+
+    condition = Q()
+    if vehicle is not None:
+        condition |= Q(resource_type='vehicle', resource_id=vehicle)
+    if persons:
+        condition |= Q(resource_type__in=PERSONS, resource_id__in=persons)
+    if not condition:
+        return []
+
+    slots = (busy_slots(RESOURCES, task.start_time, task.end_time, exclude=task.pk)
+             .filter(condition)
+             .order_by('start_time', 'task')
+             .values_list('resource_type', 'resource_id', 'task', 'start_time', 'end_time'))
+
+    conflicts = []
+    for resource_type, resource_id, task_id, start_time, end_time in slots:
+        for resource in RESOURCES:
+            if resources[resource] != resource_id:
+                continue
+            if (resource == 'vehicle') != (resource_type == 'vehicle'):
+                continue
+
+            conflict = Conflict(
+                resource, str(getattr(task, resource)), task_id, start_time, end_time)
+            # a person driving and guiding the other task shows up twice
+            if conflict not in conflicts:
+                conflicts.append(conflict)
+
+    return conflicts
+
+
+# the field shown to dispatchers for each resource
+LABELS = {
+    'vehicle': 'traffic_plate_no',
+    'driver': 'full_name',
+    'tourguide': 'full_name',
+}
+
+
+def available(resource, start_time, end_time, exclude=None):
+    """
+    Return ``(pk, label)`` pairs of the ``resource`` candidates that
+    are free between ``start_time`` and ``end_time``.
+
+    Busy candidates are dropped with a correlated
+    ``NOT EXISTS`` subquery, one query per resource.
+    """
+    from .models import Task
+
+    field = Task._meta.get_field(resource)
+    types = PERSONS if resource in PERSONS else [resource]
+
+    busy = busy_slots(types, start_time, end_time, exclude).filter(
+        resource_id=OuterRef('pk'))
+
+    return (field.related_model.objects
+            .filter(**field.get_limit_choices_to())
+            .annotate(busy=Exists(busy.values('pk')))
+            .filter(busy=False)
+            .order_by(LABELS[resource])
+            .values_list('pk', LABELS[resource]))
+
+
+def availability(start_time, end_time, exclude=None):
+    return {resource: available(resource, start_time, end_time, exclude)
+            for resource in RESOURCES}
+
+
+def expected_slots(task_ids):
+    """
+    Yield the ``(resource_type, resource_id, start_time, end_time, task_id)``
+    tuples ``Task`` implies for ``task_ids``, reading them in two queries.
+    """
+    from .models import Task
+
+    tasks = Task.objects.filter(pk__in=task_ids).values_list(
+        'id', 'start_time', 'end_time', 'vehicle_id', 'driver_id', 'tourguide_id')
+    times = {}
+    for id, start_time, end_time, vehicle, driver, tourguide in tasks:
+        times[id] = (start_time, end_time)
+        for resource_type, resource_id in zip(RESOURCES, (vehicle, driver, tourguide)):
+            if resource_id is not None:
+                yield resource_type, resource_id, start_time, end_time, id
+
+    operators = Task.operator.through.objects.filter(
+        task__in=task_ids).values_list('task', 'staff')
+    for task_id, staff_id in operators:
+        start_time, end_time = times[task_id]
+        yield 'operator', staff_id, start_time, end_time, task_id
+
+
+def sync_busy_slots(task_ids):
+    """
+    Rewrite the ``ResourceBusySlot`` rows of ``task_ids`` from ``Task``.
+
+    The handlers in ``main.handlers`` call this on every save; code that
+    bypasses signals (``update()``, ``bulk_create()``) must call it too.
+    """
+    from .models import ResourceBusySlot
+    from .analytics import periods_changed
+
+    task_ids = list(task_ids)
+    with transaction.atomic():
+        for i in range(0, len(task_ids), BATCH_SIZE):
+            batch = task_ids[i:i + BATCH_SIZE]
+            old = ResourceBusySlot.objects.filter(task__in=batch)
+            earliest = old.aggregate(earliest=Min('start_time'))['earliest']
+            old.delete()
+
+            slots = [ResourceBusySlot(resource_type=resource_type, resource_id=resource_id,
+                                      start_time=start_time, end_time=end_time, task_id=task_id)
+                     for resource_type, resource_id, start_time, end_time, task_id
+                     in expected_slots(batch)]
+            ResourceBusySlot.objects.bulk_create(slots, batch_size=BATCH_SIZE)
+
+            # the analytics of past days are cached
+            starts = [slot.start_time for slot in slots] + ([earliest] if earliest else [])
+            if starts:
+                periods_changed(min(starts))
@@ -1,5 +1,15 @@
+import datetime
+import os
+import re
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.conf import settings
+from django.core.files.storage import default_storage
 from rest_framework import serializers
-from .models import Staff, Vehicle, Task, BaseGroup, TLI, DLI, PPI
+from .models import Staff, Vehicle, Task, BaseGroup, TLI, DLI, PPI, Upload
+from .scheduling import RESOURCES
+from .analytics import GRANULARITY
+from .images import read_variants
 
 
 class DLISerializer(serializers.ModelSerializer):
@@ -27,24 +37,39 @@ class GroupSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class VariantsField(serializers.ReadOnlyField):
+    # the URLs of the image variants recorded by main.images
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = {}
+        for name, path in read_variants(value).items():
+            if name != 'source':
+                url = default_storage.url(path)
+                urls[name] = request.build_absolute_uri(url) if request is not None else url
+        return urls
+
+
 class StaffSerializer(serializers.ModelSerializer):
+    photo_variants = VariantsField()
 
     class Meta:
         model = Staff
-        fields = ['id', 'full_name', 'phone', 'photo', 'status',
+        fields = ['id', 'full_name', 'phone', 'photo', 'photo_variants', 'status',
                   'is_driver', 'is_tourguide', 'is_operator']
 
 
 class StaffDetailSerializer(serializers.ModelSerializer):
     group = GroupSerializer(many=True, read_only=True)
-    DLI = PPISerializer(many=False, read_only=False)
-    TLI = PPISerializer(many=False, read_only=False)
+    photo_variants = VariantsField()
+    DLI = DLISerializer(many=False, read_only=False)
+    TLI = TLISerializer(many=False, read_only=False)
     PPI = PPISerializer(many=False, read_only=False)
 
     class Meta:
         model = Staff
         exclude = ['password', 'first_name', 'last_name',
-                   'email', 'create_time', 'user_permissions']
+                   'email', 'create_time', 'user_permissions', 'token_version']
 
 
 class VehicleSerializer(serializers.ModelSerializer):
@@ -57,6 +82,7 @@ class VehicleSerializer(serializers.ModelSerializer):
 
 class VehicleDetailSerializer(serializers.ModelSerializer):
     group = GroupSerializer(many=True, read_only=True)
+    photo_variants = VariantsField()
 
     class Meta:
         model = Vehicle
@@ -64,8 +90,157 @@ class VehicleDetailSerializer(serializers.ModelSerializer):
 
 
 class TaskSerializer(serializers.ModelSerializer):
+    # integer keys in the database, plates and names in the API
+    vehicle = serializers.SlugRelatedField(
+        required=False, allow_null=True, slug_field='traffic_plate_no',
+        queryset=Vehicle.objects.filter(**Task._meta.get_field('vehicle').get_limit_choices_to()))
+    driver = serializers.SlugRelatedField(
+        required=False, allow_null=True, slug_field='full_name',
+        queryset=Staff.objects.filter(**Task._meta.get_field('driver').get_limit_choices_to()))
+    tourguide = serializers.SlugRelatedField(
+        required=False, allow_null=True, slug_field='full_name',
+        queryset=Staff.objects.filter(**Task._meta.get_field('tourguide').get_limit_choices_to()))
+    operator = serializers.SlugRelatedField(
+        many=True, required=False, slug_field='full_name',
+        queryset=Staff.objects.filter(**Task._meta.get_field('operator').get_limit_choices_to()))
+    author = serializers.SlugRelatedField(read_only=True, slug_field='full_name')
 
     class Meta:
         model = Task
         fields = ['id', 'uuid', 'create_time', 'start_time', 'end_time','remake',
-                  'vehicle', 'driver', 'tourguide', 'start_addr', 'end_addr']
+                  'vehicle', 'driver', 'tourguide', 'start_addr', 'end_addr',
+                  'operator', 'author']
+
+    def validate(self, attrs):
+        # run the same checks as the admin form, conflicts included
+        task = Task(pk=self.instance.pk if self.instance else None)
+        for field in ['start_time', 'end_time', 'vehicle', 'driver', 'tourguide']:
+            if field in attrs:
+                setattr(task, field, attrs[field])
+            elif self.instance is not None:
+                attname = Task._meta.get_field(field).attname
+                setattr(task, attname, getattr(self.instance, attname))
+
+        try:
+            task.clean()
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+
+        return attrs
+
+
+class AutoAssignSerializer(serializers.Serializer):
+    start_time = serializers.DateTimeField()
+    end_time = serializers.DateTimeField()
+    resources = serializers.MultipleChoiceField(choices=RESOURCES, required=False)
+    num_of_pass = serializers.IntegerField(required=False, min_value=1)
+
+    def validate(self, attrs):
+        if attrs['start_time'] > attrs['end_time']:
+            raise serializers.ValidationError('the end time must be after start time')
+
+        # form posts send an empty list when nothing is checked
+        if not attrs.get('resources'):
+            attrs['resources'] = ['vehicle', 'driver']
+        return attrs
+
+
+class ScheduleSerializer(serializers.ModelSerializer):
+    # the compact task of /tasks/mine/, names instead of nested objects
+    vehicle = serializers.StringRelatedField()
+    driver = serializers.StringRelatedField()
+    tourguide = serializers.StringRelatedField()
+    roles = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Task
+        fields = ['id', 'start_time', 'end_time', 'start_addr', 'end_addr', 'remake',
+                  'vehicle', 'driver', 'tourguide', 'roles']
+
+    def get_roles(self, task):
+        return self.context['roles'].get(task.pk, [])
+
+
+class ScheduleWindowSerializer(serializers.Serializer):
+    start_time = serializers.DateTimeField(required=False)
+    end_time = serializers.DateTimeField(required=False)
+
+    # longest window a device may ask for
+    max_days = 62
+
+    def validate(self, attrs):
+        start_time = attrs.get('start_time') or datetime.datetime.combine(
+            datetime.date.today(), datetime.time.min)
+        end_time = attrs.get('end_time') or start_time + datetime.timedelta(days=7)
+
+        if start_time > end_time:
+            raise serializers.ValidationError('the end time must be after start time')
+        if end_time - start_time > datetime.timedelta(days=self.max_days):
+            raise serializers.ValidationError('the window cannot be longer than %d days' % self.max_days)
+
+        return {'start_time': start_time, 'end_time': end_time}
+
+
+class BoardSerializer(ScheduleWindowSerializer):
+    resources = serializers.MultipleChoiceField(choices=RESOURCES, required=False)
+    group = serializers.PrimaryKeyRelatedField(queryset=BaseGroup.objects.all(), required=False)
+
+    max_days = 31
+
+    def validate(self, attrs):
+        window = super(BoardSerializer, self).validate(attrs)
+        # keep the order of RESOURCES whatever the query string says
+        resources = attrs.get('resources') or RESOURCES
+        window['resources'] = [resource for resource in RESOURCES if resource in resources]
+        window['group'] = attrs.get('group')
+        return window
+
+
+class UtilizationSerializer(serializers.Serializer):
+    resource = serializers.ChoiceField(choices=RESOURCES, default='vehicle')
+    granularity = serializers.ChoiceField(choices=GRANULARITY, default='day')
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    group = serializers.PrimaryKeyRelatedField(queryset=BaseGroup.objects.all(), required=False)
+
+    max_days = 366
+
+    def validate(self, attrs):
+        # the current month by default, end date included
+        start_date = attrs.get('start_date') or datetime.date.today().replace(day=1)
+        end_date = attrs.get('end_date') or (
+            start_date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+
+        if start_date > end_date:
+            raise serializers.ValidationError('the end date must be after start date')
+        if (end_date - start_date).days >= self.max_days:
+            raise serializers.ValidationError('the window cannot be longer than %d days' % self.max_days)
+
+        attrs.update(start_date=start_date, end_date=end_date, group=attrs.get('group'))
+        return attrs
+
+
+class UploadSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Upload
+        fields = ['id', 'target', 'object_id', 'filename', 'size', 'checksum', 'offset', 'created_at']
+        read_only_fields = ['offset', 'created_at']
+
+    def validate_filename(self, value):
+        # the name only, the field decides the directory
+        value = os.path.basename(value.replace('\\', '/'))
+        if not value:
+            raise serializers.ValidationError('a file name is required')
+        return value
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.CHUNKED_UPLOADS['MAX_SIZE']:
+            raise serializers.ValidationError(
+                'the size must be between 1 and %d bytes' % settings.CHUNKED_UPLOADS['MAX_SIZE'])
+        return value
+
+    def validate_checksum(self, value):
+        if not re.match(r'^[0-9a-fA-F]{64}$', value):
+            raise serializers.ValidationError('the checksum must be a hex SHA-256')
+        return value.lower()
@@ -1,3 +1,1407 @@
-from django.test import TestCase
+import base64
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Permission, User, update_last_login
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from oauth2_provider.models import AccessToken, Application
+from PIL import Image as PILImage
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from .events import Hub, LocalBackend, SQLiteBackend, task_filter
+from .models import (
+    Staff, Vehicle, Task, TaskChange, BaseGroup, DLI, Setting, Image, Upload, ResourceBusySlot)
+from .roles import ADMIN, DRIVER, OPERATOR, SUPERUSER, get_roles
+from .authentication import TokenUser, token_cache
+from .images import read_variants
+from .dispatch import auto_assign
+from .caching import get_versions, version_key
+from .changes import prune_changes
+from .scheduling import available, find_conflicts
+from .views import TaskViewSet
+
+
+# version counters every worker shares, as behind memcached; the locmem
+# default of the settings turns the caching on them off
+shared_cache = override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'dispature-tests-cache'),
+}})
+local_cache = override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+}})
+
+
+def make_staff(name, **kwargs):
+    # Staff.save() takes no arguments, so objects.create() is out
+    staff = Staff(username=name, full_name=name, phone=name, **kwargs)
+    staff.save()
+    return staff
+
+
+def make_vehicle(plate):
+    day = datetime.date(2018, 1, 1)
+    return Vehicle.objects.create(
+        model_name='test', eng_no=plate, chassis_no=plate, traffic_plate_no=plate,
+        policy_no=plate, exp_date=day, reg_date=day, ins_exp=day)
+
+
+class QueryCountTest(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_authenticate(self.admin)
+        self.start = datetime.datetime(2018, 1, 1, 8)
+        self.group = BaseGroup.objects.create(name='fleet', type_name='vehicle')
+
+    def make_tasks(self, count):
+        for i in range(Task.objects.count(), count):
+            vehicle = make_vehicle('P%d' % i)
+            vehicle.group.add(self.group)
+            task = Task.objects.create(
+                start_time=self.start, end_time=self.start + datetime.timedelta(hours=1),
+                start_addr='a', end_addr='b', vehicle=vehicle,
+                driver=make_staff('driver%d' % i, is_driver=True),
+                tourguide=make_staff('guide%d' % i, is_tourguide=True),
+                author=make_staff('author%d' % i, is_operator=True))
+            task.operator.add(make_staff('operator%d' % i, is_operator=True))
+
+    def test_task_list(self):
+        # page and operator prefetch, the ETag is built from them; no
+        # COUNT(*) unless asked for
+        for size in (1, 20):
+            self.make_tasks(size)
+            with self.assertNumQueries(2):
+                response = self.client.get('/tasks/')
+            self.assertEqual(len(response.data['results']), size)
+            self.assertNotIn('count', response.data)
+
+        task = response.data['results'][0]
+        self.assertTrue(task['operator'][0].startswith('operator'))
+        self.assertTrue(task['author'].startswith('author'))
+
+    def test_staff_detail(self):
+        staff = make_staff('driver', is_driver=True)
+        staff.group.add(BaseGroup.objects.create(name='drivers', type_name='staff'))
+        DLI.objects.bulk_create([DLI(
+            staff=staff, driving_license_no='1', driver_code='1',
+            date_of_issue=datetime.date(2018, 1, 1), date_of_expiry=datetime.date(2020, 1, 1))])
+
+        # ETag, staff with its licenses, groups, auth groups
+        with self.assertNumQueries(4):
+            response = self.client.get('/staffs/%d/' % staff.pk)
+        self.assertEqual(response.data['DLI']['driving_license_no'], '1')
+
+    def test_vehicle_detail(self):
+        self.make_tasks(1)
+        vehicle = Vehicle.objects.get()
+
+        # ETag, vehicle, groups
+        with self.assertNumQueries(3):
+            response = self.client.get('/vehicles/%d/' % vehicle.pk)
+        self.assertEqual(response.data['group'][0]['name'], 'fleet')
+
+
+class KeysetPaginationTest(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_authenticate(self.admin)
+        start = datetime.datetime(2018, 1, 1, 8)
+        # pairs of tasks share a start time so the id breaks the tie
+        Task.objects.bulk_create([Task(
+            start_time=start + datetime.timedelta(hours=i // 2),
+            end_time=start + datetime.timedelta(hours=i // 2 + 1),
+            start_addr='a', end_addr='b') for i in range(7)])
+        self.expected = list(Task.objects.order_by('-start_time', '-id').values_list('id', flat=True))
+
+    def walk(self, url, key):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            page = [task['id'] for task in response.data['results']]
+            ids = ids + page if key == 'next' else page + ids
+            url = response.data[key]
+        return ids, response
+
+    def test_cursor_walk(self):
+        ids, last = self.walk('/tasks/?page_size=3', 'next')
+        self.assertEqual(ids, self.expected)
+
+        # and back from the last page
+        ids, first = self.walk(last.data['previous'], 'previous')
+        self.assertEqual(ids, self.expected[:6])
+
+    def test_ascending(self):
+        ids, response = self.walk('/tasks/?page_size=3&ordering=start_time', 'next')
+        self.assertEqual(ids, list(reversed(self.expected)))
+
+    def test_count(self):
+        for mode in ('exact', 'cached', 'estimate'):
+            response = self.client.get('/tasks/?count=%s' % mode)
+            self.assertEqual(response.data['count'], 7)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/tasks/?cursor=nonsense').status_code, 404)
+
+
+class ExportTest(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_authenticate(self.admin)
+        start = datetime.datetime(2018, 1, 1, 8)
+        for i in range(3):
+            task = Task.objects.create(
+                start_time=start, end_time=start + datetime.timedelta(hours=1),
+                start_addr='a%d' % i, end_addr='b', vehicle=make_vehicle('P%d' % i),
+                driver=make_staff('driver%d' % i, is_driver=True))
+            task.operator.add(make_staff('operator%d' % i, is_operator=True),
+                              make_staff('clerk%d' % i, is_operator=True))
+
+    def test_csv(self):
+        response = self.client.get('/tasks/export/?start_addr=a1')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'start_time', 'end_time'])
+        self.assertEqual(len(lines), 2)
+        self.assertIn('P1,driver1,,,', lines[1])
+        self.assertTrue(lines[1].endswith('clerk1;operator1'))
+
+    def test_ndjson(self):
+        response = self.client.get('/staffs/export/?file_format=ndjson&is_driver=True')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['full_name'] for row in rows], ['driver0', 'driver1', 'driver2'])
+
+    def test_admin_only(self):
+        self.client.force_authenticate(make_staff('someone'))
+        self.assertEqual(self.client.get('/vehicles/export/').status_code, 403)
+
+
+@shared_cache
+class ConditionalGetTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_authenticate(self.admin)
+        self.vehicle = make_vehicle('P1')
+
+    def test_list(self):
+        response = self.client.get('/vehicles/')
+        etag = response['ETag']
+
+        # the version counters behind the ETag come from the cache
+        with self.assertNumQueries(0):
+            response = self.client.get('/vehicles/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.vehicle.group.add(BaseGroup.objects.create(name='fleet', type_name='vehicle'))
+        response = self.client.get('/vehicles/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # deletions change the ETag too
+        etag = response['ETag']
+        self.vehicle.delete()
+        self.assertEqual(self.client.get('/vehicles/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @local_cache
+    def test_local_cache(self):
+        # a write on another worker bumps no version seen here, the rows tell
+        etag = self.client.get('/vehicles/')['ETag']
+        Vehicle.objects.filter(pk=self.vehicle.pk).update(
+            model_name='other', updated_at=self.vehicle.updated_at + datetime.timedelta(seconds=5))
+        response = self.client.get('/vehicles/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data['results'][0]['model_name']), (200, 'other'))
+
+    def test_task_related(self):
+        driver = make_staff('driver', is_driver=True)
+        start = datetime.datetime(2018, 1, 1, 8)
+        task = Task.objects.create(
+            start_time=start, end_time=start + datetime.timedelta(hours=1),
+            start_addr='a', end_addr='b', driver=driver)
+        detail = self.client.get('/tasks/%d/' % task.pk)
+        listing = self.client.get('/tasks/')
+
+        # the task row is untouched, the driver name it shows is not
+        Staff.objects.filter(pk=driver.pk).update(
+            full_name='renamed', updated_at=driver.updated_at + datetime.timedelta(seconds=5))
+        response = self.client.get('/tasks/%d/' % task.pk, HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual((response.status_code, response.data['driver']), (200, 'renamed'))
+        response = self.client.get('/tasks/%d/' % task.pk, HTTP_IF_MODIFIED_SINCE=detail['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/tasks/', HTTP_IF_NONE_MATCH=listing['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/tasks/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_group_rename(self):
+        group = BaseGroup.objects.create(name='fleet', type_name='vehicle')
+        self.vehicle.group.add(group)
+        response = self.client.get('/vehicles/%d/' % self.vehicle.pk)
+
+        group.name = 'renamed'
+        group.save()
+        response = self.client.get('/vehicles/%d/' % self.vehicle.pk, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, response.data['group'][0]['name']), (200, 'renamed'))
+
+    def test_retrieve(self):
+        staff = make_staff('driver', is_driver=True)
+        response = self.client.get('/staffs/%d/' % staff.pk)
+        last_modified = response['Last-Modified']
+
+        response = self.client.get('/staffs/%d/' % staff.pk, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        Staff.objects.filter(pk=staff.pk).update(
+            updated_at=staff.updated_at + datetime.timedelta(seconds=5))
+        response = self.client.get('/staffs/%d/' % staff.pk, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+
+@shared_cache
+class ResponseCacheTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_authenticate(self.admin)
+        self.group = BaseGroup.objects.create(name='fleet', type_name='vehicle')
+
+    def test_list(self):
+        self.client.get('/groups/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/groups/')
+        self.assertEqual(response.data['count'], 1)
+
+        BaseGroup.objects.create(name='drivers', type_name='staff')
+        self.assertEqual(self.client.get('/groups/').data['count'], 2)
+
+    @local_cache
+    def test_local_cache(self):
+        self.client.get('/groups/')
+        BaseGroup.objects.filter(pk=self.group.pk).update(name='renamed')
+        self.assertEqual(self.client.get('/groups/').data['results'][0]['name'], 'renamed')
+
+    def test_m2m(self):
+        vehicle = make_vehicle('P1')
+        self.client.get('/vehicles/%d/' % vehicle.pk)
+        vehicle.group.add(self.group)
+        response = self.client.get('/vehicles/%d/' % vehicle.pk)
+        self.assertEqual(response.data['group'][0]['name'], 'fleet')
+
+    def test_user_saved(self):
+        staff = make_staff('driver')
+        versions = get_versions([User, Staff])
+
+        # logging in saves last_login only, that drops no cache
+        update_last_login(None, User.objects.get(pk=staff.pk))
+        self.assertEqual(get_versions([User, Staff]), versions)
+
+        user = User.objects.get(pk=staff.pk)
+        user.is_active = False
+        user.save()
+        changed = get_versions([User, Staff])
+        self.assertNotEqual(changed[version_key(User)], versions[version_key(User)])
+        self.assertNotEqual(changed[version_key(Staff)], versions[version_key(Staff)])
+
+    def test_per_user(self):
+        staff, other = make_staff('driver'), make_staff('guide')
+        self.client.get('/staffs/%d/' % other.pk)
+
+        # the admin's entry must not bypass the object permission
+        self.client.force_authenticate(staff)
+        self.assertEqual(self.client.get('/staffs/%d/' % other.pk).status_code, 403)
+
+
+class ChangesFeedTest(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.driver = make_staff('driver', is_driver=True)
+        self.other = make_staff('other', is_driver=True)
+        start = datetime.datetime(2018, 1, 1, 8)
+        self.task = Task.objects.create(
+            start_time=start, end_time=start + datetime.timedelta(hours=1),
+            start_addr='a', end_addr='b', driver=self.driver)
+
+    def feed(self, user, since=None, **params):
+        self.client.force_authenticate(user)
+        if since is not None:
+            params['since'] = since
+        return self.client.get('/tasks/changes/', params)
+
+    def test_sync(self):
+        response = self.feed(self.driver, 0)
+        self.assertEqual([task['id'] for task in response.data['changed']], [self.task.pk])
+        token = response.data['token']
+
+        self.assertEqual(self.feed(self.driver, token).data['changed'], [])
+
+        # reassigned: a tombstone for the old driver, the task for the new one
+        self.task.driver = self.other
+        self.task.save()
+        self.assertEqual(self.feed(self.driver, token).data['deleted'], [self.task.pk])
+        self.assertEqual(len(self.feed(self.other, token).data['changed']), 1)
+
+        pk = self.task.pk
+        self.task.delete()
+        response = self.feed(self.admin, token)
+        self.assertEqual((response.data['changed'], response.data['deleted']), ([], [pk]))
+
+    def test_author_changed(self):
+        author = make_staff('author', is_operator=True)
+        self.task.author = author
+        self.task.save()
+        token = self.feed(author, 0).data['token']
+
+        # the author is saved with the task, not through the busy slots
+        self.task.author = make_staff('next', is_operator=True)
+        self.task.save()
+        self.assertEqual(self.feed(author, token).data['deleted'], [self.task.pk])
+        self.assertEqual(TaskChange.objects.filter(
+            task_id=self.task.pk, staff_id=author.pk).latest('id').action, 'removed')
+
+    def test_late_commit(self):
+        # a transaction that took the first id but commits last
+        late = TaskChange.objects.filter(staff_id__isnull=True).earliest('id')
+        late.delete()
+        token = self.feed(self.admin, 0).data['token']
+        self.assertEqual(self.feed(self.admin, token).data['changed'], [])
+
+        late.save()
+        response = self.feed(self.admin, token)
+        self.assertEqual([task['id'] for task in response.data['changed']], [self.task.pk])
+        self.assertGreater(int(response.data['token']), int(token))
+
+    def test_pruned(self):
+        token = self.feed(self.admin).data['token']
+        self.task.save()
+        self.assertEqual(prune_changes(-1), 4)
+        self.assertFalse(TaskChange.objects.exists())
+
+        # the log is empty but what came after the token is gone
+        self.assertEqual(self.feed(self.admin, token).status_code, 410)
+        self.assertEqual(self.feed(self.admin, -5).status_code, 410)
+        token = self.feed(self.admin).data['token']
+        self.task.save()
+        self.assertEqual(len(self.feed(self.admin, token).data['changed']), 1)
+
+
+class ConflictTest(APITestCase):
+
+    def setUp(self):
+        self.day = datetime.datetime(2018, 1, 1)
+        self.vehicle = make_vehicle('P1')
+        self.staff = make_staff('staff', is_driver=True, is_tourguide=True)
+        self.booked = self.make_task(8, 10, vehicle=self.vehicle, driver=self.staff)
+
+    def make_task(self, start, end, save=True, **kwargs):
+        task = Task(start_time=self.day.replace(hour=start), end_time=self.day.replace(hour=end),
+                    start_addr='a', end_addr='b', **kwargs)
+        if save:
+            task.save()
+        return task
+
+    def test_overlap(self):
+        conflicts = find_conflicts(self.make_task(9, 11, save=False, vehicle=self.vehicle))
+        self.assertEqual([(conflict.resource, conflict.task_id) for conflict in conflicts],
+                         [('vehicle', self.booked.pk)])
+        self.assertEqual(str(conflicts[0]), 'P1 is busy from 2018-01-01 08:00 to 2018-01-01 10:00 (task %d)' % self.booked.pk)
+
+        # half-open: touching either end is free
+        self.assertEqual(find_conflicts(self.make_task(10, 11, save=False, vehicle=self.vehicle)), [])
+        self.assertEqual(find_conflicts(self.make_task(7, 8, save=False, vehicle=self.vehicle)), [])
+
+    def test_edited_task(self):
+        # moving a task over its own old slot is no conflict
+        self.booked.end_time = self.day.replace(hour=11)
+        self.assertEqual(find_conflicts(self.booked), [])
+
+    def test_driver_and_guide(self):
+        # driving one task and guiding the other collide
+        conflicts = find_conflicts(self.make_task(9, 10, save=False, tourguide=self.staff))
+        self.assertEqual([conflict.resource for conflict in conflicts], ['tourguide'])
+
+        conflicts = find_conflicts(self.make_task(9, 10, save=False, driver=self.staff, tourguide=self.staff))
+        self.assertEqual([conflict.resource for conflict in conflicts], ['driver', 'tourguide'])
+
+        # a task the staff drives and guides shows up once per resource
+        both = self.make_task(12, 14, driver=self.staff, tourguide=self.staff)
+        conflicts = find_conflicts(self.make_task(13, 15, save=False, driver=self.staff))
+        self.assertEqual([(conflict.resource, conflict.task_id) for conflict in conflicts],
+                         [('driver', both.pk)])
+
+    def test_available(self):
+        start, end = self.day.replace(hour=9), self.day.replace(hour=10)
+        self.assertEqual(list(available('vehicle', start, end)), [])
+        self.assertEqual(list(available('driver', start, end)), [])
+        # busy driving, so not free to guide either
+        self.assertEqual(list(available('tourguide', start, end)), [])
+
+        self.assertEqual(list(available('driver', end, end + datetime.timedelta(hours=1))),
+                         [(self.staff.pk, 'staff')])
+        self.assertEqual(list(available('vehicle', start, end, exclude=self.booked.pk)),
+                         [(self.vehicle.pk, 'P1')])
+        self.assertEqual(list(available('tourguide', start, end, exclude=self.booked.pk)),
+                         [(self.staff.pk, 'staff')])
+
+    def test_availability_view(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        params = {'start_time': '2018-01-01 09:00', 'end_time': '2018-01-01 10:00'}
+
+        response = self.client.get('/admin/availability/', params)
+        self.assertEqual(json.loads(b''.join(response.streaming_content).decode()),
+                         {'driver': [], 'tourguide': [], 'vehicle': []})
+
+        # the task being changed does not block itself
+        response = self.client.get('/admin/availability/', dict(params, task=self.booked.pk))
+        self.assertEqual(json.loads(b''.join(response.streaming_content).decode())['vehicle'],
+                         [[self.vehicle.pk, 'P1']])
+
+        response = self.client.get('/admin/availability/', dict(params, task='1 OR 1'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('task', json.loads(response.content.decode()))
+
+
+class BusySlotTest(APITestCase):
+
+    def setUp(self):
+        self.start = datetime.datetime(2018, 1, 1, 8)
+        self.vehicle = make_vehicle('P1')
+        self.driver = make_staff('driver', is_driver=True)
+        self.operator = make_staff('operator', is_operator=True)
+        self.task = Task.objects.create(
+            start_time=self.start, end_time=self.start + datetime.timedelta(hours=2),
+            start_addr='a', end_addr='b', vehicle=self.vehicle, driver=self.driver)
+
+    def slots(self):
+        return set(ResourceBusySlot.objects.values_list(
+            'resource_type', 'resource_id', 'start_time', 'end_time', 'task'))
+
+    def test_task_saved(self):
+        end = self.start + datetime.timedelta(hours=2)
+        self.assertEqual(self.slots(), {
+            ('vehicle', self.vehicle.pk, self.start, end, self.task.pk),
+            ('driver', self.driver.pk, self.start, end, self.task.pk)})
+
+        # moved and without a vehicle
+        self.task.start_time += datetime.timedelta(days=1)
+        self.task.end_time += datetime.timedelta(days=1)
+        self.task.vehicle = None
+        self.task.save()
+        self.assertEqual(self.slots(), {
+            ('driver', self.driver.pk, self.task.start_time, self.task.end_time, self.task.pk)})
+
+        self.task.delete()
+        self.assertEqual(self.slots(), set())
+
+    def test_operators(self):
+        self.task.operator.add(self.operator)
+        self.assertIn(('operator', self.operator.pk), {slot[:2] for slot in self.slots()})
+
+        self.task.operator.remove(self.operator)
+        self.assertNotIn('operator', {slot[0] for slot in self.slots()})
+
+        # from the staff side, and cleared from there
+        self.operator.operator_task.add(self.task)
+        self.assertIn(('operator', self.operator.pk), {slot[:2] for slot in self.slots()})
+        self.operator.operator_task.clear()
+        self.assertNotIn('operator', {slot[0] for slot in self.slots()})
+
+    def test_rebuild(self):
+        self.task.operator.add(self.operator)
+        expected = self.slots()
+
+        ResourceBusySlot.objects.filter(resource_type='driver').delete()
+        # slots written around the signals
+        Task.objects.filter(pk=self.task.pk).update(end_time=self.start + datetime.timedelta(hours=3))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_busy_slots', '--check', stdout=io.StringIO())
+
+        call_command('rebuild_busy_slots', stdout=io.StringIO())
+        self.assertEqual(self.slots(), {slot[:3] + (self.start + datetime.timedelta(hours=3), slot[4])
+                                        for slot in expected})
+        call_command('rebuild_busy_slots', '--check', stdout=io.StringIO())
+
+
+class ImportTest(APITestCase):
+
+    header = 'start_time,end_time,start_addr,end_addr,vehicle,driver,tourguide\n'
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_authenticate(self.admin)
+        self.vehicle = make_vehicle('P1')
+        self.driver = make_staff('driver', is_driver=True)
+        self.guide = make_staff('guide', is_tourguide=True)
+
+    def post(self, lines, **params):
+        url = '/tasks/import/'
+        if params:
+            url += '?' + '&'.join('%s=%s' % item for item in params.items())
+        return self.client.generic('POST', url, self.header + '\n'.join(lines), content_type='text/csv')
+
+    def test_valid(self):
+        response = self.post([
+            '2018-01-01 08:00,2018-01-01 10:00,a,b,P1,driver,guide',
+            '2018-01-01 10:00,2018-01-01 12:00,b,c,P1,driver,',
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'created': 2, 'valid': 2, 'errors': []})
+
+        tasks = Task.objects.order_by('start_time')
+        self.assertEqual([(task.vehicle, task.driver) for task in tasks], [(self.vehicle, self.driver)] * 2)
+        self.assertEqual(tasks[0].tourguide, self.guide)
+        # written around the signals, so synced explicitly
+        self.assertEqual(ResourceBusySlot.objects.count(), 5)
+        self.assertEqual(TaskChange.objects.filter(staff_id__isnull=True, action='created').count(), 2)
+
+    def test_invalid_rows(self):
+        response = self.post([
+            '2018-01-01 08:00,2018-01-01 10:00,,b,,,',
+            '2018-01-01 10:00,2018-01-01 09:00,a,b,,,',
+            '2018-01-01 10:00,2018-01-01 11:00,a,b,P9,driver,driver',
+            '2018-01-01 10:00,2018-01-01 11:00,a,b,P9,,',
+            '2018-01-01 12:00,2018-01-01 13:00,a,b,,,',
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([(error['row'], error['errors']) for error in response.data['errors']], [
+            (1, ['start_addr: This field is required.']),
+            (2, ['the end time must be after start time']),
+            (3, ['driver cannot be driver and tourguide']),
+            (4, ['vehicle: P9 is not available']),
+        ])
+
+        # nothing written on a dry run, or when every row fails
+        self.assertEqual(self.post(['2018-01-02 08:00,2018-01-02 09:00,a,b,,,'], dry_run=1).data,
+                         {'created': 0, 'valid': 1, 'errors': []})
+        self.assertEqual(self.post(['2018-01-02 08:00,2018-01-02 09:00,,b,,,']).status_code, 400)
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_conflicts(self):
+        booked = Task.objects.create(
+            start_time=datetime.datetime(2018, 1, 1, 8), end_time=datetime.datetime(2018, 1, 1, 18),
+            start_addr='a', end_addr='b', driver=self.driver)
+
+        response = self.post([
+            '2018-01-02 09:00,2018-01-02 11:00,a,b,P1,,',
+            '2018-01-01 12:00,2018-01-01 13:00,a,b,,driver,',
+            '2018-01-02 10:00,2018-01-02 12:00,a,b,P1,,',
+            '2018-01-02 11:00,2018-01-02 12:00,a,b,P1,,guide',
+        ])
+        self.assertEqual([(error['row'], error['errors']) for error in response.data['errors']], [
+            (2, ['driver is busy until 2018-01-01 18:00 (task %d)' % booked.pk]),
+            (3, ['P1 is busy until 2018-01-02 11:00 (row 1)']),
+        ])
+        self.assertEqual(response.data['created'], 2)
+
+
+class ScheduleTest(APITestCase):
+
+    def setUp(self):
+        self.staff = make_staff('staff', is_driver=True, is_tourguide=True, is_operator=True)
+        self.start = datetime.datetime.combine(datetime.date.today(), datetime.time(8))
+
+    def make_task(self, days, **kwargs):
+        start = self.start + datetime.timedelta(days=days)
+        return Task.objects.create(start_time=start, end_time=start + datetime.timedelta(hours=1),
+                                   start_addr='a', end_addr='b', **kwargs)
+
+    def test_mine(self):
+        driving = self.make_task(1, driver=self.staff, vehicle=make_vehicle('P1'))
+        guiding = self.make_task(2, tourguide=self.staff)
+        operating = self.make_task(0)
+        operating.operator.add(self.staff)
+        self.make_task(3)
+        self.make_task(30, driver=self.staff)
+
+        self.client.force_authenticate(self.staff)
+        # slots, tasks with their vehicle and people
+        with self.assertNumQueries(2):
+            response = self.client.get('/tasks/mine/')
+
+        self.assertEqual([(task['id'], task['roles']) for task in response.data], [
+            (operating.pk, ['operator']), (driving.pk, ['driver']), (guiding.pk, ['tourguide'])])
+        self.assertEqual(response.data[1]['vehicle'], 'P1')
+
+        response = self.client.get('/tasks/mine/', {
+            'start_time': (self.start + datetime.timedelta(days=29)).strftime('%Y-%m-%d %H:%M'),
+            'end_time': (self.start + datetime.timedelta(days=31)).strftime('%Y-%m-%d %H:%M')})
+        self.assertEqual(len(response.data), 1)
+
+    def test_not_staff(self):
+        self.client.force_authenticate(User.objects.create_user('user'))
+        self.assertEqual(self.client.get('/tasks/mine/').status_code, 403)
+
+
+
+class AutoAssignTest(APITestCase):
+
+    def setUp(self):
+        self.day = datetime.datetime(2018, 1, 1)
+
+    def make_task(self, start, end, **kwargs):
+        return Task.objects.create(
+            start_time=self.day.replace(hour=start), end_time=self.day.replace(hour=end),
+            start_addr='a', end_addr='b', **kwargs)
+
+    def test_nested_bookings(self):
+        driver = make_staff('driver', is_driver=True)
+        self.make_task(8, 18, driver=driver)
+        self.make_task(9, 10, driver=driver)
+        early = self.make_task(7, 8)
+        task = self.make_task(12, 13)
+
+        # the short booking inside the long one must not hide it
+        result = auto_assign(Task.objects.filter(driver=None), resources=['driver'])
+        self.assertEqual(result['assigned']['driver'], 1)
+        self.assertEqual(result['unassigned'], [task.pk])
+        self.assertEqual(Task.objects.get(pk=early.pk).driver, driver)
+        self.assertIsNone(Task.objects.get(pk=task.pk).driver)
+
+    def test_driver_and_guide(self):
+        staff = make_staff('staff', is_driver=True, is_tourguide=True)
+        task = self.make_task(8, 10)
+
+        # one person cannot drive and guide the same task
+        result = auto_assign(Task.objects.all(), resources=['driver', 'tourguide'])
+        self.assertEqual(result['assigned'], {'driver': 1, 'tourguide': 0})
+        self.assertEqual(result['unassigned'], [task.pk])
+        task = Task.objects.get(pk=task.pk)
+        self.assertEqual((task.driver, task.tourguide), (staff, None))
+
+        # nor drive while guiding another
+        self.make_task(12, 18, tourguide=staff)
+        task = self.make_task(13, 14)
+        result = auto_assign(Task.objects.filter(pk=task.pk), resources=['driver'])
+        self.assertEqual(result['unassigned'], [task.pk])
+
+
+class BoardTest(APITestCase):
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        self.start = datetime.datetime(2018, 1, 1)
+        self.fleet = BaseGroup.objects.create(name='fleet', type_name='vehicle')
+
+    def make_task(self, hours, length, **kwargs):
+        start = self.start + datetime.timedelta(hours=hours)
+        return Task.objects.create(start_time=start, end_time=start + datetime.timedelta(hours=length),
+                                   start_addr='a', end_addr='b', **kwargs)
+
+    def get(self, **params):
+        params.setdefault('start_time', '2018-01-01 00:00')
+        params.setdefault('end_time', '2018-01-02 00:00')
+        return self.client.get('/tasks/board/', params)
+
+    def test_columns(self):
+        idle, busy = make_vehicle('P1'), make_vehicle('P2')
+        driver = make_staff('driver', is_driver=True)
+        late = self.make_task(10, 2, vehicle=busy, driver=driver)
+        early = self.make_task(-1, 3, vehicle=busy)
+        self.make_task(30, 1, vehicle=idle)
+
+        # the rows of each resource, then every slot at once
+        with self.assertNumQueries(4):
+            response = self.get()
+        self.assertEqual(response.status_code, 200)
+
+        vehicles = response.data['resources']['vehicle']
+        self.assertEqual(vehicles['id'], [idle.pk, busy.pk])
+        self.assertEqual(vehicles['label'], ['P1', 'P2'])
+        self.assertEqual(vehicles['offsets'], [0, 0, 2])
+        self.assertEqual(vehicles['task'], [early.pk, late.pk])
+        self.assertEqual(vehicles['start'], [-60, 600])
+        self.assertEqual(vehicles['duration'], [180, 120])
+
+        drivers = response.data['resources']['driver']
+        self.assertEqual((drivers['id'], drivers['offsets'], drivers['task']),
+                         ([driver.pk], [0, 1], [late.pk]))
+
+    def test_group(self):
+        member, other = make_vehicle('P1'), make_vehicle('P2')
+        member.group.add(self.fleet)
+        task = self.make_task(1, 1, vehicle=member)
+        self.make_task(1, 1, vehicle=other)
+
+        vehicles = self.get(group=self.fleet.pk, resources='vehicle').data['resources']['vehicle']
+        self.assertEqual((vehicles['id'], vehicles['task']), ([member.pk], [task.pk]))
+
+        self.assertEqual(self.get(end_time='2018-03-01 00:00').status_code, 400)
+        self.client.force_authenticate(make_staff('driver', is_driver=True))
+        self.assertEqual(self.get().status_code, 403)
+
+
+
+@shared_cache
+class UtilizationTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        self.vehicle = make_vehicle('P1')
+        self.vehicle.rate = 240
+        self.vehicle.save()
+
+    def make_task(self, start, hours):
+        return Task.objects.create(start_time=start, end_time=start + datetime.timedelta(hours=hours),
+                                   start_addr='a', end_addr='b', vehicle=self.vehicle)
+
+    def get(self, **params):
+        params.setdefault('start_date', '2018-01-01')
+        params.setdefault('end_date', '2018-01-03')
+        return self.client.get('/tasks/utilization/', params)
+
+    def test_days(self):
+        make_vehicle('P2')
+        # across midnight, then a second booking of the next day
+        self.make_task(datetime.datetime(2018, 1, 1, 22), 4)
+        self.make_task(datetime.datetime(2018, 1, 2, 10), 6)
+
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['periods'], ['2018-01-01', '2018-01-02', '2018-01-03'])
+        self.assertEqual(response.data['label'], ['P1', 'P2'])
+        self.assertEqual(response.data['available_hours'], [24, 24, 24])
+        self.assertEqual(response.data['booked_hours'], [[2, 8, 0], [0, 0, 0]])
+        self.assertEqual(response.data['utilization'][0], [0.0833, 0.3333, 0])
+        self.assertEqual(response.data['revenue'][0], [20, 80, 0])
+        self.assertEqual(response.data['total']['available_hours'], [48, 48, 48])
+        self.assertEqual(response.data['total']['booked_hours'], [2, 8, 0])
+
+    def test_periods(self):
+        self.make_task(datetime.datetime(2018, 1, 7, 12), 24)
+
+        response = self.get(start_date='2018-01-03', end_date='2018-02-02', granularity='week')
+        self.assertEqual(response.data['periods'][:3], ['2018-01-03', '2018-01-08', '2018-01-15'])
+        self.assertEqual(response.data['available_hours'][:2], [5 * 24, 7 * 24])
+        self.assertEqual(response.data['booked_hours'][0][:2], [12, 12])
+
+        response = self.get(start_date='2018-01-03', end_date='2018-02-02', granularity='month')
+        self.assertEqual(response.data['periods'], ['2018-01-03', '2018-02-01'])
+        self.assertEqual(response.data['booked_hours'], [[24, 0]])
+
+    def test_closed_days_cached(self):
+        task = self.make_task(datetime.datetime(2018, 1, 2, 8), 2)
+        self.get()
+
+        # only the rows once the days are cached
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get().data['booked_hours'], [[0, 2, 0]])
+
+        task.start_time = datetime.datetime(2018, 1, 3, 8)
+        task.end_time = datetime.datetime(2018, 1, 3, 9)
+        task.save()
+        self.assertEqual(self.get().data['booked_hours'], [[0, 0, 1]])
+
+    def test_invalid(self):
+        self.assertEqual(self.get(end_date='2017-01-01').status_code, 400)
+        self.assertEqual(self.get(resource='operator').status_code, 400)
+        self.client.force_authenticate(make_staff('driver', is_driver=True))
+        self.assertEqual(self.get().status_code, 403)
+
+
+
+@shared_cache
+class RolesTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.operator = make_staff('operator', is_operator=True, is_staff=True)
+        self.operator.user_permissions.add(*Permission.objects.filter(codename='change_task'))
+
+    def request(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return request
+
+    def test_once_per_request(self):
+        request = self.request(User.objects.get(pk=self.operator.pk))
+        with self.assertNumQueries(1):
+            roles = get_roles(request)
+            self.assertIs(get_roles(request), roles)
+        self.assertEqual(roles.mask, OPERATOR)
+        self.assertEqual(roles.staff_id, self.operator.pk)
+
+        # superusers need no profile until it is asked for
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        with self.assertNumQueries(0):
+            roles = get_roles(self.request(admin))
+        self.assertEqual(roles.mask, SUPERUSER)
+        with self.assertNumQueries(1):
+            self.assertIsNone(roles.staff_id)
+            self.assertIsNone(roles.staff)
+        # the profile itself is the user
+        staff = make_staff('driver', is_driver=True, is_admin=True)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_roles(self.request(staff)).mask, ADMIN | DRIVER)
+
+    def test_admin_change_view(self):
+        task = Task.objects.create(start_time=datetime.datetime(2018, 1, 1, 8),
+                                   end_time=datetime.datetime(2018, 1, 1, 9),
+                                   start_addr='a', end_addr='b')
+        task.operator.add(self.operator)
+
+        # Staff.save() takes no arguments, log in as the parent user
+        self.client.force_login(User.objects.get(pk=self.operator.pk))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/main/task/%d/change/' % task.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('operator', response.context['adminform'].readonly_fields)
+
+        profile = [query for query in queries if query['sql'].startswith('SELECT') and
+                   'FROM "main_staff"' in query['sql'] and '"main_staff"."user_ptr_id" = %d' % self.operator.pk in query['sql']]
+        operates = [query for query in queries if 'FROM "main_task_operator"' in query['sql'] and
+                    '"main_task_operator"."staff_id" = %d' % self.operator.pk in query['sql']]
+        self.assertEqual((len(profile), len(operates)), (1, 1))
+
+    @override_settings(ROLES_SESSION_CACHE=True)
+    def test_session_cache(self):
+        # Staff.save() takes no arguments, log in as the parent user
+        self.client.force_login(User.objects.get(pk=self.operator.pk))
+        self.client.get('/tasks/mine/')
+        with self.assertNumQueries(3):
+            # session, user, slots; the roles come with the session
+            self.assertEqual(self.client.get('/tasks/mine/').status_code, 200)
+
+        self.operator.is_operator = False
+        self.operator.save()
+        self.client.get('/tasks/mine/')
+        self.assertEqual(self.client.session['_roles'][1], 0)
+
+
+
+class ProvisioningTest(APITestCase):
+
+    def main_permissions(self):
+        return set(Permission.objects.filter(content_type__app_label='main').values_list('pk', flat=True))
+
+    def user_permissions(self, user):
+        return set(user.user_permissions.values_list('pk', flat=True))
+
+    def test_signup(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/staffs/regist/', {
+                'username': 'new', 'password1': 'a-long-secret', 'password2': 'a-long-secret',
+                'full_name': 'New', 'phone': '123', 'code': Setting.objects.get().verifycode})
+        self.assertEqual(response.status_code, 200)
+
+        inserts = [query for query in queries
+                   if query['sql'].startswith('INSERT INTO "auth_user_user_permissions"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(self.user_permissions(Staff.objects.get(username='new')), self.main_permissions())
+
+    def test_command(self):
+        group = BaseGroup.objects.create(name='drivers', type_name='staff')
+        member, other = make_staff('member'), make_staff('other')
+        member.group.add(group)
+        member.user_permissions.add(Permission.objects.get(codename='add_user'))
+
+        call_command('assign_roles', 'staff', '--group', 'drivers', '--replace', stdout=io.StringIO())
+        self.assertEqual(self.user_permissions(member), self.main_permissions())
+        self.assertEqual(self.user_permissions(other), set())
+
+        call_command('assign_roles', 'staff', '--all', stdout=io.StringIO())
+        self.assertEqual(self.user_permissions(other), self.main_permissions())
+
+
+
+@shared_cache
+class TokenCacheTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.staff = make_staff('staff', is_driver=True)
+        application = Application.objects.create(
+            name='app', user=self.staff, client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_PASSWORD)
+        self.token = AccessToken.objects.create(
+            user=self.staff, application=application, token='secret', scope='read',
+            expires=datetime.datetime.now() + datetime.timedelta(days=1))
+
+    def get(self, token='secret'):
+        return self.client.get('/tasks/mine/', HTTP_AUTHORIZATION='Bearer %s' % token)
+
+    def test_cached(self):
+        self.assertEqual(self.get().status_code, 200)
+        # staff profile and slots; no token or user
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get().status_code, 200)
+
+        self.assertEqual(self.get('wrong').status_code, 401)
+        stats = token_cache.stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['misses']), (1, 1, 2))
+
+    def test_revoked(self):
+        self.get()
+        self.token.delete()
+        self.assertEqual(self.get().status_code, 401)
+        self.assertEqual(token_cache.stats()['revocations'], 1)
+
+    def test_stats(self):
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        self.assertEqual(self.client.get('/auth/token-cache/').data['size'], 0)
+
+
+
+class SignedTokenTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.staff = make_staff('driver', is_driver=True)
+        self.staff.set_password('secret')
+        self.staff.save()
+
+    def issue(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Basic %s' % base64.b64encode(b'driver:secret').decode())
+        response = self.client.post('/auth/token/')
+        self.client.credentials()
+        return response.data['token']
+
+    def get(self, token):
+        return self.client.get('/tasks/mine/', HTTP_AUTHORIZATION='Signed %s' % token)
+
+    def test_no_queries(self):
+        token = self.issue()
+        self.assertEqual(self.get(token).status_code, 200)
+        # the slots only; the token version stays in the cache
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(token).status_code, 200)
+
+        self.assertEqual(self.get(token[:-1] + 'x').status_code, 401)
+
+    def test_revoke(self):
+        token = self.issue()
+        response = self.client.post('/auth/token/revoke/', HTTP_AUTHORIZATION='Signed %s' % token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(token).status_code, 401)
+        # refreshing takes no authentication, so no 401
+        self.assertEqual(self.client.post('/auth/token/refresh/', {'token': token}).status_code, 403)
+
+    def test_roles_changed(self):
+        token = self.issue()
+        self.assertEqual(self.get(token).status_code, 200)
+
+        # other saves leave the tokens alone
+        self.staff.full_name = 'renamed'
+        self.staff.save()
+        User.objects.get(pk=self.staff.pk).save(update_fields=['last_login'])
+        self.assertEqual(self.get(token).status_code, 200)
+
+        self.staff.is_driver = False
+        self.staff.save()
+        self.assertEqual(self.get(token).status_code, 401)
+        # the instance knows its new version, saving it revokes nothing back
+        self.staff.save()
+        self.assertEqual(self.get(token).status_code, 401)
+
+        token = self.issue()
+        user = User.objects.get(pk=self.staff.pk)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.get(token).status_code, 401)
+
+    def test_token_user(self):
+        # read from the user row, not taken for granted
+        self.assertTrue(TokenUser(self.staff.pk, DRIVER).is_active)
+        User.objects.filter(pk=self.staff.pk).update(is_active=False)
+        self.assertFalse(TokenUser(self.staff.pk, DRIVER).is_active)
+
+    def test_refresh(self):
+        with self.settings(SIGNED_TOKEN=dict(settings.SIGNED_TOKEN, MAX_AGE=-10, REFRESH_GRACE=60)):
+            token = self.issue()
+            self.assertEqual(self.get(token).status_code, 401)
+
+        response = self.client.post('/auth/token/refresh/', {'token': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(response.data['token']).status_code, 200)
+
+        # past the grace period
+        with self.settings(SIGNED_TOKEN=dict(settings.SIGNED_TOKEN, MAX_AGE=-120, REFRESH_GRACE=60)):
+            token = self.issue()
+            response = self.client.post('/auth/token/refresh/', {'token': token})
+        self.assertEqual(response.status_code, 403)
+
+
+
+class ImageVariantsTest(APITestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media_settings = override_settings(MEDIA_ROOT=self.media, IMAGE_VARIANTS={'WORKERS': 1, 'ASYNC': False})
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def make_photo(self):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (2000, 1000), 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile('car.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def open(self, name):
+        return PILImage.open(os.path.join(self.media, name))
+
+    def test_variants(self):
+        vehicle = make_vehicle('P1')
+        vehicle.photo = self.make_photo()
+        vehicle.save()
+
+        vehicle.refresh_from_db()
+        variants = read_variants(vehicle.photo_variants)
+        self.assertEqual(variants['source'], vehicle.photo.name)
+        with self.open(variants['thumbnail']) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('JPEG', (160, 80)))
+        with self.open(variants['webp']) as webp:
+            self.assertEqual((webp.format, webp.size), ('WEBP', (1600, 800)))
+
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        urls = self.client.get('/vehicles/%d/' % vehicle.pk).data['photo_variants']
+        self.assertEqual(sorted(urls), ['medium', 'thumbnail', 'webp'])
+        self.assertTrue(urls['medium'].startswith('http://testserver/media/variants/photos/'))
+
+    def test_backfill(self):
+        vehicle = make_vehicle('P1')
+        vehicle.photo = self.make_photo()
+        vehicle.save()
+        Vehicle.objects.update(photo_variants='')
+
+        call_command('generate_image_variants', '--workers', '1', stdout=io.StringIO())
+        vehicle.refresh_from_db()
+        self.assertEqual(read_variants(vehicle.photo_variants)['source'], vehicle.photo.name)
+
+
+
+class MediaTest(APITestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media_settings = override_settings(MEDIA_ROOT=self.media)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        for path in ['photos/a.txt', 'images/scan.txt', 'variants/photos/a_thumbnail_0f00.txt',
+                     'variants/images/scan_thumbnail_0f00.txt']:
+            os.makedirs(os.path.join(self.media, os.path.dirname(path)), exist_ok=True)
+            with open(os.path.join(self.media, path), 'wb') as file:
+                file.write(b'0123456789')
+
+    def get(self, path, **headers):
+        response = self.client.get('/media/' + path, **headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, content
+
+    def test_file(self):
+        response, content = self.get('photos/a.txt')
+        self.assertEqual((response.status_code, content), (200, b'0123456789'))
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600, must-revalidate')
+
+        response, content = self.get('photos/a.txt', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, content), (304, b''))
+
+        response, content = self.get('variants/photos/a_thumbnail_0f00.txt')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        self.assertEqual(self.get('photos/b.txt')[0].status_code, 404)
+        self.assertEqual(self.get('../manage.py')[0].status_code, 404)
+
+    def test_range(self):
+        response, content = self.get('photos/a.txt', HTTP_RANGE='bytes=2-5')
+        self.assertEqual((response.status_code, content), (206, b'2345'))
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+
+        self.assertEqual(self.get('photos/a.txt', HTTP_RANGE='bytes=7-')[1], b'789')
+        self.assertEqual(self.get('photos/a.txt', HTTP_RANGE='bytes=-3')[1], b'789')
+
+        response, content = self.get('photos/a.txt', HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+        # the file changed since the client got the first part
+        response, content = self.get('photos/a.txt', HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"old"')
+        self.assertEqual((response.status_code, content), (200, b'0123456789'))
+
+    def test_private(self):
+        self.assertEqual(self.get('images/scan.txt')[0].status_code, 401)
+
+        self.client.force_authenticate(make_staff('driver'))
+        response, content = self.get('images/scan.txt')
+        self.assertEqual((response.status_code, content), (200, b'0123456789'))
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+        # the variants of private images stay out of shared caches too
+        response, content = self.get('variants/images/scan_thumbnail_0f00.txt')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+        self.client.force_authenticate(None)
+        self.assertEqual(self.get('variants/images/scan_thumbnail_0f00.txt')[0].status_code, 401)
+
+    def test_offload(self):
+        delivery = dict(settings.MEDIA_DELIVERY, OFFLOAD='x-accel-redirect')
+        with override_settings(MEDIA_DELIVERY=delivery):
+            response, content = self.get('photos/a.txt')
+        self.assertEqual((response.status_code, content), (200, b''))
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/photos/a.txt')
+        self.assertIn('ETag', response)
+
+
+
+class UploadTest(APITestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        self.chunks = os.path.join(self.media, 'chunks')
+        upload_settings = override_settings(
+            MEDIA_ROOT=self.media, CHUNKED_UPLOADS=dict(settings.CHUNKED_UPLOADS, DIR=self.chunks))
+        upload_settings.enable()
+        self.addCleanup(upload_settings.disable)
+
+        self.driver = make_staff('driver', is_driver=True)
+        self.other = make_staff('other', is_driver=True)
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (100, 50), 'blue').save(buffer, 'PNG')
+        self.data = buffer.getvalue()
+
+    def start(self, url, **data):
+        data.update(filename='me.png', size=len(self.data),
+                    checksum=data.get('checksum') or hashlib.sha256(self.data).hexdigest())
+        return self.client.post(url, data, format='json')
+
+    def put(self, upload, offset, data):
+        return self.client.put('/uploads/%s/chunk/?offset=%d' % (upload, offset), data,
+                               content_type='application/octet-stream')
+
+    def test_photo(self):
+        self.client.force_authenticate(self.driver)
+        response = self.start('/staffs/%d/upload_photo/' % self.driver.pk)
+        self.assertEqual(response.status_code, 201)
+        upload = response.data['id']
+
+        self.assertEqual(self.put(upload, 0, self.data[:100]).data, {'offset': 100})
+        # a chunk the server already has, or one past a gap
+        self.assertEqual(self.put(upload, 0, self.data[:100]).status_code, 409)
+        self.assertEqual(self.put(upload, 150, self.data[150:]).status_code, 409)
+
+        # the client dropped, and asks where to go on from
+        self.assertEqual(self.client.get('/uploads/%s/' % upload).data['offset'], 100)
+        self.assertEqual(self.client.post('/uploads/%s/finalize/' % upload).status_code, 400)
+
+        self.assertEqual(self.put(upload, 100, self.data[100:]).data, {'offset': len(self.data)})
+        response = self.client.post('/uploads/%s/finalize/' % upload)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['url'].startswith('http://testserver/media/photos/me'))
+
+        photo = Staff.objects.get(pk=self.driver.pk).photo
+        with open(os.path.join(self.media, photo.name), 'rb') as file:
+            self.assertEqual(file.read(), self.data)
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(os.listdir(self.chunks), [])
+
+    def test_access(self):
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.start('/uploads/', target='staff.photo', object_id=self.driver.pk).status_code, 403)
+        self.assertEqual(self.start('/uploads/', target='vehicle.photo', object_id=1).status_code, 400)
+
+        start = datetime.datetime(2018, 1, 1, 8)
+        task = Task.objects.create(
+            start_time=start, end_time=start + datetime.timedelta(hours=1),
+            start_addr='a', end_addr='b', driver=self.driver)
+        self.assertEqual(self.start('/uploads/', target='task.image', object_id=task.pk).status_code, 403)
+
+        self.client.force_authenticate(self.driver)
+        upload = self.start('/uploads/', target='task.image', object_id=task.pk).data['id']
+        self.put(upload, 0, self.data)
+        self.assertEqual(self.client.post('/uploads/%s/finalize/' % upload).status_code, 200)
+        self.assertEqual(Image.objects.get().content_object, task)
+
+        # only the owner sees an upload
+        upload = self.start('/uploads/', target='staff.image', object_id=self.driver.pk).data['id']
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get('/uploads/%s/' % upload).status_code, 404)
+
+    def test_checksum(self):
+        self.client.force_authenticate(self.driver)
+        upload = self.start('/uploads/', target='staff.photo', object_id=self.driver.pk,
+                            checksum='0' * 64).data['id']
+        self.assertEqual(self.put(upload, 0, self.data + b'x').status_code, 400)
+        self.put(upload, 0, self.data)
+
+        self.assertEqual(self.client.post('/uploads/%s/finalize/' % upload).status_code, 400)
+        # the bytes were dropped, the upload starts over
+        self.assertEqual(Upload.objects.get().offset, 0)
+        self.assertFalse(Staff.objects.get(pk=self.driver.pk).photo)
+
+    def test_clear(self):
+        self.client.force_authenticate(self.driver)
+        upload = self.start('/uploads/', target='staff.photo', object_id=self.driver.pk).data['id']
+        self.put(upload, 0, self.data[:100])
+        Upload.objects.update(created_at=datetime.datetime(2018, 1, 1))
+
+        call_command('clear_uploads', stdout=io.StringIO())
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(os.listdir(self.chunks), [])
+
+
+
+class AdminHighVolumeTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        vehicles = [make_vehicle('P%d' % i) for i in range(3)]
+        drivers = [make_staff('driver%d' % i, is_driver=True) for i in range(3)]
+        start = datetime.datetime(2018, 1, 1, 8)
+        for i in range(30):
+            Task.objects.create(
+                start_time=start + datetime.timedelta(days=i), end_time=start + datetime.timedelta(days=i, hours=1),
+                start_addr='a', end_addr='b', vehicle=vehicles[i % 3], driver=drivers[i % 3])
+
+    def test_changelist(self):
+        self.assertEqual(self.client.get('/admin/main/task/').status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/main/task/')
+        cl = response.context['cl']
+        self.assertEqual(cl.result_count, 30)
+        self.assertIsNone(cl.full_result_count)
+
+        sql = [query['sql'] for query in queries]
+        # vehicles and drivers come with the tasks, not one query per row
+        self.assertFalse([query for query in sql if 'WHERE "main_vehicle"."id" =' in query or
+                          'WHERE "main_staff"."user_ptr_id" =' in query])
+        # the count and the date hierarchy come from the cache
+        self.assertFalse([query for query in sql if 'COUNT(' in query or 'DISTINCT' in query])
+
+        self.assertEqual(len(set(id(task.changelist_now) for task in cl.result_list)), 1)
+        self.assertEqual(len(self.client.get('/admin/main/task/?start_time__year=2018').context['cl'].result_list), 30)
+
+    def test_stale_count(self):
+        from custom.admin import TaskAdmin
+
+        with mock.patch.object(TaskAdmin, 'list_per_page', 20):
+            self.assertEqual(self.client.get('/admin/main/task/').context['cl'].result_count, 30)
+
+            # the cached count is 30, the page still holds no more than
+            # 20 rows and the ones past the count are reachable
+            start = datetime.datetime(2018, 3, 1, 8)
+            Task.objects.bulk_create([Task(
+                start_time=start, end_time=start + datetime.timedelta(hours=1),
+                start_addr='a', end_addr='b') for i in range(25)])
+            cl = self.client.get('/admin/main/task/').context['cl']
+            self.assertEqual(len(cl.result_list), 20)
+            self.assertTrue(cl.multi_page)
+            cl = self.client.get('/admin/main/task/?p=2').context['cl']
+            self.assertEqual(len(cl.result_list), 15)
+            self.assertEqual(cl.paginator.num_pages, 3)
+
+        with mock.patch.object(TaskAdmin, 'list_per_page', 40):
+            # a count below a page does not render the whole table
+            cl = self.client.get('/admin/main/task/').context['cl']
+            self.assertEqual(len(cl.result_list), 40)
+            self.assertTrue(cl.multi_page)
+
+            # nor one past the rows left
+            Task.objects.filter(start_time__gte=start).delete()
+            self.assertEqual(self.client.get('/admin/main/task/?p=1').status_code, 302)
+
+
+class EventsTest(APITransactionTestCase):
+
+    def setUp(self):
+        self.driver = make_staff('driver', is_driver=True)
+        self.other = make_staff('other', is_driver=True)
+        self.hub = Hub(LocalBackend())
+        patcher = mock.patch('main.events._hub', self.hub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_task(self, driver):
+        start = datetime.datetime(2018, 1, 1, 8)
+        return Task.objects.create(start_time=start, end_time=start + datetime.timedelta(hours=1),
+                                   start_addr='a', end_addr='b', driver=driver)
+
+    def test_per_user(self):
+        task = self.make_task(self.driver)
+        task.driver = self.other
+        task.save()
+        Task.objects.create(start_time=task.start_time, end_time=task.end_time,
+                            start_addr='a', end_addr='b')
+
+        seen = list(self.hub.listen(task_filter(self.driver.pk), last_id=0, seconds=0.1))
+        self.assertEqual([event[1] for event in seen if event], [
+            {'task': task.pk, 'action': 'created'}, {'task': task.pk, 'action': 'removed'}])
+
+    def test_stream(self):
+        task = self.make_task(self.driver)
+        self.client.force_authenticate(self.driver)
+
+        with mock.patch.object(TaskViewSet, 'event_stream_seconds', 0.1):
+            response = self.client.get('/tasks/events/', HTTP_ACCEPT='text/event-stream',
+                                       HTTP_LAST_EVENT_ID='0')
+            body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('event: task\ndata: {"task": %d, "action": "created"}' % task.pk, body)
+
+    def test_publish_failed(self):
+        # the task is saved by then, a backend failing must not undo that
+        with mock.patch.object(self.hub, 'publish_many', side_effect=sqlite3.OperationalError('database is locked')), \
+                self.assertLogs('django', 'ERROR'):
+            task = self.make_task(self.driver)
+        self.assertTrue(Task.objects.filter(pk=task.pk).exists())
+
+    def test_sqlite_workers(self):
+        with tempfile.TemporaryDirectory() as path:
+            path = os.path.join(path, 'events.sqlite3')
+            publisher, listener = Hub(SQLiteBackend(path)), Hub(SQLiteBackend(path, interval=0.01))
+            publisher.publish_many([{'task': 1, 'action': 'updated', 'staff': {'7': 'updated'}},
+                                    {'task': 2, 'action': 'created', 'staff': {}}])
+            seen = list(listener.listen(task_filter(None), last_id=0, seconds=0.1))
+            self.assertEqual(seen[:2], [(1, {'task': 1, 'action': 'updated'}),
+                                        (2, {'task': 2, 'action': 'created'})])
+
+
+class TaskKeysTest(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_authenticate(self.admin)
+        self.vehicle = make_vehicle('P1')
+        self.driver = make_staff('driver', is_driver=True)
+
+    def test_names_in_the_api(self):
+        response = self.client.post('/tasks/', {
+            'start_time': '2018-01-01 08:00', 'end_time': '2018-01-01 09:00',
+            'start_addr': 'a', 'end_addr': 'b', 'vehicle': 'P1', 'driver': 'driver'})
+        self.assertEqual(response.status_code, 201, response.data)
+
+        task = Task.objects.get()
+        self.assertEqual((task.vehicle_id, task.driver_id), (self.vehicle.pk, self.driver.pk))
+
+        response = self.client.get('/tasks/', {'driver': 'driver'})
+        self.assertEqual([(t['vehicle'], t['driver']) for t in response.data['results']], [('P1', 'driver')])
+        self.assertEqual(self.client.get('/tasks/', {'driver': 'nobody'}).data['results'], [])
+
+    def test_rename(self):
+        Task.objects.create(start_time=datetime.datetime(2018, 1, 1, 8), end_time=datetime.datetime(2018, 1, 1, 9),
+                            start_addr='a', end_addr='b', driver=self.driver)
+        self.driver.full_name = 'renamed'
+        self.driver.save()
+        self.assertEqual(Task.objects.get().driver.full_name, 'renamed')
@@ -0,0 +1,192 @@
+import datetime
+import hashlib
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.http.request import UnreadablePostError
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework import exceptions, status
+
+
+BLOCK_SIZE = 64 * 1024
+
+# target: (model, image field, or None for a new Image row)
+TARGETS = {
+    'staff.photo': ('main.staff', 'photo'),
+    'vehicle.photo': ('main.vehicle', 'photo'),
+    'staff.image': ('main.staff', None),
+    'vehicle.image': ('main.vehicle', None),
+    'task.image': ('main.task', None),
+}
+
+
+class OffsetMismatch(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The chunk does not start where the upload stands.'
+    default_code = 'offset_mismatch'
+
+
+class UploadedFile(File):
+    """
+    The finished upload on disk; storages that see
+    ``temporary_file_path`` move the file instead of copying it.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def chunk_path(upload):
+    return os.path.join(settings.CHUNKED_UPLOADS['DIR'], '%s.part' % upload.pk)
+
+
+def get_target(target, object_id):
+    model = TARGETS[target][0]
+    return apps.get_model(model).objects.filter(pk=object_id).first()
+
+
+def may_upload(roles, target, instance):
+    """
+    Staff admins upload anything, staff their own photo and images, and
+    the crew of a task its images.
+    """
+    if roles.is_staff_admin:
+        return True
+    if target.startswith('staff.'):
+        return instance.pk == roles.staff_id
+    if target == 'task.image':
+        return roles.staff_id in (instance.driver_id, instance.tourguide_id) or roles.operates(instance)
+    return False
+
+
+def write_chunk(upload, offset, stream):
+    """
+    Append ``stream`` to ``upload`` block by block if it starts at
+    ``offset``, and return the new offset.
+
+    What arrived before the client dropped is kept, so it can ask where
+    the upload stands and go on from there.
+    """
+    from .models import Upload
+
+    if offset != upload.offset:
+        raise OffsetMismatch()
+
+    os.makedirs(settings.CHUNKED_UPLOADS['DIR'], exist_ok=True)
+    path = chunk_path(upload)
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as file:
+        # drops the rest of a chunk that was never recorded
+        file.seek(offset)
+        file.truncate()
+        try:
+            while True:
+                block = stream.read(BLOCK_SIZE)
+                if not block:
+                    break
+                if file.tell() + len(block) > upload.size:
+                    file.seek(offset)
+                    file.truncate()
+                    raise exceptions.ValidationError('The chunk goes past the size of the upload.')
+                file.write(block)
+        except UnreadablePostError:
+            pass
+        end = file.tell()
+
+    Upload.objects.filter(pk=upload.pk, offset=offset).update(offset=end)
+    upload.offset = end
+    return end
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finalize(upload):
+    """
+    Check the size, checksum and image of ``upload`` and move it into
+    place, as the photo of its target or a new ``Image`` of it.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from .models import Image
+
+    path = chunk_path(upload)
+    if upload.offset != upload.size or not os.path.exists(path):
+        raise exceptions.ValidationError(
+            'Only %d of %d bytes were uploaded.' % (upload.offset, upload.size))
+
+    if sha256(path) != upload.checksum.lower():
+        # start over, the bytes on disk are not the file
+        discard(upload, delete=False)
+        raise exceptions.ValidationError('The checksum does not match, upload the file again.')
+    try:
+        with PILImage.open(path) as image:
+            image.verify()
+    except Exception:
+        discard(upload)
+        raise exceptions.ValidationError('The file is not an image.')
+
+    instance = get_target(upload.target, upload.object_id)
+    if instance is None:
+        discard(upload)
+        raise exceptions.NotFound()
+
+    field = TARGETS[upload.target][1]
+    with open(path, 'rb') as file:
+        if field is not None:
+            getattr(instance, field).save(upload.filename, UploadedFile(file), save=False)
+            instance.save()
+        else:
+            instance = Image(
+                content_type=ContentType.objects.get_for_model(instance), object_id=instance.pk)
+            instance.image.save(upload.filename, UploadedFile(file), save=True)
+
+    discard(upload)
+    return instance
+
+
+def discard(upload, delete=True):
+    # delete=False keeps the upload but from the start
+    from .models import Upload
+
+    try:
+        os.remove(chunk_path(upload))
+    except FileNotFoundError:
+        pass
+    if delete:
+        upload.delete()
+    else:
+        Upload.objects.filter(pk=upload.pk).update(offset=0)
+        upload.offset = 0
+
+
+def clear_expired():
+    """
+    Drop the uploads older than ``CHUNKED_UPLOADS['EXPIRES']`` seconds,
+    and chunk files as old that no upload knows of. Returns how many
+    uploads.
+    """
+    from .models import Upload
+
+    expires = settings.CHUNKED_UPLOADS['EXPIRES']
+    expired = list(Upload.objects.filter(
+        created_at__lt=timezone.now() - datetime.timedelta(seconds=expires)))
+    for upload in expired:
+        discard(upload)
+
+    directory = settings.CHUNKED_UPLOADS['DIR']
+    if os.path.isdir(directory):
+        known = set(str(pk) for pk in Upload.objects.values_list('pk', flat=True))
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.part') and name[:-len('.part')] not in known and \
+                    os.path.getmtime(path) < time.time() - expires:
+                os.remove(path)
+    return len(expired)
@@ -2,7 +2,8 @@ from django.conf.urls import url, include
 from rest_framework.routers import DefaultRouter
 
 from .views import (StaffViewSet, TaskViewSet, VehicleViewSet,
-                    GroupViewSet, DLIViewSet, TLIViewSet, PPIViewSet,StaffSigup)
+                    GroupViewSet, DLIViewSet, TLIViewSet, PPIViewSet, UploadViewSet, StaffSigup,
+                    TokenCacheStats, SignedTokenView, SignedTokenRefresh, SignedTokenRevoke)
 
 router = DefaultRouter()
 router.register(r'staffs', StaffViewSet, base_name='staff')
@@ -12,7 +13,12 @@ router.register(r'groups', GroupViewSet, base_name='group')
 router.register(r'dlis', DLIViewSet, base_name='DLI')
 router.register(r'tlis', TLIViewSet, base_name='TLI')
 router.register(r'ppis', PPIViewSet, base_name='PPI')
+router.register(r'uploads', UploadViewSet, base_name='upload')
 
 urlpatterns = [
     url(r'staffs/regist/', StaffSigup.as_view()),
+    url(r'auth/token-cache/', TokenCacheStats.as_view()),
+    url(r'^auth/token/$', SignedTokenView.as_view()),
+    url(r'^auth/token/refresh/$', SignedTokenRefresh.as_view()),
+    url(r'^auth/token/revoke/$', SignedTokenRevoke.as_view()),
 ] + router.urls
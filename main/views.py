@@ -1,126 +1,552 @@
+import csv
+import json
+
+from django.conf import settings
 from django.shortcuts import render
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.db import connection
 
-from rest_framework import viewsets, generics, views
+from rest_framework import viewsets, generics, views, serializers, mixins
 from rest_framework.response import Response
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied, ValidationError
 from rest_framework.pagination import PageNumberPagination
 from rest_framework_extensions.mixins import DetailSerializerMixin
 from rest_framework.filters import OrderingFilter
 from rest_framework.decorators import list_route, api_view, detail_route
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .permissions import (IsStaffSelf, IsStaffAdmin, IsAuthenticated, AllowAny, IsAdminOrIsSelf)
+from .permissions import (IsStaffSelf, IsStaffAdmin, IsAuthenticated, AllowAny)
 from .serializers import (
     DLISerializer, StaffSerializer, StaffDetailSerializer,
     VehicleSerializer, VehicleDetailSerializer, TaskSerializer,
     GroupSerializer, TLISerializer,
-    DLISerializer, PPISerializer)
-from .models import Staff, Vehicle, Task, BaseGroup, TLI, DLI, PPI
+    DLISerializer, PPISerializer, AutoAssignSerializer,
+    ScheduleSerializer, ScheduleWindowSerializer, BoardSerializer,
+    UtilizationSerializer, UploadSerializer)
+from .models import Staff, Vehicle, Task, BaseGroup, TLI, DLI, PPI, Upload
 from .forms import StaffCreationForm
-
-from rest_framework.renderers import JSONRenderer
+from .filters import TaskFilter
+from .dispatch import auto_assign
+from .imports import guess_format, import_tasks, read_rows
+from .pagination import TaskPagination
+from .exports import ExportMixin
+from .caching import ConditionalGetMixin, VersionedCacheMixin
+from .changes import Gone, changes_since, current_token
+from .scheduling import busy_slots
+from .board import occupancy
+from .analytics import utilization
+from .events import event_stream, get_hub, task_filter
+from .roles import get_roles
+from .media import is_private, serve
+from .uploads import TARGETS, discard, finalize, get_target, may_upload, write_chunk
+from .authentication import (
+    issue_signed_token, read_signed_token, revoke_signed_tokens, token_cache)
+
+from rest_framework.renderers import JSONRenderer, BaseRenderer
+from rest_framework.negotiation import BaseContentNegotiation
 
 class Utf8JSONRenderer(JSONRenderer):
     charset = 'utf-8'
 
+class EventStreamRenderer(BaseRenderer):
+    # lets clients ask for text/event-stream; only errors are rendered here
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode('utf-8')
+
 class BaseModelViewSet(viewsets.ModelViewSet, views.APIView):
 
     def get_permissions(self):
         if self.action == 'list':
             permission_classes = [IsStaffAdmin]
         else:
-            permission_classes = [IsAuthenticated]
+            # extra routes may ask for their own permissions
+            handler = getattr(self, self.action or '', None)
+            permission_classes = getattr(handler, 'kwargs', {}).get(
+                'permission_classes', [IsAuthenticated])
         return [permission() for permission in permission_classes]
 
 
-class StaffViewSet(DetailSerializerMixin, viewsets.ModelViewSet):
+class StaffViewSet(ConditionalGetMixin, VersionedCacheMixin, ExportMixin,
+                   DetailSerializerMixin, viewsets.ModelViewSet):
 
     queryset = Staff.objects.all()
+    queryset_detail = Staff.objects.select_related(
+        'DLI', 'TLI', 'PPI').prefetch_related('group', 'groups')
     serializer_class = StaffSerializer
     serializer_detail_class = StaffDetailSerializer
+    cache_models = (Staff, BaseGroup, DLI, TLI, PPI)
+    etag_models = cache_models
     filter_backends = (OrderingFilter, DjangoFilterBackend)
     filter_fields = ['id', 'full_name', 'phone', 'status',
                      'is_driver', 'is_tourguide', 'is_operator']
     search_fields = '__all__'
     ordering_fields = '__all__'
+    export_fields = {
+        'id': 'id',
+        'username': 'username',
+        'full_name': 'full_name',
+        'phone': 'phone',
+        'email': 'email',
+        'wechart_account': 'wechart_account',
+        'whatsup_account': 'whatsup_account',
+        'status': 'status',
+        'is_driver': 'is_driver',
+        'is_tourguide': 'is_tourguide',
+        'is_operator': 'is_operator',
+        'is_active': 'is_active',
+        'create_time': 'create_time',
+    }
+    export_many = {'group': 'group__name'}
 
     def get_permissions(self):
-        if self.action == 'list':
+        if self.action in ('list', 'export'):
             permission_classes = [IsStaffAdmin]
         else:
             permission_classes = [IsStaffSelf]
         return [permission() for permission in permission_classes]
 
-    @detail_route(methods=['post'], permission_classes=[IsAdminOrIsSelf])
-    def upload_photo(self,request, pk=None):
-        staff = request.user.staff
-        return Response('ok')
+    @detail_route(methods=['post'])
+    def upload_photo(self, request, pk=None):
+        # starts a chunked upload of the photo, see UploadViewSet
+        staff = self.get_object()
+        serializer = UploadSerializer(
+            data=dict(request.data.items(), target='staff.photo', object_id=staff.pk))
+        serializer.is_valid(raise_exception=True)
+        start_upload(request, serializer)
+        return Response(serializer.data, status=201)
 
 
-class VehicleViewSet(DetailSerializerMixin, BaseModelViewSet):
+class VehicleViewSet(ConditionalGetMixin, VersionedCacheMixin, ExportMixin,
+                     DetailSerializerMixin, BaseModelViewSet):
 
     queryset = Vehicle.objects.all()
+    queryset_detail = Vehicle.objects.prefetch_related('group')
     serializer_class = VehicleSerializer
     serializer_detail_class = VehicleDetailSerializer
+    cache_models = (Vehicle, BaseGroup)
+    etag_models = cache_models
     filter_backends = (OrderingFilter, DjangoFilterBackend)
     filter_fields = ['id', 'traffic_plate_no', 'model_name', 'model_year',
                      'num_of_pass', 'exp_date', 'policy_no', 'rate', 'status']
     search_fields = '__all__'
     ordering_fields = '__all__'
-
-class TaskViewSet(BaseModelViewSet):
-
-    queryset = Task.objects.all()
+    export_fields = {
+        'id': 'id',
+        'traffic_plate_no': 'traffic_plate_no',
+        'model_name': 'model_name',
+        'model_year': 'model_year',
+        'num_of_pass': 'num_of_pass',
+        'eng_no': 'eng_no',
+        'chassis_no': 'chassis_no',
+        'exp_date': 'exp_date',
+        'reg_date': 'reg_date',
+        'ins_exp': 'ins_exp',
+        'policy_no': 'policy_no',
+        'rate': 'rate',
+        'status': 'status',
+        'create_time': 'create_time',
+    }
+    export_many = {'group': 'group__name'}
+
+class TaskViewSet(ConditionalGetMixin, ExportMixin, BaseModelViewSet):
+
+    queryset = Task.objects.select_related(
+        'vehicle', 'driver', 'tourguide', 'author').prefetch_related('operator')
     serializer_class = TaskSerializer
+    pagination_class = TaskPagination
+    etag_related = ('vehicle', 'driver', 'tourguide', 'author', 'operator')
     filter_backends = (OrderingFilter, DjangoFilterBackend)
-    filter_fields = ['id', 'create_time', 'vehicle', 'driver', 'tourguide', 'start_addr', 'end_addr', ]
+    filter_class = TaskFilter
     search_fields = '__all__'
     ordering_fields = '__all__'
     renderer_classes = [Utf8JSONRenderer,]
-
-
-class GroupViewSet(BaseModelViewSet):
+    # the columns of a task import, so an export can be imported back
+    export_fields = {
+        'id': 'id',
+        'start_time': 'start_time',
+        'end_time': 'end_time',
+        'start_addr': 'start_addr',
+        'end_addr': 'end_addr',
+        'remake': 'remake',
+        'vehicle': 'vehicle__traffic_plate_no',
+        'driver': 'driver__full_name',
+        'tourguide': 'tourguide__full_name',
+        'author': 'author__full_name',
+        'create_time': 'create_time',
+    }
+    export_many = {'operator': 'operator__full_name'}
+    event_stream_seconds = 300
+    event_heartbeat_seconds = 15
+
+    def perform_create(self, serializer):
+        staff = get_roles(self.request).staff
+        if staff is not None:
+            serializer.save(author=staff)
+        else:
+            serializer.save()
+
+    @list_route(methods=['post'], permission_classes=[IsStaffAdmin])
+    def auto_assign(self, request):
+        params = AutoAssignSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+
+        tasks = Task.objects.filter(
+            start_time__gte=params.validated_data['start_time'],
+            start_time__lt=params.validated_data['end_time'])
+        result = auto_assign(
+            tasks,
+            resources=params.validated_data['resources'],
+            num_of_pass=params.validated_data.get('num_of_pass'))
+
+        return Response(result)
+
+    @list_route(methods=['post'], permission_classes=[IsStaffAdmin], url_path='import')
+    def bulk_import(self, request):
+        # a multipart 'file' or the raw CSV / NDJSON body
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'file': ['No file was submitted.']}, status=400)
+            stream, file_format = upload, guess_format(upload.name, upload.content_type)
+        else:
+            stream, file_format = request.stream, guess_format(content_type=request.content_type)
+
+        if stream is None:
+            return Response({'file': ['No file was submitted.']}, status=400)
+
+        author = get_roles(request).staff
+
+        try:
+            result = import_tasks(read_rows(stream, file_format), author=author,
+                                  dry_run=request.query_params.get('dry_run') in ('1', 'true'))
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            return Response({'file': [str(e)]}, status=400)
+
+        return Response(result, status=400 if result['errors'] and not result['created'] else 200)
+
+    def feed_staff(self, request):
+        # None for the admin-wide feed, else the caller's staff id
+        roles = get_roles(request)
+        if request.query_params.get('mine') not in ('1', 'true') and roles.is_staff_admin:
+            return None
+        if roles.staff_id is None:
+            raise PermissionDenied('Only staff have a task feed.')
+        return roles.staff_id
+
+    @list_route(methods=['get'], permission_classes=[IsAuthenticated])
+    def changes(self, request):
+        """
+        The tasks created, updated or deleted after ``?since=<token>``.
+
+        Admins get the whole feed unless they pass ``?mine=1``, everybody
+        else the tasks they drive, guide, operate or wrote. Without
+        ``since`` only the current token is returned; ``410`` means the
+        log was pruned and the client has to download its tasks again.
+        """
+        staff = self.feed_staff(request)
+
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({'token': str(current_token()), 'more': False, 'changed': [], 'deleted': []})
+
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({'since': ['Not a change token.']}, status=400)
+
+        try:
+            actions, token, more = changes_since(since, staff)
+        except Gone:
+            return Response({'since': ['Changes before this token were pruned.']}, status=410)
+
+        changed = [task_id for task_id, action in actions.items() if action in ('created', 'updated')]
+        tasks = {task.pk: task for task in self.get_queryset().filter(pk__in=changed)}
+        # a task updated here may have been deleted after the last entry read
+        deleted = [task_id for task_id in actions if task_id not in tasks]
+
+        return Response({
+            'token': str(token),
+            'more': more,
+            'changed': self.get_serializer([tasks[pk] for pk in changed if pk in tasks], many=True).data,
+            'deleted': deleted,
+        })
+
+    @list_route(methods=['get'], permission_classes=[IsAuthenticated],
+                renderer_classes=[EventStreamRenderer, Utf8JSONRenderer])
+    def events(self, request):
+        """
+        Server-Sent Events ``{"task": id, "action": ...}`` for the tasks
+        the caller is part of (all of them for admins, as in ``changes``).
+
+        The stream ends after ``event_stream_seconds`` and the client
+        reconnects with ``Last-Event-ID``, so a worker is never held
+        forever; then ``changes`` tells what to download.
+        """
+        last_id = request.META.get('HTTP_LAST_EVENT_ID')
+        try:
+            last_id = int(last_id) if last_id else None
+        except ValueError:
+            last_id = None
+
+        events = get_hub().listen(
+            task_filter(self.feed_staff(request)), last_id,
+            seconds=self.event_stream_seconds, heartbeat=self.event_heartbeat_seconds)
+        # the stream reads no more rows, do not hold a connection for it
+        if not connection.in_atomic_block:
+            connection.close()
+
+        response = StreamingHttpResponse(event_stream(events), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx would otherwise buffer the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @list_route(methods=['get'], permission_classes=[IsAuthenticated])
+    def mine(self, request):
+        """
+        The caller's tasks overlapping ``?start_time=&end_time=``, a week
+        from today by default, with the roles they hold in each.
+
+        The busy slots already are the union of the driver, tour guide
+        and operator relations, so one index range scan finds the tasks.
+        """
+        staff_id = get_roles(request).staff_id
+        if staff_id is None:
+            raise PermissionDenied('Only staff have a schedule.')
+
+        window = ScheduleWindowSerializer(data=request.query_params)
+        window.is_valid(raise_exception=True)
+
+        slots = busy_slots(
+            ['driver', 'tourguide', 'operator'],
+            window.validated_data['start_time'], window.validated_data['end_time'],
+        ).filter(resource_id=staff_id).values_list('task', 'resource_type')
+
+        roles = {}
+        for task_id, role in slots.order_by('resource_type'):
+            roles.setdefault(task_id, []).append(role)
+
+        tasks = Task.objects.filter(pk__in=roles).select_related(
+            'vehicle', 'driver', 'tourguide').order_by('start_time', 'pk')
+        return Response(ScheduleSerializer(tasks, many=True, context={'roles': roles}).data)
+
+    @list_route(methods=['get'], permission_classes=[IsStaffAdmin])
+    def board(self, request):
+        """
+        The dispatch board of ``?start_time=&end_time=``, optionally for
+        the members of ``?group=`` and some ``?resources=`` only, as the
+        columns described in ``main.board.occupancy``.
+        """
+        params = BoardSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+
+        return Response({
+            'start_time': serializers.DateTimeField().to_representation(data['start_time']),
+            'end_time': serializers.DateTimeField().to_representation(data['end_time']),
+            'resources': occupancy(data['start_time'], data['end_time'],
+                                   data['resources'], data['group']),
+        })
+
+    @list_route(methods=['get'], permission_classes=[IsStaffAdmin])
+    def utilization(self, request):
+        """
+        Booked against available hours of ``?resource=`` per
+        ``?granularity=`` between ``?start_date=`` and ``?end_date=``,
+        see ``main.analytics.utilization``.
+        """
+        params = UtilizationSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+
+        return Response(utilization(data['resource'], data['start_date'], data['end_date'],
+                                    data['granularity'], data['group']))
+
+
+class GroupViewSet(VersionedCacheMixin, BaseModelViewSet):
 
     queryset = BaseGroup.objects.all()
     serializer_class = GroupSerializer
+    cache_models = (BaseGroup,)
     filter_backends = (OrderingFilter, DjangoFilterBackend)
     filter_fields = '__all__'
     search_fields = '__all__'
     ordering_fields = '__all__'
 
 
-class DLIViewSet(BaseModelViewSet):
+class DLIViewSet(VersionedCacheMixin, BaseModelViewSet):
 
     queryset = DLI.objects.all()
     serializer_class = DLISerializer
+    cache_models = (DLI,)
     filter_backends = (OrderingFilter, DjangoFilterBackend)
     filter_fields = '__all__'
     search_fields = '__all__'
     ordering_fields = '__all__'
 
 
-class TLIViewSet(BaseModelViewSet):
+class TLIViewSet(VersionedCacheMixin, BaseModelViewSet):
 
     queryset = TLI.objects.all()
     serializer_class = TLISerializer
+    cache_models = (TLI,)
     filter_backends = (OrderingFilter, DjangoFilterBackend)
     filter_fields = '__all__'
     search_fields = '__all__'
     ordering_fields = '__all__'
 
 
-class PPIViewSet(BaseModelViewSet):
+class PPIViewSet(VersionedCacheMixin, BaseModelViewSet):
 
     queryset = PPI.objects.all()
     serializer_class = PPISerializer
+    cache_models = (PPI,)
     filter_backends = (OrderingFilter, DjangoFilterBackend)
     filter_fields = '__all__'
     search_fields = '__all__'
     ordering_fields = '__all__'
 
 
+def start_upload(request, serializer):
+    roles = get_roles(request)
+    data = serializer.validated_data
+    instance = get_target(data['target'], data['object_id'])
+    if instance is None:
+        raise ValidationError({'object_id': ['no such %s' % data['target'].split('.')[0]]})
+    if roles.staff_id is None:
+        raise PermissionDenied('Only staff can upload files.')
+    if not may_upload(roles, data['target'], instance):
+        raise PermissionDenied('You cannot upload files to this %s.' % data['target'].split('.')[0])
+    serializer.save(owner_id=roles.staff_id)
+
+
+class UploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                    mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable uploads of photos and images, see ``main.uploads``.
+
+    POST the target, size and checksum, PUT the bytes to
+    ``chunk/?offset=`` in as many pieces as needed, GET the upload to
+    learn where it stands after a drop, and POST ``finalize/`` at the end.
+    """
+    serializer_class = UploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        roles = get_roles(self.request)
+        if roles.is_staff_admin:
+            return Upload.objects.all()
+        return Upload.objects.filter(owner=roles.staff_id)
+
+    def perform_create(self, serializer):
+        start_upload(self.request, serializer)
+
+    def perform_destroy(self, instance):
+        discard(instance)
+
+    @detail_route(methods=['put'])
+    def chunk(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            offset = int(request.query_params['offset'])
+        except (KeyError, ValueError):
+            raise ValidationError({'offset': ['the offset of the chunk is required']})
+        # the body is read from the socket as it comes, never parsed
+        return Response({'offset': write_chunk(upload, offset, request._request)})
+
+    @detail_route(methods=['post'])
+    def finalize(self, request, pk=None):
+        upload = self.get_object()
+        instance = finalize(upload)
+        file = getattr(instance, TARGETS[upload.target][1] or 'image')
+        return Response({'target': upload.target, 'id': instance.pk,
+                         'url': request.build_absolute_uri(file.url)})
+
+
+class TokenCacheStats(views.APIView):
+    # the access token cache of the worker that answers
+    permission_classes = [IsStaffAdmin]
+
+    def get(self, request):
+        return Response(token_cache.stats())
+
+
+class SignedTokenView(views.APIView):
+    """
+    A signed token for the caller, who logs in once with any of the
+    other authentication methods.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        staff = get_roles(request).staff
+        if staff is None:
+            raise PermissionDenied('Only staff can get a signed token.')
+        return Response(issue_signed_token(staff))
+
+
+class SignedTokenRefresh(views.APIView):
+    """
+    A new token for ``token``, also up to ``SIGNED_TOKEN['REFRESH_GRACE']``
+    seconds after it expired, with the current roles of its staff.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        payload = read_signed_token(
+            str(request.data.get('token', '')), grace=settings.SIGNED_TOKEN['REFRESH_GRACE'])
+        staff = payload and Staff.objects.filter(
+            pk=payload['u'], token_version=payload['v'], is_active=True).first()
+        if not staff:
+            raise AuthenticationFailed('Invalid or expired token.')
+        return Response(issue_signed_token(staff))
+
+
+class SignedTokenRevoke(views.APIView):
+    # signs the caller out of every device
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        staff_id = get_roles(request).staff_id
+        if staff_id is None:
+            raise PermissionDenied('Only staff have signed tokens.')
+        revoke_signed_tokens(staff_id)
+        return Response('ok')
+
+
+class IgnoreAcceptNegotiation(BaseContentNegotiation):
+    # files are sent as they are, errors as JSON, whatever was asked for
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class MediaView(views.APIView):
+    """
+    The files under ``MEDIA_URL``, see ``main.media``. Files under the
+    ``MEDIA_DELIVERY['PRIVATE']`` prefixes are for signed in users only.
+    """
+    content_negotiation_class = IgnoreAcceptNegotiation
+
+    def get_permissions(self):
+        if is_private(self.kwargs['path']):
+            return [IsAuthenticated()]
+        return [AllowAny()]
+
+    def get(self, request, path):
+        return serve(request, path)
+
+
 class StaffSigup(views.APIView):
 
     permission_classes = [AllowAny]